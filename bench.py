@@ -0,0 +1,299 @@
+import argparse
+import inspect
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from importlib import import_module
+
+import numpy as np
+import torch
+import torch.nn as nn
+from PIL import Image
+from torch.utils.data.dataloader import default_collate
+
+from dataset import open_image, is_image_file # dataset.py
+from loss import create_criterion, _criterion_entrypoints # loss.py
+
+
+def reset_peak_rss():
+    '''
+    Linux 에서는 /proc/self/clear_refs 에 5 를 써서 peak RSS(VmHWM)를 현재 RSS 로 초기화합니다.
+    '''
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    '''
+    component 실행 중 최대 RSS (MB). /proc 이 없으면 process 전체 최대값(ru_maxrss)을 사용합니다.
+    '''
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(fn, batch_size, steps, warmup):
+    '''
+    fn 한 번을 batch_size 장을 처리하는 1 step 으로 보고 ms/step, images/s, peak RSS 를 측정합니다.
+    '''
+    for _ in range(warmup):
+        fn()
+    reset_peak_rss()
+    start = time.perf_counter()
+    for _ in range(steps):
+        fn()
+    elapsed = time.perf_counter() - start
+    return {
+        'ms_per_step': elapsed / steps * 1000,
+        'images_per_s': batch_size * steps / elapsed,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def sample_images(data_dir, num_images, size=(384, 512)):
+    '''
+    data_dir 이 있으면 실제 이미지 경로를, 없으면 size(W, H) 크기의 synthetic jpeg 를 만들어 경로를 반환합니다.
+    '''
+    if data_dir and os.path.isdir(data_dir):
+        paths = []
+        for root, _, file_names in os.walk(data_dir):
+            paths += [os.path.join(root, f) for f in sorted(file_names) if is_image_file(f) and not f.startswith('.')]
+            if len(paths) >= num_images:
+                break
+        if paths:
+            return paths[:num_images]
+    tmp_dir = tempfile.mkdtemp(prefix='bench_')
+    rng = np.random.RandomState(0)
+    paths = []
+    for i in range(num_images):
+        # 완전한 noise 보다 실제 사진에 가까운 압축률이 나오도록 저해상도 noise 를 확대
+        small = rng.randint(0, 255, (size[1] // 16, size[0] // 16, 3), dtype=np.uint8)
+        path = os.path.join(tmp_dir, f'{i}.jpg')
+        Image.fromarray(small).resize(size, Image.BILINEAR).save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def bench_decode(paths, batch_sizes, steps, warmup):
+    results = []
+    for batch_size in batch_sizes:
+        batch = [paths[i % len(paths)] for i in range(batch_size)]
+        fn = lambda: [open_image(p).convert('RGB') for p in batch]
+        results.append(dict(stage='decode', component='PIL', batch_size=batch_size, **measure(fn, batch_size, steps, warmup)))
+    return results
+
+
+def augmentation_classes():
+    '''
+    dataset.py 에 정의된 *Augmentation 클래스 (resize, mean, std 를 받는 transform)
+    '''
+    module = import_module('dataset')
+    return {
+        name: obj for name, obj in vars(module).items()
+        if inspect.isclass(obj) and name.endswith('Augmentation') and obj.__module__ == 'dataset'
+    }
+
+
+def bench_augmentation(paths, batch_sizes, steps, warmup, resize, names=None):
+    results = []
+    images = [open_image(p).convert('RGB') for p in paths]
+    for name, cls in augmentation_classes().items():
+        if names and name not in names:
+            continue
+        transform = cls(resize=resize, mean=(0.548, 0.504, 0.479), std=(0.237, 0.247, 0.246))
+        for batch_size in batch_sizes:
+            batch = [images[i % len(images)] for i in range(batch_size)]
+            fn = lambda: [transform(image) for image in batch]
+            results.append(dict(stage='augmentation', component=name, batch_size=batch_size, **measure(fn, batch_size, steps, warmup)))
+    return results
+
+
+def bench_collate(batch_sizes, steps, warmup, resize):
+    results = []
+    for batch_size in batch_sizes:
+        batch = [(torch.randn(3, *resize), i % 18) for i in range(batch_size)]
+        fn = lambda: default_collate(batch)
+        results.append(dict(stage='collate', component='default_collate', batch_size=batch_size, **measure(fn, batch_size, steps, warmup)))
+    return results
+
+
+def model_classes():
+    '''
+    model.py 에 등록된 모델 class (BaseModel + pretrained backbone registry)
+    '''
+    return dict(import_module('model')._model_entrypoints)
+
+
+def bench_model(names, batch_sizes, steps, warmup, resize, num_classes):
+    results = []
+    classes = model_classes()
+    for name in names:
+        model = classes[name](num_classes=num_classes)
+        criterion = nn.CrossEntropyLoss()
+        for batch_size in batch_sizes:
+            inputs = torch.randn(batch_size, 3, *resize)
+            labels = torch.randint(0, num_classes, (batch_size,))
+
+            def forward():
+                with torch.no_grad():
+                    model(inputs)
+
+            def forward_backward():
+                model.zero_grad(set_to_none=True)
+                criterion(model(inputs), labels).backward()
+
+            model.eval()
+            results.append(dict(stage='forward', component=name, batch_size=batch_size, **measure(forward, batch_size, steps, warmup)))
+            model.train()
+            results.append(dict(stage='forward_backward', component=name, batch_size=batch_size, **measure(forward_backward, batch_size, steps, warmup)))
+        del model
+    return results
+
+
+def bench_tta(names, batch_sizes, steps, warmup, resize, num_classes):
+    '''
+    inference.py 의 TTA policy 별 forward 비용 (images/s 는 원본 이미지 기준)
+    '''
+    from inference import TTA_POLICIES, wrap_tta
+    results = []
+    classes = model_classes()
+    for name in names:
+        model = classes[name](num_classes=num_classes).eval()
+        for policy in TTA_POLICIES:
+            tta_model = wrap_tta(model, policy)
+            for batch_size in batch_sizes:
+                inputs = torch.randn(batch_size, 3, *resize)
+
+                def forward():
+                    with torch.no_grad():
+                        tta_model(inputs)
+
+                results.append(dict(stage='tta', component=f'{name}/{policy}', batch_size=batch_size, **measure(forward, batch_size, steps, warmup)))
+        del model
+    return results
+
+
+def bench_loss(batch_sizes, steps, warmup, num_classes):
+    results = []
+    for name in _criterion_entrypoints:
+        for batch_size in batch_sizes:
+            logits = torch.randn(batch_size, num_classes, requires_grad=True)
+            labels = torch.randint(0, num_classes, (batch_size,))
+            try:
+                criterion = create_criterion(name)
+                if name == 'f1' or name == 'label_smoothing':
+                    criterion.classes = num_classes
+                fn = lambda: criterion(logits, labels).backward()
+                fn()
+            except Exception as e:
+                results.append(dict(stage='loss', component=name, batch_size=batch_size, error=f'{type(e).__name__}: {e}'))
+                continue
+            results.append(dict(stage='loss', component=name, batch_size=batch_size, **measure(fn, batch_size, steps, warmup)))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    '''
+    baseline 결과와 (stage, component, batch_size) 별 images/s 를 비교하여 tolerance 이상 느려진 항목을 반환합니다.
+    '''
+    key = lambda r: (r['stage'], r['component'], r['batch_size'])
+    base = {key(r): r for r in baseline['results'] if 'images_per_s' in r}
+    regressions = []
+    for r in results:
+        b = base.get(key(r))
+        if b is None or 'images_per_s' not in r:
+            continue
+        change = r['images_per_s'] / b['images_per_s'] - 1
+        r['change'] = change
+        if change < -tolerance:
+            regressions.append(r)
+    return regressions
+
+
+def print_results(results):
+    print(f"{'stage':<17}{'component':<24}{'batch':>6}{'ms/step':>11}{'images/s':>11}{'peak MB':>10}{'change':>9}")
+    for r in results:
+        if 'error' in r:
+            print(f"{r['stage']:<17}{r['component']:<24}{r['batch_size']:>6}  {r['error']}")
+            continue
+        change = f"{r['change']:+.1%}" if 'change' in r else ''
+        print(f"{r['stage']:<17}{r['component']:<24}{r['batch_size']:>6}{r['ms_per_step']:>11.2f}{r['images_per_s']:>11.1f}{r['peak_rss_mb']:>10.0f}{change:>9}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='throughput benchmark for data, model and loss hot paths')
+    parser.add_argument('--stages', nargs='+', default=['decode', 'augmentation', 'collate', 'model', 'loss'],
+                        help='stages to run, tta (inference.py TTA policies) is opt-in (default: decode augmentation collate model loss)')
+    parser.add_argument('--data_dir', type=str, default=None, help='sample real images from here (default: synthetic jpegs)')
+    parser.add_argument('--num_images', type=int, default=64, help='number of sample images (default: 64)')
+    parser.add_argument('--batch_sizes', nargs='+', type=int, default=[1, 32], help='batch sizes to measure (default: 1 32)')
+    parser.add_argument('--resize', nargs=2, type=int, default=[512, 384], help='model input size H W (default: 512 384)')
+    parser.add_argument('--models', nargs='+', default=['BaseModel'], help="model.py classes, or 'all' (default: BaseModel)")
+    parser.add_argument('--augmentations', nargs='*', default=None, help='dataset.py augmentation classes (default: all)')
+    parser.add_argument('--num_classes', type=int, default=18, help='number of classes for model / loss (default: 18)')
+    parser.add_argument('--steps', type=int, default=10, help='measured steps per component (default: 10)')
+    parser.add_argument('--warmup', type=int, default=2, help='warmup steps per component (default: 2)')
+    parser.add_argument('--num_threads', type=int, default=None, help='torch.set_num_threads (default: torch default)')
+    parser.add_argument('--output', type=str, default='bench.json', help='result json path (default: bench.json)')
+    parser.add_argument('--baseline', type=str, default=None, help='baseline json to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed images/s drop vs baseline (default: 0.1)')
+    args = parser.parse_args()
+
+    if args.num_threads:
+        torch.set_num_threads(args.num_threads)
+    resize = tuple(args.resize)
+    paths = sample_images(args.data_dir, args.num_images) if {'decode', 'augmentation'} & set(args.stages) else []
+    models = list(model_classes()) if args.models == ['all'] else args.models
+
+    results = []
+    if 'decode' in args.stages:
+        results += bench_decode(paths, args.batch_sizes, args.steps, args.warmup)
+    if 'augmentation' in args.stages:
+        results += bench_augmentation(paths, args.batch_sizes, args.steps, args.warmup, resize, args.augmentations)
+    if 'collate' in args.stages:
+        results += bench_collate(args.batch_sizes, args.steps, args.warmup, resize)
+    if 'model' in args.stages:
+        results += bench_model(models, args.batch_sizes, args.steps, args.warmup, resize, args.num_classes)
+    if 'tta' in args.stages:
+        results += bench_tta(models, args.batch_sizes, args.steps, args.warmup, resize, args.num_classes)
+    if 'loss' in args.stages:
+        results += bench_loss(args.batch_sizes, args.steps, args.warmup, args.num_classes)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+    print_results(results)
+
+    report = {
+        'meta': {
+            'python': sys.version.split()[0],
+            'torch': torch.__version__,
+            'platform': platform.platform(),
+            'num_threads': torch.get_num_threads(),
+            'resize': resize,
+            'steps': args.steps,
+            'images': 'synthetic' if not args.data_dir else args.data_dir,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+    print(f'bench result saved at {args.output}')
+
+    if regressions:
+        for r in regressions:
+            print(f"REGRESSION {r['stage']}/{r['component']} batch {r['batch_size']}: {r['change']:+.1%} images/s")
+        sys.exit(1)
@@ -0,0 +1,93 @@
+import argparse
+import json
+
+import numpy as np
+
+from ensemble_search import align_runs, weighted_f1 # ensemble_search.py
+
+
+def cascade_curve(cheap_probs, expensive_probs, labels, thresholds):
+    '''
+    threshold 후보 (K,) 마다 cheap 모델의 최대 확률이 threshold 이상이면 cheap 예측을, 아니면 expensive 예측을 사용했을 때의
+    weighted F1 (K,) 과 expensive 로 넘어가는 이미지 비율 (K,) 을 한 번에 계산합니다.
+    '''
+    confidence = cheap_probs.max(axis=-1)
+    accept = confidence[None, :] >= thresholds[:, None]
+    preds = np.where(accept, cheap_probs.argmax(axis=-1)[None, :], expensive_probs.argmax(axis=-1)[None, :])
+    return weighted_f1(preds, labels, cheap_probs.shape[-1]), 1 - accept.mean(axis=1)
+
+
+def choose_threshold(thresholds, f1, routed, min_f1):
+    '''
+    F1 이 min_f1 이상인 threshold 중 expensive 로 넘기는 비율이 가장 작은 것 (같으면 F1 이 높은 것) 의 index
+    '''
+    valid = np.flatnonzero(f1 >= min_f1)
+    if len(valid) == 0:
+        return int(np.argmax(f1))
+    return int(valid[np.lexsort((-f1[valid], routed[valid]))[0]])
+
+
+def measure_ms(model_dir, model_type, batch_size, steps):
+    '''
+    model_dir 의 모델 (config.json 의 model, resize) 의 CPU forward 시간 (ms / image)
+    '''
+    from inference import load_member # inference.py
+    from quantize import latency # quantize.py
+
+    defaults = argparse.Namespace(model='BaseModel', resize=(512, 384))
+    model, resize = load_member(model_type, model_dir, defaults, 'cpu')
+    return latency(model, batch_size, resize, steps, warmup=1)['ms_per_step'] / batch_size
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='choose a confidence threshold for a cheap -> expensive model cascade on stored validation logits')
+    parser.add_argument('--cheap', type=str, required=True, help='train.py save dir of the cheap model (val_logits.npy, best checkpoint)')
+    parser.add_argument('--expensive', type=str, required=True, help='train.py save dir of the expensive model')
+    parser.add_argument('--model_type', type=str, default='MaskBase', help='MaskBase, Mask, Gender, Age or MaskGender (default: MaskBase)')
+    parser.add_argument('--max_f1_drop', type=float, default=0.005, help='allowed F1 drop vs the expensive model alone (default: 0.005)')
+    parser.add_argument('--thresholds', type=int, default=101, help='number of thresholds in [0, 1] to evaluate (default: 101)')
+    parser.add_argument('--cheap_ms', type=float, default=None, help='cheap model ms / image (default: measured on CPU)')
+    parser.add_argument('--expensive_ms', type=float, default=None, help='expensive model ms / image (default: measured on CPU)')
+    parser.add_argument('--latency_batch', type=int, default=8, help='batch size for the latency measurement (default: 8)')
+    parser.add_argument('--steps', type=int, default=3, help='measured steps for the latency measurement (default: 3)')
+    parser.add_argument('--output', type=str, default='./cascade.json', help='cascade config for inference.py --cascade (default: ./cascade.json)')
+    args = parser.parse_args()
+
+    probs, labels, indices = align_runs([args.cheap, args.expensive])
+    cheap_probs, expensive_probs = probs
+    thresholds = np.linspace(0, 1, args.thresholds)
+    f1, routed = cascade_curve(cheap_probs, expensive_probs, labels, thresholds)
+    cheap_f1, expensive_f1 = weighted_f1(probs.argmax(axis=-1), labels, probs.shape[-1])
+
+    cheap_ms = args.cheap_ms if args.cheap_ms is not None else measure_ms(args.cheap, args.model_type, args.latency_batch, args.steps)
+    expensive_ms = args.expensive_ms if args.expensive_ms is not None else measure_ms(args.expensive, args.model_type, args.latency_batch, args.steps)
+    cost_ms = cheap_ms + routed * expensive_ms # cascade 는 모든 이미지에 cheap 을, routed 비율만큼 expensive 를 실행
+
+    print(f"{len(indices)} common validation images | cheap f1 {cheap_f1:.4f} ({cheap_ms:.1f}ms) | expensive f1 {expensive_f1:.4f} ({expensive_ms:.1f}ms)")
+    print(f"{'threshold':>10}{'f1':>8}{'routed':>9}{'ms/img':>9}{'speedup':>9}")
+    for k in range(0, len(thresholds), max(len(thresholds) // 10, 1)):
+        print(f"{thresholds[k]:>10.2f}{f1[k]:>8.4f}{routed[k]:>9.1%}{cost_ms[k]:>9.1f}{expensive_ms / cost_ms[k]:>8.2f}x")
+
+    best = choose_threshold(thresholds, f1, routed, expensive_f1 - args.max_f1_drop)
+    result = {
+        'model_type': args.model_type,
+        'cheap': args.cheap,
+        'expensive': args.expensive,
+        'threshold': float(thresholds[best]),
+        'tta': 'none', # val_logits.npy 는 TTA 없이 계산되므로 inference.py --cascade 도 TTA 없이 추론
+        'val_f1': float(f1[best]),
+        'cheap_f1': float(cheap_f1),
+        'expensive_f1': float(expensive_f1),
+        'routed': float(routed[best]),
+        'cheap_ms': float(cheap_ms),
+        'expensive_ms': float(expensive_ms),
+        'estimated_speedup': float(expensive_ms / cost_ms[best]),
+        'curve': [{'threshold': float(t), 'f1': float(v), 'routed': float(r)} for t, v, r in zip(thresholds, f1, routed)],
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=4)
+    print(f"threshold {result['threshold']:.2f}: f1 {result['val_f1']:.4f}, {result['routed']:.1%} routed, "
+          f"estimated {result['estimated_speedup']:.2f}x vs expensive only")
+    if result['estimated_speedup'] < 1:
+        print(f"cheap model is not cheap enough: the cascade is slower than {args.expensive} alone")
+    print(f"saved at {args.output} (run: python inference.py --cascade {args.output})")
@@ -0,0 +1,147 @@
+import json
+import mmap
+import os
+import struct
+
+import torch
+
+
+# safetensors 와 같은 형식 : [8 byte little-endian header 크기][JSON header][tensor bytes]
+# header = {name: {"dtype", "shape", "data_offsets": [begin, end]}, "__metadata__": {str: str}}
+# safetensors 패키지 없이 읽고 쓰며, 만든 파일은 safetensors.torch.load_file 로도 읽을 수 있습니다.
+_DTYPES = {
+    torch.float64: 'F64',
+    torch.float32: 'F32',
+    torch.float16: 'F16',
+    torch.bfloat16: 'BF16',
+    torch.int64: 'I64',
+    torch.int32: 'I32',
+    torch.int16: 'I16',
+    torch.int8: 'I8',
+    torch.uint8: 'U8',
+    torch.bool: 'BOOL',
+}
+_TORCH_DTYPES = {name: dtype for dtype, name in _DTYPES.items()}
+
+CKPT_DTYPES = {'float32': torch.float32, 'float16': torch.float16, 'bfloat16': torch.bfloat16}
+CKPT_EXTENSIONS = {'pth': '.pth', 'safetensors': '.safetensors'}
+
+
+def _cast(state_dict, dtype):
+    '''
+    floating point tensor 만 dtype 으로 변환합니다. (num_batches_tracked 같은 int buffer 는 그대로)
+    '''
+    if dtype is None:
+        return state_dict
+    return {name: t.to(dtype) if t.is_floating_point() else t for name, t in state_dict.items()}
+
+
+def save_safetensors(state_dict, path, metadata=None):
+    '''
+    state_dict 를 safetensors 형식으로 저장합니다.
+    element 크기가 큰 dtype 부터 저장하여 모든 tensor 의 offset 이 element 크기의 배수가 되도록 합니다. (zero-copy load 용)
+    '''
+    tensors = sorted(((name, t.detach().cpu().contiguous()) for name, t in state_dict.items()),
+                     key=lambda item: -item[1].element_size())
+    header = {}
+    offset = 0
+    for name, t in tensors:
+        size = t.numel() * t.element_size()
+        header[name] = {'dtype': _DTYPES[t.dtype], 'shape': list(t.shape), 'data_offsets': [offset, offset + size]}
+        offset += size
+    if metadata:
+        header['__metadata__'] = {key: str(value) for key, value in metadata.items()}
+
+    header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    header_bytes += b' ' * (-len(header_bytes) % 8)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        for _, t in tensors:
+            if t.numel():
+                f.write(t.view(-1).view(torch.uint8).numpy()) # bfloat16 은 numpy 가 없어서 byte 로 보고 씀
+    os.replace(tmp_path, path)
+
+
+def _read_header(f):
+    header_size = struct.unpack('<Q', f.read(8))[0]
+    return json.loads(f.read(header_size)), 8 + header_size
+
+
+def read_metadata(path):
+    '''
+    safetensors 파일의 __metadata__ (model, num_classes, dtype 등)만 읽습니다.
+    '''
+    with open(path, 'rb') as f:
+        header, _ = _read_header(f)
+    return header.get('__metadata__', {})
+
+
+def load_safetensors(path, dtype=None):
+    '''
+    safetensors 파일을 mmap 하여 복사 없이 tensor 로 만듭니다. 실제 읽기는 tensor 를 사용할 때 page 단위로 일어납니다.
+    ACCESS_COPY 로 mmap 하므로 tensor 를 수정해도 파일은 바뀌지 않습니다.
+    dtype 이 주어지면 floating point tensor 를 변환합니다. (저장 dtype 과 다르면 이 때 복사)
+    '''
+    with open(path, 'rb') as f:
+        header, data_start = _read_header(f)
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    metadata = header.pop('__metadata__', {})
+    state_dict = {}
+    for name, info in header.items():
+        begin, end = info['data_offsets']
+        t_dtype = _TORCH_DTYPES[info['dtype']]
+        if end == begin:
+            t = torch.empty(info['shape'], dtype=t_dtype)
+        else:
+            itemsize = torch.empty((), dtype=t_dtype).element_size()
+            t = torch.frombuffer(buffer, dtype=t_dtype, count=(end - begin) // itemsize, offset=data_start + begin)
+        state_dict[name] = t.view(info['shape'])
+    return _cast(state_dict, dtype), metadata
+
+
+def save_checkpoint(state_dict, path, model_name=None, num_classes=None, dtype=None):
+    '''
+    확장자에 따라 .safetensors (header 에 model, num_classes, dtype 기록) 또는 .pth (torch.save) 로 저장합니다.
+    dtype (torch.float16 / torch.bfloat16) 을 주면 floating point tensor 를 변환하여 저장합니다.
+    '''
+    state_dict = _cast(state_dict, dtype)
+    if path.endswith('.safetensors'):
+        metadata = {'format': 'pt', 'dtype': str(dtype or torch.float32).replace('torch.', '')}
+        if model_name is not None:
+            metadata['model'] = model_name
+        if num_classes is not None:
+            metadata['num_classes'] = num_classes
+        save_safetensors(state_dict, path, metadata)
+    else:
+        torch.save(state_dict, path)
+
+
+def load_checkpoint(path, map_location='cpu', dtype=None):
+    '''
+    save_checkpoint 로 저장한 파일을 (state_dict, metadata) 로 읽습니다.
+    - .safetensors : mmap zero-copy load, metadata 는 header 의 __metadata__
+    - .pth         : torch.load (지원하는 torch 에서는 mmap=True), metadata 는 빈 dict
+    '''
+    if path.endswith('.safetensors'):
+        state_dict, metadata = load_safetensors(path, dtype)
+        if torch.device(map_location).type != 'cpu':
+            state_dict = {name: t.to(map_location) for name, t in state_dict.items()}
+        return state_dict, metadata
+    try:
+        state_dict = torch.load(path, map_location=map_location, mmap=True)
+    except (TypeError, RuntimeError): # torch < 2.1 또는 예전 (zip 이 아닌) 형식의 파일
+        state_dict = torch.load(path, map_location=map_location)
+    return _cast(state_dict, dtype), {}
+
+
+def find_checkpoint(model_dir, name='best'):
+    '''
+    model_dir 에서 {name}.safetensors, {name}.pth, {name}.pt (TorchScript, quantize.py 결과) 순서로 찾습니다.
+    '''
+    for extension in ('.safetensors', '.pth', '.pt'):
+        path = os.path.join(model_dir, name + extension)
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"no {name}.safetensors, {name}.pth or {name}.pt in {model_dir}")
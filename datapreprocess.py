@@ -39,6 +39,8 @@ from inference import inference # inference.py
 import wandb
 import shutil
 
+from profiling import TimedCompose # profiling.py
+
 class RandomGaussianBlur(object):
     def __init__(self, kernel_size):
         self.kernel_size = kernel_size
@@ -50,19 +52,22 @@ class RandomGaussianBlur(object):
             return F.gaussian_blur(img, kernel_size=self.kernel_size, sigma=(0.1, 2.0))    
 
 
+scale = (0.005, 0.025)
+ratio = (0.3, 3.3)
+# 매 이미지마다 Compose 를 새로 만들지 않도록 한 번만 생성 (--time_transforms 이면 TimedCompose 로 교체)
+RANDOM_TRANSFORM = transforms.Compose([transforms.ToTensor(),
+                                       transforms.RandomHorizontalFlip(p=0.6),
+                                       transforms.ColorJitter(brightness=0.2, contrast=0.2, saturation=0.2, hue=0.1),
+                                       transforms.RandomErasing(p=0.7, scale=scale, ratio=ratio),
+                                       transforms.RandomErasing(p=0.5, scale=scale, ratio=ratio),
+                                       RandomGaussianBlur(kernel_size=3),
+                                       transforms.RandomRotation(5),
+                                       transforms.ToPILImage()
+                                      ])
+
+
 def random_transform(image):
-    scale = (0.005, 0.025)
-    ratio = (0.3, 3.3)
-    transform = transforms.Compose([transforms.ToTensor(),
-                                    transforms.RandomHorizontalFlip(p=0.6),
-                                    transforms.ColorJitter(brightness=0.2, contrast=0.2, saturation=0.2, hue=0.1),
-                                    transforms.RandomErasing(p=0.7, scale=scale, ratio=ratio),
-                                    transforms.RandomErasing(p=0.5, scale=scale, ratio=ratio),
-                                    RandomGaussianBlur(kernel_size=3),
-                                    transforms.RandomRotation(5),
-                                    transforms.ToPILImage()
-                                   ])
-    return transform(image)    
+    return RANDOM_TRANSFORM(image)
 
 
 def AddAugmentation(label_paths, idx, aug_size, aug_dir_name):
@@ -103,6 +108,7 @@ if __name__ == '__main__':
     parser.add_argument('--dataset', type=str, default='MaskPreprocessDataset', help='dataset augmentation type (default: MaskPreprocessDataset)')
 #     parser.add_argument('--delplus', type=int, default=0,choices=[1, 0], help = 'want? (y : 1 enter ,n : 0 enter 1를 입력하면 지정 텍스트 파일을 읽어 실행됨)') # 무조건 실행되므로 필요없음
     parser.add_argument('--aug_dir_name', type=str, default='/opt/ml/input/data/augmentation_delete_data', help = 'create preprocess dataset folder')
+    parser.add_argument('--time_transforms', action='store_true', help='report per-transform call counts and time of random_transform')
     
     if os.path.exists('/opt/ml/input/augmentation_delete_data'):
         print('augmentation_delete_data is already exists')
@@ -131,11 +137,18 @@ if __name__ == '__main__':
         outlier_remove=False
     )
     
+    transform_timer = None
+    if args.time_transforms:
+        transform_timer = TimedCompose(RANDOM_TRANSFORM.transforms)
+        RANDOM_TRANSFORM = transform_timer
+
     # -- delplus 다현 추가 부분
     with open('./delplustxt.txt', 'r') as f:
         for line in f:
             idx,size = line.strip().split(',')
             AddAugmentation(dataset.label_paths, idx, size, aug_dir_name)
+    if transform_timer is not None:
+        print(TimedCompose.format(transform_timer.summary()))
     print('datapreprocess is done! if you want to use preprocessed data, put data_dir parser --data_dir /opt/ml/input/augmentation_delete_data')
             
 # python datapreprocess.py --aug_dir_name /opt/ml/input/augmentation_delete_data
\ No newline at end of file
@@ -1,16 +1,18 @@
+import json
 import os
 import random
-from collections import defaultdict
+from collections import Counter, defaultdict
 from enum import Enum
+from multiprocessing import Pool
 from typing import Tuple, List
 import numpy as np
 import torch
 from PIL import Image
 from PIL import ImageEnhance
 from torch.utils.data import Dataset, Subset, random_split
-from torchvision.transforms import *
 from torch.optim.lr_scheduler import StepLR
 from PIL import ImageEnhance
+# torchvision 은 import 가 느려서 transform 을 만드는 __init__ 안에서 import 합니다. (python importtime.py 로 확인)
 
 IMG_EXTENSIONS = [
     ".jpg", ".JPG", ".jpeg", ".JPEG", ".png",
@@ -26,8 +28,130 @@ def is_image_file(filename):
     return any(filename.endswith(extension) for extension in IMG_EXTENSIONS)
 
 
+###### shared manifest / decoded image cache ##########
+# 여러 학습 run 이 같은 데이터를 다시 scan / decode 하지 않도록 공유하는 캐시입니다.
+# runner.py 가 한 번 만들고 환경변수로 경로를 넘겨주면 dataset 의 list_dir / open_image 가 사용합니다.
+MANIFEST_ENV = "PSTAGE_MANIFEST"
+IMAGE_CACHE_ENV = "PSTAGE_IMAGE_CACHE"
+
+_manifest = None
+_image_cache = None
+
+
+def build_manifest(data_dir, manifest_path):
+    '''
+    data_dir 과 그 아래 profile 폴더들의 os.listdir 결과를 그대로(순서 포함) json 으로 저장합니다.
+    순서를 보존하므로 manifest 를 사용해도 random_split 결과가 달라지지 않습니다.
+    '''
+    data_dir = os.path.abspath(data_dir)
+    entries = {data_dir: os.listdir(data_dir)}
+    for profile in entries[data_dir]:
+        img_folder = os.path.join(data_dir, profile)
+        if os.path.isdir(img_folder):
+            entries[img_folder] = os.listdir(img_folder)
+
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(entries, f, ensure_ascii=False)
+    os.replace(tmp_path, manifest_path)
+    return entries
+
+
+def list_dir(path):
+    '''
+    PSTAGE_MANIFEST 가 지정되어 있고 path 가 manifest 에 있으면 manifest 의 목록을, 아니면 os.listdir 결과를 반환합니다.
+    '''
+    global _manifest
+    manifest_path = os.environ.get(MANIFEST_ENV)
+    if manifest_path and _manifest is None and os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            _manifest = json.load(f)
+    if _manifest is not None:
+        entries = _manifest.get(os.path.abspath(path))
+        if entries is not None:
+            return list(entries)
+    return os.listdir(path)
+
+
+class ImageCache:
+    '''
+    decode 된 RGB 이미지를 (N, H, W, 3) uint8 memmap 파일 하나에 저장한 캐시
+    여러 process 가 같은 파일을 read-only 로 열기 때문에 page cache 를 공유합니다.
+    캐시 크기(H, W)와 다른 이미지는 저장하지 않고 open_image 에서 원본을 읽습니다.
+    - cache_dir/index.json : {"shape": [H, W, 3], "paths": [...]}
+    - cache_dir/images.u8  : 이미지 데이터
+    '''
+    def __init__(self, cache_dir):
+        with open(os.path.join(cache_dir, "index.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.shape = tuple(meta["shape"])
+        self.rows = {path: row for row, path in enumerate(meta["paths"])}
+        self.array = np.memmap(
+            os.path.join(cache_dir, "images.u8"), dtype=np.uint8, mode="r",
+            shape=(len(self.rows),) + self.shape,
+        )
+
+    def get(self, path):
+        row = self.rows.get(os.path.abspath(path))
+        if row is None:
+            return None
+        return self.array[row]
+
+
+def _fill_image_cache(task):
+    array_path, shape, start, paths = task
+    array = np.memmap(array_path, dtype=np.uint8, mode="r+", shape=shape)
+    for row, path in enumerate(paths, start):
+        array[row] = np.asarray(Image.open(path).convert("RGB"))
+    array.flush()
+
+
+def build_image_cache(image_paths, cache_dir, num_workers=4, chunk_size=256):
+    '''
+    image_paths 를 한 번만 decode 하여 ImageCache 를 만듭니다.
+    가장 많은 이미지의 크기를 캐시 크기로 사용하며, 크기는 header 만 읽어 확인합니다.
+    '''
+    os.makedirs(cache_dir, exist_ok=True)
+    sizes = {}
+    for path in image_paths:
+        with Image.open(path) as image:
+            sizes[os.path.abspath(path)] = image.size  # (W, H)
+    (width, height), _ = Counter(sizes.values()).most_common(1)[0]
+    paths = [path for path, size in sizes.items() if size == (width, height)]
+    shape = (len(paths), height, width, 3)
+    print(f"caching {len(paths)}/{len(image_paths)} images of size {width}x{height} ({np.prod(shape) / 1024 ** 3:.1f} GB)")
+
+    array_path = os.path.join(cache_dir, "images.u8")
+    np.memmap(array_path, dtype=np.uint8, mode="w+", shape=shape).flush()
+    tasks = [(array_path, shape, start, paths[start:start + chunk_size]) for start in range(0, len(paths), chunk_size)]
+    with Pool(num_workers) as pool:
+        pool.map(_fill_image_cache, tasks)
+
+    tmp_path = os.path.join(cache_dir, "index.json.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"shape": [height, width, 3], "paths": paths}, f, ensure_ascii=False)
+    os.replace(tmp_path, os.path.join(cache_dir, "index.json"))
+
+
+def open_image(path):
+    '''
+    PSTAGE_IMAGE_CACHE 가 지정되어 있으면 캐시에서 decode 된 이미지를, 없으면 Image.open 결과를 반환합니다.
+    '''
+    global _image_cache
+    cache_dir = os.environ.get(IMAGE_CACHE_ENV)
+    if cache_dir and _image_cache is None and os.path.exists(os.path.join(cache_dir, "index.json")):
+        _image_cache = ImageCache(cache_dir)
+    if _image_cache is not None:
+        array = _image_cache.get(path)
+        if array is not None:
+            return Image.fromarray(np.asarray(array), "RGB")
+    return Image.open(path)
+
+
 class BaseAugmentation:
     def __init__(self, resize, mean, std, **args):
+        from torchvision.transforms import Compose, Resize, ToTensor, Normalize
+
         self.transform = Compose([
             Resize(resize, Image.BILINEAR),
             ToTensor(),
@@ -56,6 +180,8 @@ class AddGaussianNoise(object):
 
 class CustomAugmentation:
     def __init__(self, resize, mean, std, **args):
+        from torchvision.transforms import Compose, CenterCrop, Resize, ColorJitter, ToTensor, Normalize
+
         self.transform = Compose([
             CenterCrop((320, 256)),
             Resize(resize, Image.BILINEAR),
@@ -70,6 +196,9 @@ class CustomAugmentation:
 
 class bestAugmentation:
     def __init__(self, resize, mean=(0.548, 0.504, 0.479), std=(0.237, 0.247, 0.246), **args):
+        from torchvision import transforms
+        from torchvision.transforms import Compose, CenterCrop, RandomApply, ToTensor, Normalize
+
         self.transform = Compose([
             CenterCrop((380,380)),
             RandomApply([transforms.ColorJitter(brightness=0.2, contrast=0.2, saturation=0.2, hue=0.2)], p=1),
@@ -153,13 +282,13 @@ class MaskBaseDataset(Dataset):
         self.calc_statistics()
 
     def setup(self):
-        profiles = os.listdir(self.data_dir)
+        profiles = list_dir(self.data_dir)
         for profile in profiles:
             if profile.startswith("."):  # "." 로 시작하는 파일은 무시합니다
                 continue
 
             img_folder = os.path.join(self.data_dir, profile)
-            for file_name in os.listdir(img_folder):
+            for file_name in list_dir(img_folder):
                 _file_name, ext = os.path.splitext(file_name)
                 if _file_name not in self._file_names:  # "." 로 시작하는 파일 및 invalid 한 파일들은 무시합니다
                     continue
@@ -215,6 +344,12 @@ class MaskBaseDataset(Dataset):
     def __len__(self):
         return len(self.image_paths)
 
+    def get_target(self, index) -> int:
+        '''
+        이미지를 읽지 않고 지정된 인덱스의 학습 label 만 반환합니다.
+        '''
+        return self.encode_multi_class(self.get_mask_label(index), self.get_gender_label(index), self.get_age_label(index))
+
     def get_mask_label(self, index) -> MaskLabels:
         '''
         지정된 인덱스의 마스크 라벨을 반환합니다.
@@ -238,7 +373,7 @@ class MaskBaseDataset(Dataset):
         지정된 인덱스의 이미지 데이터를 읽어들입니다.
         '''
         image_path = self.image_paths[index]
-        return Image.open(image_path)
+        return open_image(image_path)
 
     @staticmethod
     def encode_multi_class(mask_label, gender_label, age_label) -> int:
@@ -316,13 +451,13 @@ class MaskDataset(Dataset):
         
 
     def setup(self):
-        profiles = os.listdir(self.data_dir)
+        profiles = list_dir(self.data_dir)
         for profile in profiles:
             if profile.startswith("."):  # "." 로 시작하는 파일은 무시합니다
                 continue
 
             img_folder = os.path.join(self.data_dir, profile)
-            for file_name in os.listdir(img_folder):
+            for file_name in list_dir(img_folder):
                 _file_name, ext = os.path.splitext(file_name)
                 if _file_name not in self._file_names:  # "." 로 시작하는 파일 및 invalid 한 파일들은 무시합니다
                     continue
@@ -381,6 +516,12 @@ class MaskDataset(Dataset):
     def __len__(self):
         return len(self.image_paths)
 
+    def get_target(self, index) -> int:
+        '''
+        이미지를 읽지 않고 지정된 인덱스의 학습 label 만 반환합니다.
+        '''
+        return self.get_mask_label(index)
+
     def get_mask_label(self, index) -> MaskLabels:
         '''
         지정된 인덱스의 마스크 라벨을 반환합니다.
@@ -404,7 +545,7 @@ class MaskDataset(Dataset):
         지정된 인덱스의 이미지 데이터를 읽어들입니다.
         '''
         image_path = self.image_paths[index]
-        return Image.open(image_path)
+        return open_image(image_path)
 
 #     @staticmethod
 #     def encode_multi_class(mask_label, gender_label, age_label) -> int:
@@ -480,13 +621,13 @@ class GenderDataset(Dataset):
         
 
     def setup(self):
-        profiles = os.listdir(self.data_dir)
+        profiles = list_dir(self.data_dir)
         for profile in profiles:
             if profile.startswith("."):  # "." 로 시작하는 파일은 무시합니다
                 continue
 
             img_folder = os.path.join(self.data_dir, profile)
-            for file_name in os.listdir(img_folder):
+            for file_name in list_dir(img_folder):
                 _file_name, ext = os.path.splitext(file_name)
                 if _file_name not in self._file_names:  # "." 로 시작하는 파일 및 invalid 한 파일들은 무시합니다
                     continue
@@ -545,6 +686,12 @@ class GenderDataset(Dataset):
     def __len__(self):
         return len(self.image_paths)
 
+    def get_target(self, index) -> int:
+        '''
+        이미지를 읽지 않고 지정된 인덱스의 학습 label 만 반환합니다.
+        '''
+        return self.get_gender_label(index)
+
 #     def get_mask_label(self, index) -> MaskLabels:
 #         '''
 #         지정된 인덱스의 마스크 라벨을 반환합니다.
@@ -568,7 +715,7 @@ class GenderDataset(Dataset):
         지정된 인덱스의 이미지 데이터를 읽어들입니다.
         '''
         image_path = self.image_paths[index]
-        return Image.open(image_path)
+        return open_image(image_path)
 
 #     @staticmethod
 #     def encode_multi_class(mask_label, gender_label, age_label) -> int:
@@ -643,13 +790,13 @@ class AgeDataset(Dataset):
         
 
     def setup(self):
-        profiles = os.listdir(self.data_dir)
+        profiles = list_dir(self.data_dir)
         for profile in profiles:
             if profile.startswith("."):  # "." 로 시작하는 파일은 무시합니다
                 continue
 
             img_folder = os.path.join(self.data_dir, profile)
-            for file_name in os.listdir(img_folder):
+            for file_name in list_dir(img_folder):
                 _file_name, ext = os.path.splitext(file_name)
                 if _file_name not in self._file_names:  # "." 로 시작하는 파일 및 invalid 한 파일들은 무시합니다
                     continue
@@ -708,6 +855,12 @@ class AgeDataset(Dataset):
     def __len__(self):
         return len(self.image_paths)
 
+    def get_target(self, index) -> int:
+        '''
+        이미지를 읽지 않고 지정된 인덱스의 학습 label 만 반환합니다.
+        '''
+        return self.get_age_label(index)
+
 #     def get_mask_label(self, index) -> MaskLabels:
 #         '''
 #         지정된 인덱스의 마스크 라벨을 반환합니다.
@@ -731,7 +884,7 @@ class AgeDataset(Dataset):
         지정된 인덱스의 이미지 데이터를 읽어들입니다.
         '''
         image_path = self.image_paths[index]
-        return Image.open(image_path)
+        return open_image(image_path)
 
 #     @staticmethod
 #     def encode_multi_class(mask_label, gender_label, age_label) -> int:
@@ -808,13 +961,13 @@ class MaskBaseDataset(Dataset):
         self.calc_statistics()
 
     def setup(self):
-        profiles = os.listdir(self.data_dir)
+        profiles = list_dir(self.data_dir)
         for profile in profiles:
             if profile.startswith("."):  # "." 로 시작하는 파일은 무시합니다
                 continue
 
             img_folder = os.path.join(self.data_dir, profile)
-            for file_name in os.listdir(img_folder):
+            for file_name in list_dir(img_folder):
                 _file_name, ext = os.path.splitext(file_name)
                 if _file_name not in self._file_names:  # "." 로 시작하는 파일 및 invalid 한 파일들은 무시합니다
                     continue
@@ -870,6 +1023,12 @@ class MaskBaseDataset(Dataset):
     def __len__(self):
         return len(self.image_paths)
 
+    def get_target(self, index) -> int:
+        '''
+        이미지를 읽지 않고 지정된 인덱스의 학습 label 만 반환합니다.
+        '''
+        return self.encode_multi_class(self.get_mask_label(index), self.get_gender_label(index))
+
     def get_mask_label(self, index) -> MaskLabels:
         '''
         지정된 인덱스의 마스크 라벨을 반환합니다.
@@ -893,7 +1052,7 @@ class MaskBaseDataset(Dataset):
         지정된 인덱스의 이미지 데이터를 읽어들입니다.
         '''
         image_path = self.image_paths[index]
-        return Image.open(image_path)
+        return open_image(image_path)
 
     @staticmethod
     def encode_multi_class(mask_label, gender_label) -> int:
@@ -972,7 +1131,7 @@ class MaskSplitByProfileDataset(MaskBaseDataset):
         image_paths, mask_labels, gender_labels, age_labels 리스트에 각 이미지의 경로, 마스크, 성별, 연령 정보를 저장
         indices 딕셔너리에 저장한 인덱스를 사용하여 Subset으로 데이터셋을 나누어줍니다
         '''
-        profiles = os.listdir(self.data_dir)
+        profiles = list_dir(self.data_dir)
         profiles = [profile for profile in profiles if not profile.startswith(".")]
         split_profiles = self._split_profile(profiles, self.val_ratio)
 
@@ -981,7 +1140,7 @@ class MaskSplitByProfileDataset(MaskBaseDataset):
             for _idx in indices:
                 profile = profiles[_idx]
                 img_folder = os.path.join(self.data_dir, profile)
-                for file_name in os.listdir(img_folder):
+                for file_name in list_dir(img_folder):
                     _file_name, ext = os.path.splitext(file_name)
                     if _file_name not in self._file_names:  # "." 로 시작하는 파일 및 invalid 한 파일들은 무시합니다
                         continue
@@ -1038,7 +1197,9 @@ class MaskSplitByProfileDataset(MaskBaseDataset):
 #         return len(self.img_paths)
 
 class TestDataset(Dataset):
-    def __init__(self, img_paths, transform):
+    def __init__(self, img_paths, resize=(512, 384), mean=(0.548, 0.504, 0.479), std=(0.237, 0.247, 0.246)):
+        from torchvision.transforms import Compose, Resize, ToTensor, Normalize
+
         self.img_paths = img_paths
         self.transform = Compose([
             Resize(resize, Image.BILINEAR),
@@ -1047,7 +1208,7 @@ class TestDataset(Dataset):
         ])
 
     def __getitem__(self, index):
-        image = Image.open(self.img_paths[index])
+        image = open_image(self.img_paths[index])
 
         if self.transform:
             image = self.transform(image)
@@ -1055,3 +1216,26 @@ class TestDataset(Dataset):
 
     def __len__(self):
         return len(self.img_paths)
+
+
+class MultiResizeTestDataset(Dataset):
+    '''
+    이미지를 한 번만 decode 하고 resizes 의 크기마다 transform 한 tensor 를 tuple 로 반환하는 Test 데이터셋
+    입력 크기가 다른 여러 모델을 같은 batch 로 추론할 때 사용합니다.
+    '''
+    def __init__(self, img_paths, resizes, mean=(0.548, 0.504, 0.479), std=(0.237, 0.247, 0.246)):
+        from torchvision.transforms import Compose, Resize, ToTensor, Normalize
+
+        self.img_paths = img_paths
+        self.transforms = [Compose([
+            Resize(resize, Image.BILINEAR),
+            ToTensor(),
+            Normalize(mean=mean, std=std),
+        ]) for resize in resizes]
+
+    def __getitem__(self, index):
+        image = open_image(self.img_paths[index])
+        return tuple(transform(image) for transform in self.transforms)
+
+    def __len__(self):
+        return len(self.img_paths)
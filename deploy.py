@@ -0,0 +1,242 @@
+import argparse
+import copy
+import json
+import os
+import time
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+# bundle.pt 를 로드하고 추론하는 함수 (load_bundle, decode_labels, predict_images) 는 torch 만 사용합니다.
+# model.py / dataset.py / timm / efficientnet_pytorch 는 export 할 때만 import 합니다.
+BUNDLE_META = 'bundle.json'
+
+
+class DeployModel(nn.Module):
+    '''
+    uint8 (B, H, W, 3) RGB batch 를 받아 center crop -> resize -> 모델까지 한 graph 로 실행하는 wrapper
+    normalization 은 fold_normalization 으로 첫 conv 에 합쳐지고, 합칠 수 없는 부분만 scale / shift 로 남습니다.
+    '''
+    def __init__(self, model, resize, crop=None, scale=None, shift=None):
+        super().__init__()
+        self.model = model
+        self.resize = tuple(resize)
+        self.crop = tuple(crop) if crop else None
+        self.register_buffer('scale', scale if scale is not None else torch.ones(1, 3, 1, 1))
+        self.register_buffer('shift', shift if shift is not None else torch.zeros(1, 3, 1, 1))
+
+    def forward(self, images):
+        x = images.permute(0, 3, 1, 2).float()
+        if self.crop is not None:
+            top = (x.shape[2] - self.crop[0]) // 2
+            left = (x.shape[3] - self.crop[1]) // 2
+            x = x[:, :, top:top + self.crop[0], left:left + self.crop[1]]
+        x = F.interpolate(x, size=self.resize, mode='bilinear', align_corners=False, antialias=True)
+        return self.model((x - self.shift) * self.scale)
+
+
+def _first_conv(model, example):
+    '''
+    forward 에서 처음 실행되는 Conv2d 와 그 conv 의 입력이 모델 입력 그대로인지 여부
+    '''
+    found = []
+
+    def hook(module, inputs):
+        if not found:
+            found.append((module, inputs[0] is example))
+
+    handles = [m.register_forward_pre_hook(hook) for m in model.modules() if isinstance(m, nn.Conv2d)]
+    try:
+        with torch.no_grad():
+            model(example)
+    finally:
+        for handle in handles:
+            handle.remove()
+    return found[0] if found else (None, False)
+
+
+def _zero_pads(conv):
+    '''
+    conv 가 입력 가장자리를 0 으로 padding 하는지 (efficientnet_pytorch 의 *SamePadding 은 forward 안에서 padding)
+    '''
+    if conv.padding_mode != 'zeros':
+        return False
+    if isinstance(conv.padding, str):
+        return conv.padding != 'valid'
+    return any(conv.padding) or type(conv).__name__.endswith('SamePadding')
+
+
+@torch.no_grad()
+def fold_normalization(model, mean, std, resize):
+    '''
+    (x / 255 - mean) / std 를 첫 conv 에 합칩니다. 반환값 (folding, scale, shift) 는 DeployModel 에 남길 입력 변환입니다.
+    - full  : padding 이 없으면 W' = W / (255 std), b' = b - sum(W mean / std) 로 전부 합침 (입력 변환 없음)
+    - scale : zero padding 이 있으면 padding 값이 달라지므로 mean (x255) 빼기는 남기고 1 / (255 std) 만 weight 에 합침
+    - none  : 첫 conv 앞에 다른 연산이 있으면 합치지 않고 전부 입력 변환으로 남김
+    '''
+    mean = torch.tensor(mean, dtype=torch.float32).view(1, 3, 1, 1)
+    std = torch.tensor(std, dtype=torch.float32).view(1, 3, 1, 1)
+    conv, direct = _first_conv(model, torch.zeros(1, 3, *resize))
+    if conv is None or not direct or conv.in_channels != 3 or conv.groups != 1:
+        return 'none', 1 / (255 * std), mean * 255
+
+    weight = conv.weight.data
+    conv.weight.data = weight / (255 * std.view(1, 3, 1, 1))
+    if _zero_pads(conv):
+        return 'scale', torch.ones(1, 3, 1, 1), mean * 255
+    shift = (weight * (mean / std).view(1, 3, 1, 1)).sum(dim=(1, 2, 3))
+    if conv.bias is None:
+        conv.bias = nn.Parameter(-shift)
+    else:
+        conv.bias.data = conv.bias.data - shift
+    return 'full', torch.ones(1, 3, 1, 1), torch.zeros(1, 3, 1, 1)
+
+
+def label_table(model_type, num_classes):
+    '''
+    class index -> {mask, gender, age} 이름 (inference output.csv 의 ans 는 index 그대로)
+    '''
+    from ensemble import TASK_LABELS # ensemble.py
+    from dataset import MaskLabels, GenderLabels, AgeLabels # dataset.py
+
+    names = {'mask': MaskLabels, 'gender': GenderLabels, 'age': AgeLabels}
+    table = []
+    for index in range(num_classes):
+        labels = TASK_LABELS[model_type](index)
+        table.append({task: names[task](int(value)).name.lower() for task, value in labels.items()})
+    return table
+
+
+def load_bundle(path, device='cpu'):
+    '''
+    bundle.pt 를 (TorchScript 모델, meta) 로 로드합니다. model.py 와 backbone 패키지가 필요 없습니다.
+    '''
+    extra_files = {BUNDLE_META: ''}
+    model = torch.jit.load(path, map_location=device, _extra_files=extra_files)
+    return model.eval(), json.loads(extra_files[BUNDLE_META])
+
+
+def decode_labels(logits, meta):
+    '''
+    logits (B, num_classes) 를 [{'class', 'mask', 'gender', 'age', 'score'}] 로 변환합니다.
+    '''
+    probs = logits.float().softmax(dim=-1)
+    scores, indices = probs.max(dim=-1)
+    return [dict(meta['labels'][index], **{'class': index, 'score': score})
+            for index, score in zip(indices.tolist(), scores.tolist())]
+
+
+@torch.no_grad()
+def predict_images(model, meta, paths, batch_size=32):
+    '''
+    이미지 파일을 uint8 (H, W, 3) 로 읽어 bundle 로 추론합니다. 크기가 같은 이미지끼리 batch 로 묶습니다.
+    '''
+    import numpy as np
+    from PIL import Image
+
+    results = []
+    for begin in range(0, len(paths), batch_size):
+        images = [np.asarray(Image.open(path).convert('RGB')) for path in paths[begin:begin + batch_size]]
+        groups = {}
+        for i, image in enumerate(images):
+            groups.setdefault(image.shape, []).append(i)
+        decoded = [None] * len(images)
+        for indices in groups.values():
+            batch = torch.from_numpy(np.stack([images[i] for i in indices]))
+            for i, label in zip(indices, decode_labels(model(batch), meta)):
+                decoded[i] = label
+        results += decoded
+    return results
+
+
+def export_bundle(model_dir, model_type, output_path, args):
+    '''
+    학습한 모델을 bundle.pt 로 export 합니다. 같은 크기의 uint8 입력으로 eager 모델 (TestDataset 과 같은 normalize) 과 logits 를 비교합니다.
+    '''
+    from checkpoint import find_checkpoint, read_metadata # checkpoint.py
+    from inference import load_member # inference.py
+    from model import make_traceable # model.py
+
+    device = torch.device('cpu')
+    eager, resize = load_member(model_type, model_dir, args, device)
+    eager = make_traceable(eager) # efficientnet 은 trace 가능한 Swish 로
+    mean = torch.tensor(args.mean, dtype=torch.float32).view(1, 3, 1, 1)
+    std = torch.tensor(args.std, dtype=torch.float32).view(1, 3, 1, 1)
+    # folding 하지 않은 모델에 TestDataset 과 같은 normalize 를 적용한 기준 wrapper
+    reference = DeployModel(copy.deepcopy(eager), resize, args.crop, 1 / (255 * std), mean * 255).eval()
+
+    folding, scale, shift = fold_normalization(eager, args.mean, args.std, resize)
+    deploy = DeployModel(eager, resize, args.crop, scale, shift).eval()
+    input_size = tuple(args.crop) if args.crop else tuple(resize)
+    example = torch.randint(0, 256, (2, *input_size, 3), dtype=torch.uint8)
+    with torch.no_grad():
+        scripted = torch.jit.freeze(torch.jit.trace(deploy, example))
+        images = torch.randint(0, 256, (args.parity_batch, *input_size, 3), dtype=torch.uint8)
+        expected, actual = reference(images), scripted(images)
+    max_diff = float((expected - actual).abs().max())
+    agreement = float((expected.argmax(-1) == actual.argmax(-1)).float().mean())
+
+    # label table 은 dataset class 의 num_classes 가 아니라 모델이 실제로 내는 logits 수만큼 만듦
+    num_classes = expected.shape[-1]
+    checkpoint = find_checkpoint(model_dir, 'best')
+    if checkpoint.endswith('.safetensors'):
+        header_classes = read_metadata(checkpoint).get('num_classes')
+        if header_classes is not None and int(header_classes) != num_classes:
+            raise RuntimeError(f"model outputs {num_classes} logits but {checkpoint} header says num_classes {header_classes}")
+
+    meta = {
+        'model': type(reference.model).__name__,
+        'model_type': model_type,
+        'input': 'uint8 (B, H, W, 3) RGB',
+        'crop': list(args.crop) if args.crop else None,
+        'resize': list(resize),
+        'mean': list(args.mean),
+        'std': list(args.std),
+        'folding': folding,
+        'labels': label_table(model_type, num_classes),
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    torch.jit.save(scripted, output_path, _extra_files={BUNDLE_META: json.dumps(meta, ensure_ascii=False)})
+    return meta, max_diff, agreement
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='export / run a self-contained deploy bundle (uint8 HWC input, folded normalization, label decoding)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help='export a train.py model dir as bundle.pt')
+    export_parser.add_argument('--model_dir', type=str, required=True, help='train.py save dir (best.safetensors or best.pth + config.json)')
+    export_parser.add_argument('--model_type', type=str, default='MaskBase', help='MaskBase, Mask, Gender, Age or MaskGender (default: MaskBase)')
+    export_parser.add_argument('--model', type=str, default='BaseModel', help='model type if config.json is missing (default: BaseModel)')
+    export_parser.add_argument('--resize', nargs=2, type=int, default=[512, 384], help='model input size if config.json is missing (default: 512 384)')
+    export_parser.add_argument('--crop', nargs=2, type=int, default=None, help='center crop H W applied to the raw image before resize (default: none)')
+    export_parser.add_argument('--mean', nargs=3, type=float, default=[0.548, 0.504, 0.479], help='normalization mean used in training (default: dataset.py mean)')
+    export_parser.add_argument('--std', nargs=3, type=float, default=[0.237, 0.247, 0.246], help='normalization std used in training (default: dataset.py std)')
+    export_parser.add_argument('--parity_batch', type=int, default=4, help='random uint8 images for the parity check (default: 4)')
+    export_parser.add_argument('--atol', type=float, default=1e-3, help='max allowed |logit| difference vs eager (default: 1e-3)')
+    export_parser.add_argument('--output', type=str, default=None, help='bundle path (default: {model_dir}/deploy/bundle.pt)')
+
+    predict_parser = subparsers.add_parser('predict', help='run a bundle on image files (no model.py import)')
+    predict_parser.add_argument('--bundle', type=str, required=True, help='bundle.pt path')
+    predict_parser.add_argument('images', nargs='+', help='image files')
+    predict_parser.add_argument('--batch_size', type=int, default=32, help='batch size (default: 32)')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        output = args.output or os.path.join(args.model_dir, 'deploy', 'bundle.pt')
+        meta, max_diff, agreement = export_bundle(args.model_dir, args.model_type, output, args)
+        print(f"{meta['model']} ({meta['model_type']}), normalization folding: {meta['folding']}")
+        print(f"parity: max |diff| {max_diff:.2e}, argmax agreement {agreement:.2%}")
+        if max_diff > args.atol:
+            os.remove(output)
+            raise RuntimeError(f"bundle differs from eager by {max_diff:.2e} > atol {args.atol}, {output} removed")
+        start = time.perf_counter()
+        load_bundle(output)
+        print(f"bundle saved at {output} ({os.path.getsize(output) / 2**20:.1f}MB, loads in {time.perf_counter() - start:.2f}s)")
+    else:
+        start = time.perf_counter()
+        model, meta = load_bundle(args.bundle)
+        print(f"loaded {meta['model']} ({meta['model_type']}) in {time.perf_counter() - start:.2f}s")
+        for path, label in zip(args.images, predict_images(model, meta, args.images, args.batch_size)):
+            print(f"{path}\t{label['class']}\t{label.get('mask', '')}\t{label.get('gender', '')}\t{label.get('age', '')}\t{label['score']:.3f}")
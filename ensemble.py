@@ -0,0 +1,171 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+
+def encode_multi_class(mask_label, gender_label, age_label):
+    '''
+    18 class 인코딩 (첫 번째 MaskBaseDataset.encode_multi_class 와 같은 식), numpy array 에 그대로 사용합니다.
+    '''
+    return mask_label * 6 + gender_label * 3 + age_label
+
+
+def decode_multi_class(code):
+    '''
+    encode_multi_class 의 역변환 (mask, gender, age) (MaskBaseDataset.decode_multi_class 와 같은 식)
+    '''
+    return (code // 6) % 3, (code // 3) % 2, code % 3
+
+
+# model_type 의 예측 class 를 (mask, gender, age) 중 해당하는 label 로 바꾸는 함수
+# MaskGender 의 class 는 mask+gender dataset (두 번째 MaskBaseDataset) 과 같이 mask * 6 + gender * 3 으로 인코딩된 값
+TASK_LABELS = {
+    'MaskBase': lambda pred: dict(zip(('mask', 'gender', 'age'), decode_multi_class(pred))),
+    'Mask': lambda pred: {'mask': pred},
+    'Gender': lambda pred: {'gender': pred},
+    'Age': lambda pred: {'age': pred},
+    'MaskGender': lambda pred: dict(zip(('mask', 'gender'), decode_multi_class(pred)[:2])),
+}
+
+
+def combine_predictions(preds):
+    '''
+    {model_type: 예측 class array} 를 18 class 로 합칩니다.
+    MaskBase 예측이 있으면 그 값을 기본으로 하고, Mask / Gender / Age / MaskGender 예측이 해당 label 을 덮어씁니다.
+    '''
+    labels = {}
+    for model_type in sorted(preds, key=lambda t: t != 'MaskBase'):
+        labels.update(TASK_LABELS[model_type](preds[model_type]))
+    missing = {'mask', 'gender', 'age'} - set(labels)
+    if missing:
+        raise RuntimeError(f"no model predicts {sorted(missing)} (given: {list(preds)})")
+    return encode_multi_class(labels['mask'], labels['gender'], labels['age'])
+
+
+### logit store ###
+def save_logits(output_dir, name, logits, meta):
+    '''
+    logits (N, num_classes) 를 {output_dir}/{name}.npy (float16 memmap) 로, meta 를 {name}.json 으로 저장합니다.
+    row 순서는 info.csv 의 ImageID 순서와 같습니다.
+    '''
+    path = os.path.join(output_dir, f'{name}.npy')
+    store = np.lib.format.open_memmap(path, mode='w+', dtype=np.float16, shape=tuple(logits.shape))
+    store[:] = logits
+    store.flush()
+    del store
+    meta = dict(meta, num_images=int(logits.shape[0]), num_classes=int(logits.shape[1]), dtype='float16')
+    with open(os.path.join(output_dir, f'{name}.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=4)
+    return path
+
+
+def load_logits(path):
+    '''
+    save_logits 로 저장한 logits 를 memmap 으로 열고 meta 와 함께 반환합니다. path 가 폴더이면 {path}/logits.npy
+    '''
+    if os.path.isdir(path):
+        path = os.path.join(path, 'logits.npy')
+    logits = np.load(path, mmap_mode='r')
+    meta_path = path[:-len('.npy')] + '.json'
+    meta = {}
+    if os.path.exists(meta_path):
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+    return logits, meta
+
+
+def save_val_logits(save_dir, logits, labels, indices, meta):
+    '''
+    best model 의 validation logits 를 val_logits.npy(.json), label 을 val_labels.npy, dataset index 를 val_indices.npy 로 저장합니다.
+    같은 split (seed, val_ratio, dataset) 으로 학습한 run 들은 val_indices 로 row 를 맞춰 ensemble weight 를 탐색할 수 있습니다.
+    '''
+    save_logits(save_dir, 'val_logits', logits, meta)
+    np.save(os.path.join(save_dir, 'val_labels.npy'), np.asarray(labels, dtype=np.int64))
+    np.save(os.path.join(save_dir, 'val_indices.npy'), np.asarray(indices, dtype=np.int64))
+
+
+def load_val_run(run_dir):
+    '''
+    save_val_logits 로 저장한 (logits, labels, indices, meta) 를 읽습니다.
+    '''
+    logits, meta = load_logits(os.path.join(run_dir, 'val_logits.npy'))
+    labels = np.load(os.path.join(run_dir, 'val_labels.npy'))
+    indices = np.load(os.path.join(run_dir, 'val_indices.npy'))
+    return logits, labels, indices, meta
+
+
+def softmax(logits):
+    logits = np.asarray(logits, dtype=np.float32)
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    probs = np.exp(logits)
+    return probs / probs.sum(axis=-1, keepdims=True)
+
+
+def vote(logits_list, weights=None, method='soft'):
+    '''
+    같은 model_type 의 logits 들을 weight 로 합쳐 (N, num_classes) 점수를 반환합니다.
+    - soft : softmax 확률의 가중합
+    - hard : argmax 의 가중 투표 수
+    '''
+    weights = np.ones(len(logits_list), dtype=np.float32) if weights is None else np.asarray(weights, dtype=np.float32)
+    scores = None
+    for logits, weight in zip(logits_list, weights):
+        if method == 'soft':
+            score = softmax(logits)
+        else:
+            score = np.eye(logits.shape[1], dtype=np.float32)[np.asarray(logits).argmax(axis=-1)]
+        scores = weight * score if scores is None else scores + weight * score
+    return scores
+
+
+def parse_run(item):
+    '''
+    "path[:weight]" 를 (path, weight) 로 변환합니다.
+    '''
+    path, _, weight = item.rpartition(':')
+    if not path or not weight.replace('.', '', 1).isdigit():
+        return item, 1.0
+    return path, float(weight)
+
+
+def ensemble(runs, method='soft'):
+    '''
+    [(logits path, weight)] 를 model_type 별로 vote 한 뒤 combine_predictions 로 18 class 예측을 반환합니다.
+    '''
+    groups = {}
+    num_images = None
+    for path, weight in runs:
+        logits, meta = load_logits(path)
+        if num_images is not None and logits.shape[0] != num_images:
+            raise RuntimeError(f'{path} has {logits.shape[0]} images, expected {num_images}')
+        num_images = logits.shape[0]
+        model_type = meta.get('model_type', 'MaskBase')
+        groups.setdefault(model_type, ([], []))
+        groups[model_type][0].append(logits)
+        groups[model_type][1].append(weight)
+        print(f"{model_type:<11}weight {weight:<5}{path} ({meta.get('model', '?')})")
+    preds = {model_type: vote(logits_list, weights, method).argmax(axis=-1) for model_type, (logits_list, weights) in groups.items()}
+    return combine_predictions(preds)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='soft / hard voting ensemble of stored inference logits (inference.py --save_logits)')
+    parser.add_argument('--runs', nargs='+', required=True, help='logits.npy paths or output dirs, optionally path:weight')
+    parser.add_argument('--method', type=str, default='soft', choices=['soft', 'hard'], help='soft: weighted mean of softmax, hard: weighted argmax vote (default: soft)')
+    parser.add_argument('--info', type=str, default=os.path.join(os.environ.get('SM_CHANNEL_EVAL', '/opt/ml/input/data/eval'), 'info.csv'), help='eval info.csv (ImageID order of the logits)')
+    parser.add_argument('--output', type=str, default='./output/ensemble.csv', help='output csv path (default: ./output/ensemble.csv)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    preds = ensemble([parse_run(item) for item in args.runs], args.method)
+    print(f"{len(args.runs)} runs, {len(preds)} images voted in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    import pandas as pd
+    info = pd.read_csv(args.info)
+    info['ans'] = preds
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    info.to_csv(args.output, index=False)
+    print(f"Ensemble Done! result saved at {args.output}")
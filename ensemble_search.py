@@ -0,0 +1,134 @@
+import argparse
+import json
+import time
+
+import numpy as np
+
+from ensemble import load_val_run, softmax # ensemble.py
+
+
+def align_runs(run_dirs):
+    '''
+    run 들의 validation logits 를 공통 val_indices 기준으로 정렬하여
+    probs (M, N, C), labels (N,), indices (N,) 를 반환합니다.
+    '''
+    runs = [load_val_run(run_dir) for run_dir in run_dirs]
+    common = runs[0][2]
+    for _, _, indices, _ in runs[1:]:
+        common = np.intersect1d(common, indices)
+    if len(common) == 0:
+        raise RuntimeError('runs share no validation images (trained with different seed / val_ratio / dataset?)')
+
+    probs, labels = [], None
+    for run_dir, (logits, run_labels, indices, meta) in zip(run_dirs, runs):
+        if logits.shape[1] != runs[0][0].shape[1]:
+            raise RuntimeError(f'{run_dir} has {logits.shape[1]} classes, expected {runs[0][0].shape[1]}')
+        order = np.argsort(indices)
+        rows = order[np.searchsorted(indices, common, sorter=order)]
+        probs.append(softmax(logits[rows]))
+        if labels is None:
+            labels = run_labels[rows]
+        elif not np.array_equal(labels, run_labels[rows]):
+            raise RuntimeError(f'{run_dir} has different labels for the same validation images')
+    return np.stack(probs), labels, common
+
+
+def weighted_f1(preds, labels, num_classes):
+    '''
+    후보 K 개의 예측 preds (K, N) 각각의 weighted F1 (K,) 을 한 번의 bincount 로 계산합니다.
+    confusion[k, t, p] = 후보 k 에서 label t 를 p 로 예측한 수
+    '''
+    k = preds.shape[0]
+    flat = (np.arange(k)[:, None] * num_classes + labels[None, :]) * num_classes + preds
+    confusion = np.bincount(flat.ravel(), minlength=k * num_classes * num_classes).reshape(k, num_classes, num_classes)
+    tp = np.diagonal(confusion, axis1=1, axis2=2).astype(np.float64)
+    support = confusion.sum(axis=2)
+    predicted = confusion.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        f1 = np.where(support + predicted > 0, 2 * tp / (support + predicted), 0.0)
+    return (f1 * support).sum(axis=1) / np.maximum(support.sum(axis=1), 1)
+
+
+def score_weights(weights, probs, labels):
+    '''
+    weight 후보 (K, M) 를 모두 평가합니다. 점수 (K, N, C) = weights @ probs 를 한 번에 계산
+    '''
+    scores = np.einsum('km,mnc->knc', weights, probs, optimize=True)
+    return weighted_f1(scores.argmax(axis=-1), labels, probs.shape[2])
+
+
+def greedy_selection(probs, labels, max_steps=20, patience=3):
+    '''
+    Caruana 식 greedy forward selection (중복 선택 허용)
+    매 step 마다 현재 조합에 모델 하나씩을 더한 M 개 후보를 한 번에 평가하여 가장 좋은 후보를 선택합니다.
+    모델별 선택 횟수 (M,) 를 weight 로 반환합니다.
+    '''
+    num_models = probs.shape[0]
+    counts = np.zeros(num_models)
+    best_counts, best_f1, best_step = counts, -1.0, 0
+    history = []
+    for step in range(max_steps):
+        candidates = counts[None, :] + np.eye(num_models)
+        f1 = score_weights(candidates, probs, labels)
+        choice = int(f1.argmax())
+        counts = candidates[choice]
+        history.append((choice, float(f1[choice])))
+        if f1[choice] > best_f1:
+            best_counts, best_f1, best_step = counts, float(f1[choice]), step
+        elif step - best_step >= patience:
+            break
+    return best_counts, best_f1, history
+
+
+def coordinate_ascent(probs, labels, weights, grid, rounds=5):
+    '''
+    모델마다 weight 를 grid 의 값으로 바꾼 후보들을 한 번에 평가하여 가장 좋은 값으로 바꾸는 것을 반복합니다.
+    grid 는 greedy 선택 횟수와 같은 scale (1 = 한 번 선택) 입니다.
+    '''
+    weights = np.array(weights, dtype=np.float64)
+    best_f1 = float(score_weights(weights[None, :], probs, labels)[0])
+    for _ in range(rounds):
+        improved = False
+        for m in range(len(weights)):
+            candidates = np.repeat(weights[None, :], len(grid), axis=0)
+            candidates[:, m] = grid
+            valid = candidates.sum(axis=1) > 0
+            f1 = np.where(valid, score_weights(candidates, probs, labels), -1.0)
+            choice = int(f1.argmax())
+            if f1[choice] > best_f1 + 1e-9:
+                weights, best_f1, improved = candidates[choice], float(f1[choice]), True
+        if not improved:
+            break
+    return weights / weights.sum(), best_f1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='search ensemble members / weights on stored validation logits (val_logits.npy of train.py runs)')
+    parser.add_argument('--runs', nargs='+', required=True, help='train.py save dirs with val_logits.npy, val_labels.npy, val_indices.npy')
+    parser.add_argument('--max_steps', type=int, default=20, help='greedy forward selection steps (default: 20)')
+    parser.add_argument('--patience', type=int, default=3, help='stop greedy selection after this many steps without improvement (default: 3)')
+    parser.add_argument('--grid', nargs='+', type=float, default=[0, 0.25, 0.5, 0.75, 1, 1.5, 2, 3], help='weights tried by coordinate ascent')
+    parser.add_argument('--rounds', type=int, default=5, help='coordinate ascent rounds (default: 5)')
+    parser.add_argument('--output', type=str, default='./ensemble_weights.json', help='selected weights json (default: ./ensemble_weights.json)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    probs, labels, indices = align_runs(args.runs)
+    num_models = probs.shape[0]
+    print(f"{num_models} runs, {len(indices)} common validation images, {probs.shape[2]} classes")
+
+    single = score_weights(np.eye(num_models), probs, labels)
+    for run_dir, f1 in sorted(zip(args.runs, single), key=lambda item: -item[1]):
+        print(f"    single {f1:.4f}  {run_dir}")
+    uniform = float(score_weights(np.ones((1, num_models)), probs, labels)[0])
+    greedy_weights, greedy_f1, _ = greedy_selection(probs, labels, args.max_steps, args.patience)
+    weights, best_f1 = coordinate_ascent(probs, labels, greedy_weights, np.array(args.grid), args.rounds)
+    elapsed = time.perf_counter() - start
+
+    print(f"best single {single.max():.4f} | uniform {uniform:.4f} | greedy {greedy_f1:.4f} | coordinate ascent {best_f1:.4f} ({elapsed:.2f}s)")
+    members = [{'run': run_dir, 'weight': float(weight)} for run_dir, weight in zip(args.runs, weights) if weight > 0]
+    for member in members:
+        print(f"    weight {member['weight']:.3f}  {member['run']}")
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'val_f1': best_f1, 'num_images': int(len(indices)), 'members': members}, f, ensure_ascii=False, indent=4)
+    print(f"weights saved at {args.output} (use them as ensemble.py --runs <test logits>:<weight>)")
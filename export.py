@@ -0,0 +1,122 @@
+import argparse
+import json
+import os
+
+import torch
+import torch.nn as nn
+
+from inference import OPTIMIZE_FLAG, load_member, load_model # inference.py
+from model import make_traceable # model.py
+from quantize import latency # quantize.py
+
+
+def count_batchnorm(model):
+    return sum(isinstance(m, nn.modules.batchnorm._BatchNorm) for m in model.modules())
+
+
+def fuse_conv_bn(model):
+    '''
+    torch.fx 로 trace 하여 Conv2d 바로 뒤의 BatchNorm2d 를 conv 의 weight / bias 로 합칩니다. (eval 모드 전용)
+    efficientnet_pytorch 의 Conv2dStaticSamePadding 처럼 fx 가 module 로 보지 않는 conv 나 trace 가 안 되는 모델은
+    그대로 반환하며, 이 경우 torch.jit.freeze 가 graph 에서 conv + batch_norm 을 folding 합니다.
+    ReLU 는 합치지 않습니다. CPU fp32 에는 conv + relu 를 한 kernel 로 실행하는 경로가 없어 (ConvReLU2d 도 trace 하면 conv, relu 두 op)
+    optimize_for_inference 후에도 MKLDNN tensor 위의 in-place relu 로 남습니다. (export.json 의 graph_ops 에 기록)
+    '''
+    from torch.fx.experimental.optimization import fuse
+    try:
+        return fuse(model)
+    except Exception as e: # fx trace 실패 (data dependent control flow 등)
+        print(f"fx conv-bn fusion skipped ({type(e).__name__}: {e}), relying on graph folding in freeze")
+        return model
+
+
+def export_torchscript(model, example_inputs):
+    '''
+    trace -> freeze (parameter 를 상수로, conv-bn folding, dropout 제거)
+    optimize_for_inference (conv-add/mul folding, MKLDNN 변환) 결과는 torch.jit.save 로 저장되지 않으므로 load_model 이 로드할 때 적용합니다.
+    '''
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example_inputs)
+    return torch.jit.freeze(traced.eval())
+
+
+def count_graph_ops(scripted, op):
+    return str(scripted.inlined_graph if hasattr(scripted, 'inlined_graph') else scripted.graph).count(op)
+
+
+@torch.no_grad()
+def parity(eager, exported, inputs):
+    '''
+    eager 모델과 export 한 모델의 logits 최대 절대 오차와 argmax 일치율
+    '''
+    expected = eager(inputs).float()
+    actual = exported(inputs).float()
+    return {
+        'max_abs_diff': float((expected - actual).abs().max()),
+        'argmax_agreement': float((expected.argmax(-1) == actual.argmax(-1)).float().mean()),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='export a trained model as a Conv-BN fused, frozen and optimized TorchScript graph')
+    parser.add_argument('--model_dir', type=str, required=True, help='train.py save dir (best.safetensors or best.pth + config.json)')
+    parser.add_argument('--model_type', type=str, default='MaskBase', help='MaskBase, Mask, Gender, Age or MaskGender (default: MaskBase)')
+    parser.add_argument('--model', type=str, default='BaseModel', help='model type if config.json is missing (default: BaseModel)')
+    parser.add_argument('--resize', nargs=2, type=int, default=None, help='input size H W (default: resize in config.json)')
+    parser.add_argument('--device', type=str, default='cpu', help='device the graph is exported / optimized for (default: cpu)')
+    parser.add_argument('--no_optimize', action='store_true', help='do not apply torch.jit.optimize_for_inference when the graph is loaded')
+    parser.add_argument('--parity_batch', type=int, default=8, help='random inputs for the parity check (default: 8)')
+    parser.add_argument('--atol', type=float, default=1e-3, help='max allowed |logit| difference vs eager (default: 1e-3)')
+    parser.add_argument('--latency_batch_sizes', nargs='+', type=int, default=[1, 32], help='batch sizes for latency (default: 1 32)')
+    parser.add_argument('--steps', type=int, default=10, help='measured steps for latency (default: 10)')
+    parser.add_argument('--output_dir', type=str, default=None, help='artifact dir (default: {model_dir}/export)')
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    config = {}
+    config_path = os.path.join(args.model_dir, 'config.json')
+    if os.path.exists(config_path):
+        with open(config_path, encoding='utf-8') as f:
+            config = json.load(f)
+    args.resize = tuple(args.resize or config.get('resize', (512, 384)))
+    output_dir = args.output_dir or os.path.join(args.model_dir, 'export')
+
+    eager, _ = load_member(args.model_type, args.model_dir, args, device)
+    eager = make_traceable(eager) # efficientnet 은 trace 가능한 Swish 로
+    batchnorms = count_batchnorm(eager)
+    fused = fuse_conv_bn(eager)
+    print(f"{type(eager).__name__}: {batchnorms} BatchNorm modules, {count_batchnorm(fused)} left after fx fusion")
+
+    example_inputs = (torch.randn(1, 3, *args.resize, device=device),)
+    frozen = export_torchscript(fused, example_inputs)
+    graph_ops = {op: count_graph_ops(frozen, f'aten::{op}') for op in ('_convolution', 'batch_norm', 'relu')}
+    print(f"frozen graph: {graph_ops['batch_norm']} batch_norm ops left, {graph_ops['relu']} relu ops (not fused into conv)")
+
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, 'best.pt')
+    torch.jit.save(frozen, path, _extra_files={OPTIMIZE_FLAG: '0' if args.no_optimize else '1'})
+    # inference.py 와 같은 경로로 다시 로드한 모델로 parity / latency 확인
+    exported = load_model(output_dir, None, device, None)
+
+    inputs = torch.randn(args.parity_batch, 3, *args.resize, device=device)
+    check = parity(eager, exported, inputs)
+    print(f"parity: max |diff| {check['max_abs_diff']:.2e}, argmax agreement {check['argmax_agreement']:.2%}")
+    if check['max_abs_diff'] > args.atol:
+        os.remove(path)
+        raise RuntimeError(f"exported model differs from eager by {check['max_abs_diff']:.2e} > atol {args.atol}, {path} removed")
+
+    report = {'model': config.get('model', args.model), 'parity': check, 'batchnorm_modules': batchnorms, 'graph_ops': graph_ops, 'latency': {}}
+    if device.type == 'cpu':
+        print(f"{'batch':>6}{'eager ms':>11}{'export ms':>11}{'speedup':>9}")
+        for batch_size in args.latency_batch_sizes:
+            base = latency(eager, batch_size, args.resize, args.steps, warmup=2)
+            # optimize_for_inference 결과는 첫 몇 번의 호출에서 graph 를 다시 최적화하므로 warmup 을 늘림
+            fast = latency(exported, batch_size, args.resize, args.steps, warmup=3)
+            report['latency'][batch_size] = {'eager': base, 'export': fast}
+            print(f"{batch_size:>6}{base['ms_per_step']:>11.1f}{fast['ms_per_step']:>11.1f}{base['ms_per_step'] / fast['ms_per_step']:>8.2f}x")
+
+    with open(os.path.join(output_dir, 'config.json'), 'w', encoding='utf-8') as f:
+        json.dump(dict(config, model=report['model'], resize=list(args.resize), export='frozen' if args.no_optimize else 'optimized'), f, ensure_ascii=False, indent=4)
+    with open(os.path.join(output_dir, 'export.json'), 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+    print(f"exported graph saved at {path} (run: python inference.py --model_dir {output_dir})")
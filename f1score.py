@@ -1,5 +1,4 @@
-from sklearn.metrics import f1_score
-from sklearn.metrics import confusion_matrix
+# sklearn 은 import 가 느려서 score 를 계산할 때 import 합니다.
 class get_F1_Score:
     def __init__(self):
         self.reset()
@@ -11,9 +10,11 @@ class get_F1_Score:
         self.y_pred.extend(prediction.cpu())
     @property
     def get_score(self):
+        from sklearn.metrics import f1_score
         f1 = f1_score(self.y_true,self.y_pred,average = 'weighted')
         return f1
     @property
     def get_cm(self):
+        from sklearn.metrics import confusion_matrix
         cm = confusion_matrix(self.y_true, self.y_pred)
         return cm
\ No newline at end of file
@@ -0,0 +1,73 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_importtime(stderr):
+    '''
+    `python -X importtime` 출력을 (depth, module, self_us, cumulative_us) 리스트로 변환합니다.
+    depth 0 은 실행한 코드가 직접 import 한 module 입니다.
+    '''
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((depth, name.strip(), int(self_us), int(cumulative_us)))
+    return entries
+
+
+def measure_startup(command):
+    '''
+    command(python 인자 리스트)를 -X importtime 으로 실행하여 wall time(s)과 import 기록을 반환합니다.
+    '''
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-X', 'importtime'] + command, cwd=ROOT,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - start
+    if proc.returncode != 0:
+        errors = [line for line in proc.stderr.splitlines() if not line.startswith('import time:')]
+        raise RuntimeError(f"{' '.join(command)} failed ({proc.returncode}):\n" + '\n'.join(errors[-10:]))
+    return elapsed, parse_importtime(proc.stderr)
+
+
+def summarize(entries, top=15):
+    '''
+    top-level package 별 누적 import 시간(ms) 상위 top 개를 반환합니다.
+    '''
+    packages = defaultdict(int)
+    for depth, name, _, cumulative_us in entries:
+        if depth == 0:
+            packages[name.split('.')[0]] += cumulative_us
+    return sorted(((name, us / 1000) for name, us in packages.items()), key=lambda p: -p[1])[:top]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='summarize `python -X importtime` of the entry points and check a startup budget')
+    parser.add_argument('--commands', nargs='+', default=['train.py --help', 'inference.py --help', 'import model'],
+                        help="scripts with args, or 'import <module>' (default: train.py --help, inference.py --help, import model)")
+    parser.add_argument('--top', type=int, default=15, help='number of packages to show per command (default: 15)')
+    parser.add_argument('--budget', type=float, default=None, help='fail (exit 1) if any command takes longer than this many seconds')
+    args = parser.parse_args()
+
+    over_budget = []
+    for command in args.commands:
+        argv = ['-c', command] if command.startswith('import ') else command.split()
+        elapsed, entries = measure_startup(argv)
+        print(f"== {command} : {elapsed:.2f}s wall, {sum(e[3] for e in entries if e[0] == 0) / 1e6:.2f}s in imports")
+        for name, ms in summarize(entries, args.top):
+            print(f"    {name:<32}{ms:>10.1f} ms")
+        if args.budget is not None and elapsed > args.budget:
+            over_budget.append((command, elapsed))
+
+    for command, elapsed in over_budget:
+        print(f"OVER BUDGET {command}: {elapsed:.2f}s > {args.budget:.2f}s")
+    if over_budget:
+        sys.exit(1)
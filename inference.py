@@ -1,17 +1,29 @@
 import argparse
+import hashlib
+import json
 import multiprocessing
 import os
-from importlib import import_module
+import queue
 import time
 import datetime
+from importlib import import_module
 
-import pandas as pd
+import numpy as np
 import torch
 from torch.utils.data import DataLoader
 from tqdm import tqdm
 import csv
+# pandas 는 import 가 느려서 (--help 도 느려짐) csv 를 읽는 함수 안에서 import 합니다.
+
+from dataset import TestDataset, MultiResizeTestDataset # dataset.py
+from profiling import ProfileWindow, parse_step_window # profiling.py
+from model import create_model_from_state_dict # model.py
+from checkpoint import find_checkpoint, load_checkpoint # checkpoint.py
+from ensemble import combine_predictions, save_logits # ensemble.py
 
-from dataset import TestDataset, MaskBaseDataset, MaskDataset, GenderDataset, AgeDataset, MaskGenderDataset
+
+# export.py 가 best.pt 에 기록하는 extra file, '1' 이면 로드할 때 torch.jit.optimize_for_inference 적용
+OPTIMIZE_FLAG = 'optimize_for_inference'
 
 
 def load_model(saved_model, num_classes, device, import_model):
@@ -22,16 +34,12 @@ def load_model(saved_model, num_classes, device, import_model):
     num_classes  :  모델의 클래스 수를 나타내며, 이 매개변수는 모델 객체를 생성할 때 사용됩니다. 
     device       :  모델이 실행될 디바이스(CPU 또는 GPU)를 나타냅니다.
     - 변수 설명
-    model_cls    : 모듈 이름이 model인 모듈에서 args.model로 지정된 클래스를 가져옵니다. 이 코드에서는 getattr 함수를 사용하여 동적으로 모듈에서 클래스를 가져옵니다.
-    model        : model_cls에서 생성된 모델 객체입니다. num_classes를 인자로 전달하여 생성자에서 모델의 클래스 수를 설정합니다.
-    model_path   : saved_model 경로와 best.pth 파일 이름을 결합하여 모델 파일의 전체 경로를 지정합니다. 
-                   이후 torch.load 함수를 사용하여 모델 파일을 읽어들이고, map_location 매개변수를 사용하여 모델이 실행될 디바이스를 설정합니다. 
+    model        : model.py 의 create_model_from_state_dict 로 생성된 모델 객체입니다.
+                   pretrained weight 를 load 하지 않고 architecture 만 만든 뒤 checkpoint 의 tensor 로 parameter 를 채웁니다.
+    model_path   : saved_model 경로의 best.safetensors (없으면 best.pth, best.pt) 파일 경로입니다. best.pt (TorchScript) 는 torch.jit.load 로 바로 반환합니다. safetensors header 의 model, num_classes 가 있으면 그 값을 사용합니다. 
+                   이후 checkpoint.load_checkpoint 로 모델 파일을 읽어들이고 (.safetensors 는 mmap, fp16/bf16 은 fp32 로 변환), map_location 매개변수를 사용하여 모델이 실행될 디바이스를 설정합니다. 
                    마지막으로, 함수는 로드된 모델 객체를 반환합니다.
     '''
-    model_cls = getattr(import_module("model"), import_model)
-    model = model_cls(
-        num_classes=num_classes
-    )
 
     '''
     주석 처리된 코드는 .tar.gz 파일을 압축 해제하는 코드입니다.
@@ -41,248 +49,699 @@ def load_model(saved_model, num_classes, device, import_model):
     # tar = tarfile.open(tarpath, 'r:gz')
     # tar.extractall(path=saved_model)
 
-    model_path = os.path.join(saved_model, 'best.pth')
-    model.load_state_dict(torch.load(model_path, map_location=device))
+    model_path = find_checkpoint(saved_model, 'best') # best.safetensors (mmap), best.pth 또는 best.pt (TorchScript)
+    if model_path.endswith('.pt'):
+        # quantize.py / export.py 로 만든 TorchScript 모델은 model.py 없이 graph 를 그대로 로드
+        extra_files = {OPTIMIZE_FLAG: ''}
+        model = torch.jit.load(model_path, map_location=device, _extra_files=extra_files)
+        if extra_files[OPTIMIZE_FLAG] in ('1', b'1'):
+            model = torch.jit.optimize_for_inference(model)
+        return model
+    state_dict, metadata = load_checkpoint(model_path, map_location=device, dtype=torch.float32)
+    if metadata.get('model', import_model) != import_model:
+        print(f"{model_path} was saved from {metadata['model']}, using it instead of {import_model}")
+    # pretrained weight 없이 architecture 만 만들고 checkpoint 의 tensor 로 바로 채움
+    model = create_model_from_state_dict(metadata.get('model', import_model), state_dict, device=device,
+                                         num_classes=int(metadata.get('num_classes', num_classes)))
 
     return model
 
 
+# model_type 별 dataset class 이름 (num_classes 는 실행할 때 dataset.py 에서 찾음)
+INFERENCE_TASKS = {
+    'MaskBase': 'MaskBaseDataset',      # 18 (MaskBaseDataset 이 다시 정의되어 있으면 그 값)
+    'Mask': 'MaskDataset',              # 3
+    'Gender': 'GenderDataset',          # 2
+    'Age': 'AgeDataset',                # 3
+    'MaskGender': 'MaskBaseDataset',    # mask+gender dataset (dataset.py 의 두 번째 MaskBaseDataset), class = mask * 6 + gender * 3 (ensemble.TASK_LABELS)
+}
+
+
+def task_num_classes(model_type):
+    '''
+    model_type 에 해당하는 dataset class 의 num_classes
+    '''
+    if model_type not in INFERENCE_TASKS:
+        raise RuntimeError('Unknown inference model_type (%s), choose from %s' % (model_type, list(INFERENCE_TASKS)))
+    dataset_name = INFERENCE_TASKS[model_type]
+    dataset_module = import_module("dataset")
+    if not hasattr(dataset_module, dataset_name):
+        raise RuntimeError(f'{dataset_name} for model_type {model_type} is not defined in dataset.py')
+    return getattr(dataset_module, dataset_name).num_classes
+
+
+def select_device(args):
+    '''
+    --device 가 주어지면 그 device, 아니면 cuda 가 있으면 cuda (int8 quantized 모델은 --device cpu 로 실행)
+    '''
+    if getattr(args, 'device', None):
+        return torch.device(args.device)
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+def make_loader(img_paths, resize, batch_size, num_workers, use_cuda):
+    '''
+    TestDataset 을 num_workers 개의 worker 가 미리 decode 하는 DataLoader
+    worker 가 다음 batch 를 decode 하는 동안 main process 는 현재 batch 를 추론합니다.
+    '''
+    dataset = TestDataset(img_paths, resize)
+    return DataLoader(
+        dataset,
+        batch_size=batch_size,
+        num_workers=num_workers,
+        shuffle=False,
+        pin_memory=use_cuda,
+        drop_last=False,
+        **({'prefetch_factor': 2} if num_workers > 0 else {}),
+    )
+
+
+def _crop_resize(images, top, left, scale):
+    '''
+    (top, left) 비율 위치에서 scale 크기로 자른 뒤 원래 크기로 되돌린 batch
+    '''
+    h, w = images.shape[-2:]
+    ch, cw = int(h * scale), int(w * scale)
+    y, x = int((h - ch) * top), int((w - cw) * left)
+    crop = images[..., y:y + ch, x:x + cw]
+    return torch.nn.functional.interpolate(crop, size=(h, w), mode='bilinear', align_corners=False)
+
+
+# TTA variant 이름 -> batch 변환 함수 (입력은 normalize 된 (B, C, H, W))
+TTA_VARIANTS = {
+    'identity': lambda images: images,
+    'hflip': lambda images: images.flip(-1),
+    'crop_center': lambda images: _crop_resize(images, 0.5, 0.5, 0.9),
+    'crop_tl': lambda images: _crop_resize(images, 0, 0, 0.9),
+    'crop_tr': lambda images: _crop_resize(images, 0, 1, 0.9),
+    'crop_bl': lambda images: _crop_resize(images, 1, 0, 0.9),
+    'crop_br': lambda images: _crop_resize(images, 1, 1, 0.9),
+}
+
+TTA_POLICIES = {
+    'none': ('identity',),
+    'flip': ('identity', 'hflip'),
+    'crop': ('identity', 'crop_tl', 'crop_tr', 'crop_bl', 'crop_br'),
+    'flip_crop': ('identity', 'hflip', 'crop_center', 'crop_tl', 'crop_tr', 'crop_bl', 'crop_br'),
+}
+
+
+class TTAModel(torch.nn.Module):
+    '''
+    decode 된 batch 에서 policy 의 variant 들을 만들어 하나의 batch 로 이어 붙이고 한 번의 forward 후 이미지별 logits 평균을 반환하는 wrapper
+    batch 크기가 variant 수 만큼 커지므로 메모리가 부족하면 --batch_size 를 줄여야 합니다.
+    '''
+    def __init__(self, model, policy='flip'):
+        super().__init__()
+        self.model = model
+        self.policy = policy
+        self.variants = [TTA_VARIANTS[name] for name in TTA_POLICIES[policy]]
+
+    def forward(self, images):
+        if len(self.variants) == 1:
+            return self.model(images)
+        batch = torch.cat([variant(images) for variant in self.variants])
+        logits = self.model(batch)
+        return logits.view(len(self.variants), images.shape[0], -1).mean(dim=0)
+
+
+def wrap_tta(model, policy):
+    return model if policy in (None, 'none') else TTAModel(model, policy).eval()
+
+
 @torch.no_grad()
-def inference(data_dir, model_dir, output_dir, args):
+def predict(model, loader, device, num_classes, profile_window=None):
+    '''
+    loader 의 모든 batch 를 추론하여 logits (N, num_classes) 를 CPU tensor 로 반환하고 images/s 를 출력합니다.
+    이미지가 없으면 (0, num_classes) tensor 를 반환합니다.
+    '''
+    logits = []
+    num_images = 0
+    start = time.perf_counter()
+    for images in tqdm(loader):
+        images = images.to(device, non_blocking=True)
+        logits.append(model(images).float().cpu())
+        num_images += len(images)
+        if profile_window is not None:
+            profile_window.step()
+    if profile_window is not None:
+        profile_window.stop()
+    elapsed = time.perf_counter() - start
+    print(f"{num_images} images in {elapsed:.1f}s ({num_images / max(elapsed, 1e-9):.1f} images/s)")
+    return torch.cat(logits) if logits else torch.empty(0, num_classes)
+
+
+@torch.no_grad()
+def run_inference(data_dir, model_dir, output_dir, args, model_type='MaskBase'):
     """
     - 클래스 설명
-    모델을 사용하여 이미지를 추론하고, 추론 결과를 저장하는 함수
-    @torch.no_grad() : PyTorch의 기능 중 하나인 gradient 계산을 하지 않도록 하는 함수 데코레이터입니다. 
-                       이것은 모델 추론 시 메모리 사용량을 줄이고 추론 속도를 높이는 데 도움이 됩니다.
-    
+    모델을 사용하여 이미지를 추론하고, 추론 결과를 output.csv 로 저장하는 함수
+    mask / gender / age / mask+gender / 전체(18 class) 추론을 model_type 으로 구분합니다.
+
     - 클래스 인자
     data_dir   : 테스트 데이터의 디렉토리 경로
     model_dir  : 학습된 모델의 디렉토리 경로
     output_dir :  추론 결과를 저장할 디렉토리 경로
     args       :  다른 인자들을 받아들이기 위한 argparse.ArgumentParser() 인스턴스를 이용한 변수들임
+                  (model, resize, batch_size, num_workers, num_threads, profile_steps)
+    model_type : INFERENCE_TASKS 의 key (MaskBase, Mask, Gender, Age, MaskGender)
     - 함수 변수 및 내부 구현 설명
-    use_cuda : GPU를 사용할 수 있는지를 확인
-    device :  사용 가능하다면 GPU를 사용하고, 그렇지 않으면 CPU를 사용합니다.
-    num_classes :  MaskBaseDataset 클래스의 클래스 변수인 num_classes의 값을 가져와서 정의합니다. 
-    model : load_model 함수를 사용하여 모델을 불러옵니다. 모델을 불러온 후 model.eval() 함수를 사용하여 모델을 평가 모드로 전환합니다.
-    img_root :  data_dir와 'images'를 결합하여 이미지가 저장된 디렉토리 경로를 설정합니다.
-    info_path : data_dir와 'info.csv'를 결합하여 이미지 정보가 저장된 csv 파일의 경로를 설정합니다. 
-    info : pd.read_csv 함수를 사용하여 info_path(csv 파일)에서 정보를 읽어옵니다.
-    img_paths : img_root와 각 이미지 파일의 이름을 결합하여 이미지 파일들의 경로 리스트를 만듭니다. 
-    dataset : img_paths를 이용하여 TestDataset 클래스의 인스턴스를 생성합니다. 
-    loader :  torch.utils.data.DataLoader 함수를 사용하여 데이터를 로드합니다
-    preds : 추론 결과를 저장할 리스트를 생성합니다. 
-    torch.no_grad() 블록을 사용하여 gradient 계산을 하지 않도록 설정합니다. 
-    loader에서 데이터를 읽어와 모델을 이용하여 추론을 수행합니다. 이후 추론 결과를 저장합니다.
+    num_classes : model_type 에 해당하는 dataset class 의 num_classes
+    model : load_model 함수를 사용하여 모델을 불러온 후 평가 모드로 전환합니다.
+    info : pd.read_csv 함수를 사용하여 info.csv 에서 정보를 읽어옵니다.
+    loader : num_workers 개의 worker 가 decode 를 미리 수행하는 DataLoader (make_loader)
+    preds : predict 로 구한 logits 의 argmax
     """
-    use_cuda = torch.cuda.is_available()
-    device = torch.device("cuda" if use_cuda else "cpu")
+    device = select_device(args)
+    use_cuda = device.type == 'cuda'
+    if getattr(args, 'num_threads', None):
+        torch.set_num_threads(args.num_threads)
 
-    num_classes = MaskBaseDataset.num_classes  # 18 or 3 or 2
-    import_model = args.model
-    model = load_model(model_dir, num_classes, device, import_model).to(device)
-    model.eval()
+    num_classes = task_num_classes(model_type)
 
     img_root = os.path.join(data_dir, 'images')
     info_path = os.path.join(data_dir, 'info.csv')
+    import pandas as pd
     info = pd.read_csv(info_path)
 
     img_paths = [os.path.join(img_root, img_id) for img_id in info.ImageID]
-    dataset = TestDataset(img_paths, args.resize)
-    loader = torch.utils.data.DataLoader(
-        dataset,
-        batch_size=args.batch_size,
-#         num_workers=multiprocessing.cpu_count() // 2,
-        shuffle=False,
-        pin_memory=use_cuda,
-        drop_last=False,
-    )
-
-    print("Calculating inference results..")
-    preds = []
-    with torch.no_grad():
-        for idx, images in enumerate(loader):
-            images = images.to(device)
-            pred = model(images)
-            pred = pred.argmax(dim=-1)
-            preds.extend(pred.cpu().numpy())
-
-    info['ans'] = preds
+    num_workers = getattr(args, 'num_workers', multiprocessing.cpu_count() // 2)
+
+    # --cache : 내용 / checkpoint / 전처리가 같은 이미지는 저장된 logits 를 사용하고 나머지만 추론
+    cache = None
+    todo = list(range(len(img_paths)))
+    if getattr(args, 'cache', None):
+        from prediction_cache import PredictionCache, hash_images # prediction_cache.py
+        cache = PredictionCache(args.cache)
+        digests = hash_images(img_paths)
+        checkpoint, preprocess = _cache_keys(cache, model_type, model_dir, args.model, args.resize, args)
+        cached = cache.get_many(digests, checkpoint, preprocess)
+        todo = [i for i, digest in enumerate(digests) if digest not in cached]
+        print(f"prediction cache {args.cache}: {len(img_paths) - len(todo)}/{len(img_paths)} hits ({cache.hit_rate:.1%})")
+
+    logits = torch.empty(0, num_classes)
+    if todo:
+        model = load_model(model_dir, num_classes, device, args.model).to(device)
+        model.eval()
+        model = wrap_tta(model, getattr(args, 'tta', None))
+        loader = make_loader([img_paths[i] for i in todo], args.resize, args.batch_size, num_workers, use_cuda)
+
+        print(f"Calculating {model_type} inference results (tta: {getattr(args, 'tta', None) or 'none'})..")
+        profile_steps = getattr(args, 'profile_steps', None)
+        profile_window = ProfileWindow(parse_step_window(profile_steps), output_dir) if profile_steps else None
+        logits = predict(model, loader, device, num_classes, profile_window)
+    if cache is not None:
+        if todo:
+            cache.put_many([digests[i] for i in todo], logits.numpy(), checkpoint, preprocess)
+        merged = {digest: row for digest, row in zip((digests[i] for i in todo), logits.numpy())}
+        if digests:
+            logits = torch.from_numpy(np.stack([cached[d] if d in cached else merged[d] for d in digests]))
+        cache.close()
+    preds = logits.argmax(dim=-1)
+    if getattr(args, 'save_logits', False):
+        path = save_logits(output_dir, 'logits', logits.numpy(),
+                           dict(model_type=model_type, model=args.model, model_dir=model_dir, info=info_path))
+        print(f"logits saved at {path}")
+
+    info['ans'] = preds.numpy()
     save_path = os.path.join(output_dir, f'output.csv')
     info.to_csv(save_path, index=False)
-    print(f"Inference Done! Inference result saved at {save_path}")
+    print(f"{model_type} Inference Done! Inference result saved at {save_path}")
+
 
+def inference(data_dir, model_dir, output_dir, args):
+    return run_inference(data_dir, model_dir, output_dir, args, 'MaskBase')
 
 
 '''
 - inference.py 실행 부분
 스크립트 파일을 실행할 때, argparse 모듈을 사용하여 명령행 인수를 구문 분석하고,
-생성할 디렉토리를 만든 다음 inference() 함수를 호출합니다.
+생성할 디렉토리를 만든 다음 run_inference() 함수를 호출합니다.
     - 구현
     argparse 모듈을 사용하여 명령행 인수를 구문 분석합니다
     data_dir, model_dir, output_dir 변수를 선언하고,
     이 변수들에는 각각 args.data_dir, args.model_dir, args.output_dir 값을 할당합니다.
     그리고나서 os.makedirs() 함수를 사용하여 output_dir에 해당하는 디렉토리를 생성합니다.
     생성할 디렉토리가 이미 존재하면 새로 생성하지 않고 그대로 유지합니다.(os.makedirs(output_dir, exist_ok=True))
-    마지막으로 inference() 함수를 호출하고, data_dir, model_dir, output_dir, args를 인자로 전달합니다.
+    마지막으로 run_inference() 함수를 호출하고, data_dir, model_dir, output_dir, args, model_type 을 인자로 전달합니다.
 '''
 
 
-@torch.no_grad()
 def mask_inference(data_dir, model_dir, output_dir, args):
-    use_cuda = torch.cuda.is_available()
-    device = torch.device("cuda" if use_cuda else "cpu")
+    return run_inference(data_dir, model_dir, output_dir, args, 'Mask')
+
 
-    num_classes = MaskDataset.num_classes  # 3
-    import_model = args.model
-    model = load_model(model_dir, num_classes, device, import_model).to(device) # load_model(saved_model, num_classes, device)
+def gender_inference(data_dir, model_dir, output_dir, args):
+    return run_inference(data_dir, model_dir, output_dir, args, 'Gender')
+
+
+def age_inference(data_dir, model_dir, output_dir, args):
+    return run_inference(data_dir, model_dir, output_dir, args, 'Age')
+
+
+def maskgender_inference(data_dir, model_dir, output_dir, args):
+    return run_inference(data_dir, model_dir, output_dir, args, 'MaskGender')
+
+
+def parse_members(members):
+    '''
+    ["Mask=./model/mask", "Age=./model/age", ...] 를 [(model_type, model_dir)] 로 변환합니다.
+    '''
+    parsed = []
+    for member in members:
+        model_type, model_dir = member.split('=', 1)
+        if model_type not in INFERENCE_TASKS:
+            raise RuntimeError('Unknown inference model_type (%s), choose from %s' % (model_type, list(INFERENCE_TASKS)))
+        if model_type in dict(parsed):
+            raise RuntimeError(f'model_type {model_type} is given twice')
+        parsed.append((model_type, model_dir))
+    return parsed
+
+
+def load_member(model_type, model_dir, args, device):
+    '''
+    model_dir 의 config.json (train.py 가 저장) 에서 model, resize 를 읽어 모델을 불러옵니다. 없으면 args 의 값을 사용합니다.
+    '''
+    config = {}
+    config_path = os.path.join(model_dir, 'config.json')
+    if os.path.exists(config_path):
+        with open(config_path, encoding='utf-8') as f:
+            config = json.load(f)
+    model = load_model(model_dir, task_num_classes(model_type), device, config.get('model', args.model)).to(device)
     model.eval()
+    return model, tuple(int(v) for v in config.get('resize', args.resize))
 
-    img_root = os.path.join(data_dir, 'images')
-    info_path = os.path.join(data_dir, 'info.csv')
-    info = pd.read_csv(info_path)
 
+def _cache_keys(cache, model_type, model_dir, model_name, resize, args):
+    '''
+    --cache 에서 model_dir 의 checkpoint hash 와 전처리 설정 key. run_inference 와 fused_inference 가 같은 key 를 사용합니다.
+    '''
+    from prediction_cache import config_key # prediction_cache.py
+    checkpoint = cache.checkpoint_digest(find_checkpoint(model_dir, 'best'))
+    preprocess = config_key(dict(model_type=model_type, model=model_name, num_classes=task_num_classes(model_type),
+                                 transform=repr(TestDataset([], tuple(resize)).transform), tta=getattr(args, 'tta', None)))
+    return checkpoint, preprocess
+
+
+@torch.no_grad()
+def fused_inference(data_dir, members, output_dir, args):
+    '''
+    여러 모델(members)을 한 번에 불러와 이미지를 한 번만 decode 하고, 같은 batch 로 모든 모델을 추론하여
+    combine_predictions 로 합친 18 class 결과를 output.csv 로 저장합니다.
+    입력 크기(resize)가 다른 모델이 있으면 decode 한 이미지를 resize 별로 한 번씩만 변환합니다.
+    --cache 이면 member 마다 캐시를 찾고, 어느 member 라도 캐시에 없는 이미지만 decode 하여 각 member 는 자기 miss 만 추론합니다.
+    '''
+    device = select_device(args)
+    use_cuda = device.type == 'cuda'
+    if getattr(args, 'num_threads', None):
+        torch.set_num_threads(args.num_threads)
+
+    loaded = []
+    resizes = []
+    member_keys = []
+    for model_type, model_dir in parse_members(members):
+        model, resize = load_member(model_type, model_dir, args, device)
+        member_keys.append((model_type, model_dir, type(model).__name__, resize))
+        model = wrap_tta(model, getattr(args, 'tta', None))
+        if resize not in resizes:
+            resizes.append(resize)
+        loaded.append((model_type, model, resizes.index(resize)))
+        print(f"{model_type:<11}{type(model).__name__} from {model_dir}, resize {resize}")
+
+    img_root = os.path.join(data_dir, 'images')
+    import pandas as pd
+    info = pd.read_csv(os.path.join(data_dir, 'info.csv'))
     img_paths = [os.path.join(img_root, img_id) for img_id in info.ImageID]
-    dataset = TestDataset(img_paths, args.resize)
-    loader = torch.utils.data.DataLoader(
-        dataset,
+
+    # --cache : member 별 (checkpoint, 전처리) key 로 찾고, miss[model_type] 은 그 member 가 추론해야 하는 이미지
+    cache = None
+    miss = {model_type: np.ones(len(img_paths), dtype=bool) for model_type, _, _ in loaded}
+    if getattr(args, 'cache', None):
+        from prediction_cache import PredictionCache, hash_images # prediction_cache.py
+        cache = PredictionCache(args.cache)
+        digests = hash_images(img_paths)
+        keys, cached = {}, {}
+        for model_type, model_dir, model_name, resize in member_keys:
+            keys[model_type] = _cache_keys(cache, model_type, model_dir, model_name, resize, args)
+            cached[model_type] = cache.get_many(digests, *keys[model_type])
+            miss[model_type] = np.array([digest not in cached[model_type] for digest in digests], dtype=bool)
+            print(f"prediction cache {args.cache} ({model_type}): {len(img_paths) - miss[model_type].sum()}/{len(img_paths)} hits")
+    todo = np.flatnonzero(np.any(list(miss.values()), axis=0))
+    loader = DataLoader(
+        MultiResizeTestDataset([img_paths[i] for i in todo], resizes),
         batch_size=args.batch_size,
-#         num_workers=multiprocessing.cpu_count() // 2,
+        num_workers=args.num_workers,
         shuffle=False,
         pin_memory=use_cuda,
         drop_last=False,
     )
 
-    print("Calculating inference results..")
-    preds = []
-    with torch.no_grad():
-        for idx, images in enumerate(tqdm(loader)):
-            images = images.to(device)
-            pred = model(images)
-            pred = pred.argmax(dim=-1)
-            preds.extend(pred.cpu().numpy())
-
-    info['ans'] = preds
-    save_path = os.path.join(output_dir, f'output.csv')
+    print(f"Calculating fused inference results of {len(loaded)} models ({len(resizes)} resize, tta: {getattr(args, 'tta', None) or 'none'})..")
+    logits = {model_type: [] for model_type, _, _ in loaded}
+    start = time.perf_counter()
+    begin = 0
+    for batch in tqdm(loader):
+        batch = [images.to(device, non_blocking=True) for images in batch]
+        rows = todo[begin:begin + len(batch[0])]
+        begin += len(rows)
+        for model_type, model, resize_index in loaded:
+            member_rows = miss[model_type][rows]
+            if member_rows.all():
+                logits[model_type].append(model(batch[resize_index]).float().cpu())
+            elif member_rows.any():
+                logits[model_type].append(model(batch[resize_index][torch.from_numpy(member_rows).to(device)]).float().cpu())
+    elapsed = time.perf_counter() - start
+    print(f"{len(todo)} images x {len(loaded)} models in {elapsed:.1f}s ({len(todo) / max(elapsed, 1e-9):.1f} images/s)")
+
+    logits = {model_type: torch.cat(l).numpy() if l else np.zeros((0, task_num_classes(model_type)), dtype=np.float32)
+              for model_type, l in logits.items()} # 모든 이미지가 캐시에 있는 member 는 추론 결과가 없음
+    if cache is not None:
+        for model_type, inferred in logits.items():
+            missed = [digests[i] for i in np.flatnonzero(miss[model_type])]
+            if missed:
+                cache.put_many(missed, inferred, *keys[model_type])
+            merged = {**cached[model_type], **dict(zip(missed, inferred))}
+            logits[model_type] = np.stack([merged[digest] for digest in digests]) if digests else inferred
+        cache.close()
+    if getattr(args, 'save_logits', False):
+        member_dirs = dict(parse_members(members))
+        for model_type, model, _ in loaded:
+            path = save_logits(output_dir, f'logits_{model_type}', logits[model_type],
+                               dict(model_type=model_type, model=type(model).__name__, model_dir=member_dirs[model_type],
+                                    info=os.path.join(data_dir, 'info.csv')))
+            print(f"{model_type} logits saved at {path}")
+    preds = {model_type: l.argmax(axis=-1) for model_type, l in logits.items()}
+    info['ans'] = combine_predictions(preds)
+    save_path = os.path.join(output_dir, 'output.csv')
     info.to_csv(save_path, index=False)
-    print(f"Mask Inference Done! Mask Inference result saved at {save_path}")
-    
-def gender_inference(data_dir, model_dir, output_dir, args):
-    use_cuda = torch.cuda.is_available()
-    device = torch.device("cuda" if use_cuda else "cpu")
+    print(f"Fused Inference Done! Inference result saved at {save_path}")
 
-    num_classes = GenderDataset.num_classes  # 2
-    import_model = args.model
-    model = load_model(model_dir, num_classes, device, import_model).to(device) # load_model(saved_model, num_classes, device)
-    model.eval()
 
+def core_groups(num_shards):
+    '''
+    사용할 수 있는 CPU core 를 겹치지 않는 num_shards 개의 묶음으로 나눕니다.
+    '''
+    all_cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count()))
+    num_shards = min(num_shards, len(all_cores))
+    size, extra = divmod(len(all_cores), num_shards)
+    groups, begin = [], 0
+    for i in range(num_shards):
+        end = begin + size + (1 if i < extra else 0)
+        groups.append(all_cores[begin:end])
+        begin = end
+    return groups
+
+
+def _shard_worker(shard_index, img_paths, cores, model_dir, model_type, args, results):
+    '''
+    shard process : cores 에 고정하고 thread 수를 맞춘 뒤 모델을 한 번 로드하여 img_paths 를 추론합니다.
+    model, resize 는 load_member 와 같이 model_dir 의 config.json 을 따릅니다.
+    torch >= 2.1 에서 best.safetensors / best.pth 는 mmap 으로 로드하므로 weight 는 page cache 를 통해 shard 끼리 공유됩니다. (shares_mmap_weights)
+    '''
+    try:
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, cores)
+        torch.set_num_threads(getattr(args, 'num_threads', None) or len(cores))
+        device = torch.device('cpu')
+        num_classes = task_num_classes(model_type)
+        with torch.no_grad():
+            model, resize = load_member(model_type, model_dir, args, device)
+            model = wrap_tta(model, getattr(args, 'tta', None))
+            loader = make_loader(img_paths, resize, args.batch_size, getattr(args, 'shard_workers', 0), False)
+            start = time.perf_counter()
+            logits = torch.cat([model(images).float() for images in loader]) if img_paths else torch.empty(0, num_classes)
+        results.put((shard_index, logits.numpy(), time.perf_counter() - start, None))
+    except Exception:
+        import traceback
+        results.put((shard_index, None, 0.0, traceback.format_exc()))
+
+
+def shares_mmap_weights(path):
+    '''
+    path 의 checkpoint 를 shard process 끼리 page cache 로 공유할 수 있는지 여부
+    mmap 한 tensor 를 그대로 parameter 로 쓰는 load_state_dict(assign=True) 와 torch.load(mmap=True) 는 torch >= 2.1 에서만 동작하고
+    (그 이전에는 create_model_from_state_dict 가 생성 후 복사), best.pt (TorchScript) 는 항상 process 마다 복사됩니다.
+    '''
+    major, minor = (int(v) for v in torch.__version__.split('+')[0].split('.')[:2])
+    return (major, minor) >= (2, 1) and path.endswith(('.safetensors', '.pth'))
+
+
+def shard_inference(data_dir, model_dir, output_dir, args, model_type='MaskBase', poll_interval=5):
+    '''
+    info.csv 를 args.shards 개로 나누어 shard 마다 process 하나로 CPU 추론한 뒤 원래 순서로 합쳐 output.csv 로 저장합니다.
+    shard 마다 겹치지 않는 core 묶음 (core_groups) 을 sched_setaffinity 로 지정하고 torch.set_num_threads 를 core 수로 맞춥니다.
+    하나의 process 에서 batch 가 작을 때 intra-op thread 가 core 를 다 쓰지 못하고, decode 가 GIL 에 묶이는 문제를 피합니다.
+    결과는 poll_interval 초마다 기다리며, 결과 없이 종료된 shard (OOM kill, segfault 등) 가 있으면 나머지 shard 를 종료하고 에러를 냅니다.
+    weight 를 공유할 수 없으면 (shares_mmap_weights) shard 마다 weight 를 복사하므로 메모리 사용량을 경고합니다.
+    '''
     img_root = os.path.join(data_dir, 'images')
     info_path = os.path.join(data_dir, 'info.csv')
+    import pandas as pd
     info = pd.read_csv(info_path)
-
     img_paths = [os.path.join(img_root, img_id) for img_id in info.ImageID]
-    dataset = TestDataset(img_paths, args.resize)
-    loader = torch.utils.data.DataLoader(
-        dataset,
-        batch_size=args.batch_size,
-#         num_workers=multiprocessing.cpu_count() // 2,
-        shuffle=False,
-        pin_memory=use_cuda,
-        drop_last=False,
-    )
 
-    print("Calculating inference results..")
-    preds = []
-    with torch.no_grad():
-        for idx, images in enumerate(tqdm(loader)):
-            images = images.to(device)
-            pred = model(images)
-            pred = pred.argmax(dim=-1)
-            preds.extend(pred.cpu().numpy())
-
-    info['ans'] = preds
-    save_path = os.path.join(output_dir, f'output.csv')
+    groups = core_groups(args.shards)
+    checkpoint = find_checkpoint(model_dir, 'best')
+    if not shares_mmap_weights(checkpoint):
+        print(f"warning: {os.path.basename(checkpoint)} is copied into every shard on torch {torch.__version__} "
+              f"(~{os.path.getsize(checkpoint) / 2 ** 20:.0f}MB x {len(groups)}), sharing weights needs torch >= 2.1 and .safetensors or .pth")
+    bounds = [len(img_paths) * i // len(groups) for i in range(len(groups) + 1)]
+    ctx = torch.multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    processes = []
+    for i, cores in enumerate(groups):
+        process = ctx.Process(target=_shard_worker,
+                              args=(i, img_paths[bounds[i]:bounds[i + 1]], cores, model_dir, model_type, args, results))
+        process.start()
+        processes.append(process)
+
+    print(f"Calculating {model_type} inference results with {len(groups)} shards "
+          f"({len(groups[0])} cores each, tta: {getattr(args, 'tta', None) or 'none'})..")
+    start = time.perf_counter()
+    shards = {}
+    try:
+        while len(shards) < len(processes):
+            try:
+                shard_index, logits, elapsed, error = results.get(timeout=poll_interval)
+            except queue.Empty:
+                dead = [i for i, process in enumerate(processes) if i not in shards and not process.is_alive()]
+                if not dead:
+                    continue
+                try: # 종료 직전에 넣은 결과가 아직 도착하지 않았을 수 있으므로 한 번 더 기다림
+                    shard_index, logits, elapsed, error = results.get(timeout=poll_interval)
+                except queue.Empty:
+                    raise RuntimeError(f"shard {dead[0]} exited with code {processes[dead[0]].exitcode} without a result "
+                                       f"(killed by the OOM killer or a crash in a native op?)") from None
+            if error is not None:
+                raise RuntimeError(f"shard {shard_index} failed:\n{error}")
+            num_images = bounds[shard_index + 1] - bounds[shard_index]
+            print(f"    shard {shard_index} (cores {groups[shard_index][0]}-{groups[shard_index][-1]}): "
+                  f"{num_images} images in {elapsed:.1f}s ({num_images / max(elapsed, 1e-9):.1f} images/s)")
+            shards[shard_index] = logits
+    finally:
+        for process in processes:
+            if process.is_alive() and len(shards) < len(processes):
+                process.terminate()
+            process.join()
+    elapsed = time.perf_counter() - start
+    print(f"{len(img_paths)} images in {elapsed:.1f}s ({len(img_paths) / max(elapsed, 1e-9):.1f} images/s, including model loading)")
+
+    logits = np.concatenate([shards[i] for i in range(len(groups))])
+    if getattr(args, 'save_logits', False):
+        path = save_logits(output_dir, 'logits', logits,
+                           dict(model_type=model_type, model=args.model, model_dir=model_dir, info=info_path))
+        print(f"logits saved at {path}")
+
+    info['ans'] = logits.argmax(axis=-1)
+    save_path = os.path.join(output_dir, 'output.csv')
     info.to_csv(save_path, index=False)
-    print(f"Gender Inference Done! Gender Inference result saved at {save_path}")
-    
-def age_inference(data_dir, model_dir, output_dir, args):
-    use_cuda = torch.cuda.is_available()
-    device = torch.device("cuda" if use_cuda else "cpu")
+    print(f"{model_type} Sharded Inference Done! Inference result saved at {save_path}")
 
-    num_classes = AgeDataset.num_classes  # 3
-    import_model = args.model
-    model = load_model(model_dir, num_classes, device, import_model).to(device) # load_model(saved_model, num_classes, device)
-    model.eval()
+
+def _read_progress(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _hash_prefix(path, size, chunk_size=1 << 20):
+    '''
+    path 의 앞 size byte 의 sha256 hash 객체 (파일이 size 보다 짧으면 None)
+    '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while size > 0:
+            data = f.read(min(chunk_size, size))
+            if not data:
+                return None
+            digest.update(data)
+            size -= len(data)
+    return digest
+
+
+def _append_synced(path, data):
+    '''
+    data (bytes) 를 path 끝에 쓰고 fsync 한 뒤 파일 크기를 반환합니다.
+    '''
+    with open(path, 'ab') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+        return f.tell()
+
+
+def _write_progress(path, progress):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(progress, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, path)
+
+
+@torch.no_grad()
+def stream_inference(data_dir, model_dir, output_dir, args, model_type='MaskBase'):
+    '''
+    info.csv 를 chunk_size 행씩 읽어 추론하고 chunk 마다 output.csv 에 이어 쓰는 함수 (예측을 메모리에 모으지 않음)
+    chunk 를 쓸 때마다 output.csv.progress.json 에 완료한 chunk 수와 output.csv 의 byte 크기, 그 크기까지의 sha256 을 기록하고,
+    다시 실행하면 같은 설정 (info, model_dir, model_type, chunk_size) 의 progress 가 있을 때 output.csv 를 기록된 크기로
+    자른 뒤 (중간에 끊긴 chunk 제거) 다음 chunk 부터 이어서 추론합니다. --restart 이면 처음부터 다시 추론합니다.
+    output.csv 의 앞부분이 기록된 sha256 과 다르면 (다른 실행이 덮어씀) 자르지 않고 처음부터 다시 씁니다.
+    '''
+    device = select_device(args)
+    use_cuda = device.type == 'cuda'
+    if getattr(args, 'num_threads', None):
+        torch.set_num_threads(args.num_threads)
 
     img_root = os.path.join(data_dir, 'images')
     info_path = os.path.join(data_dir, 'info.csv')
-    info = pd.read_csv(info_path)
+    save_path = os.path.join(output_dir, 'output.csv')
+    progress_path = save_path + '.progress.json'
+    config = dict(info=os.path.abspath(info_path), model_dir=os.path.abspath(model_dir), model_type=model_type,
+                  chunk_size=args.chunk_size)
+
+    if getattr(args, 'save_logits', False):
+        print("--save_logits is not supported in streaming inference (the number of rows is not known in advance), ignored")
+    progress = None if getattr(args, 'restart', False) else _read_progress(progress_path)
+    if progress is not None and progress['config'] != config:
+        print(f"{progress_path} was written with a different setting, starting over")
+        progress = None
+    if progress is not None and progress['done']:
+        print(f"{save_path} is already complete ({progress['rows']} rows), use --restart to run again")
+        return
+    digest = None
+    if progress is not None and os.path.exists(save_path):
+        digest = _hash_prefix(save_path, progress['bytes'])
+        if digest is None or digest.hexdigest() != progress.get('sha256'):
+            print(f"{save_path} does not match {progress_path} (overwritten by another run?), starting over")
+            digest = None
+    if digest is None:
+        progress = dict(config=config, chunks=0, rows=0, bytes=0, sha256=None, done=False)
+        digest = hashlib.sha256()
+    else:
+        print(f"resuming after chunk {progress['chunks']} ({progress['rows']} rows done)")
+    with open(save_path, 'a+b') as f: # 마지막으로 완료한 chunk 이후에 쓰인 부분을 버림
+        f.truncate(progress['bytes'])
 
-    img_paths = [os.path.join(img_root, img_id) for img_id in info.ImageID]
-    dataset = TestDataset(img_paths, args.resize)
-    loader = torch.utils.data.DataLoader(
-        dataset,
-        batch_size=args.batch_size,
-#         num_workers=multiprocessing.cpu_count() // 2,
-        shuffle=False,
-        pin_memory=use_cuda,
-        drop_last=False,
-    )
+    num_classes = task_num_classes(model_type)
+    model = load_model(model_dir, num_classes, device, args.model).to(device)
+    model.eval()
+    model = wrap_tta(model, getattr(args, 'tta', None))
+    num_workers = getattr(args, 'num_workers', multiprocessing.cpu_count() // 2)
+
+    import pandas as pd
+    start = time.perf_counter()
+    rows = 0
+    if progress['bytes'] == 0: # info.csv 에 행이 없어도 output.csv 가 제출 가능한 csv 가 되도록 header 를 chunk 보다 먼저 기록
+        columns = list(pd.read_csv(info_path, nrows=0).columns)
+        data = pd.DataFrame(columns=columns + ['ans'] * ('ans' not in columns)).to_csv(index=False).encode('utf-8')
+        progress['bytes'] = _append_synced(save_path, data)
+        digest.update(data)
+        progress['sha256'] = digest.hexdigest()
+        _write_progress(progress_path, progress)
+    chunks = pd.read_csv(info_path, chunksize=args.chunk_size)
+    for index, chunk in enumerate(chunks):
+        if index < progress['chunks']:
+            continue
+        img_paths = [os.path.join(img_root, img_id) for img_id in chunk.ImageID]
+        loader = make_loader(img_paths, args.resize, args.batch_size, num_workers, use_cuda)
+        chunk['ans'] = predict(model, loader, device, num_classes).argmax(dim=-1).numpy()
+        data = chunk.to_csv(header=False, index=False).encode('utf-8')
+        progress['bytes'] = _append_synced(save_path, data)
+        digest.update(data)
+        progress['sha256'] = digest.hexdigest()
+        progress['chunks'] = index + 1
+        progress['rows'] += len(chunk)
+        rows += len(chunk)
+        _write_progress(progress_path, progress)
+        elapsed = time.perf_counter() - start
+        print(f"chunk {index} done: {progress['rows']} rows written ({rows / max(elapsed, 1e-9):.1f} images/s)")
+
+    progress['done'] = True
+    _write_progress(progress_path, progress)
+    print(f"{model_type} Streaming Inference Done! Inference result saved at {save_path}")
 
-    print("Calculating inference results..")
-    preds = []
-    with torch.no_grad():
-        for idx, images in tqdm(enumerate(loader)):
-            images = images.to(device)
-            pred = model(images)
-            pred = pred.argmax(dim=-1)
-            preds.extend(pred.cpu().numpy())
 
-    info['ans'] = preds
-    save_path = os.path.join(output_dir, f'output.csv')
-    info.to_csv(save_path, index=False)
-    print(f"Age Inference Done! Age Inference result saved at {save_path}")
-    
-def maskgender_inference(data_dir, model_dir, output_dir, args):
-    use_cuda = torch.cuda.is_available()
-    device = torch.device("cuda" if use_cuda else "cpu")
-    num_classes = MaskGenderDataset.num_classes  # 6
-    import_model = args.model
-    model = load_model(model_dir, num_classes, device, import_model).to(device) # load_model(saved_model, num_classes, device)
-    model.eval()
+@torch.no_grad()
+def cascade_inference(data_dir, cascade_path, output_dir, args):
+    '''
+    cascade.py 로 정한 cascade 추론
+    모든 이미지를 cheap 모델로 추론하고 softmax 최대 확률이 threshold 보다 낮은 이미지만 expensive 모델로 다시 추론합니다.
+    두 모델의 resize 는 각 model_dir 의 config.json 을 따릅니다. (--threshold 로 threshold 변경)
+    threshold 는 cascade.json 의 tta (cascade.py 는 TTA 없는 validation logits 로 계산) 와 같은 설정에서만 맞으므로 --tta 는 무시합니다.
+    '''
+    device = select_device(args)
+    use_cuda = device.type == 'cuda'
+    if getattr(args, 'num_threads', None):
+        torch.set_num_threads(args.num_threads)
+    with open(cascade_path, encoding='utf-8') as f:
+        cascade = json.load(f)
+    threshold = args.threshold if getattr(args, 'threshold', None) is not None else cascade['threshold']
+    model_type = cascade['model_type']
+    num_classes = task_num_classes(model_type)
+    tta = cascade.get('tta', 'none')
+    if getattr(args, 'tta', None) not in (None, tta):
+        print(f"--tta {args.tta} is ignored: the cascade threshold was calibrated with tta {tta}")
 
     img_root = os.path.join(data_dir, 'images')
     info_path = os.path.join(data_dir, 'info.csv')
+    import pandas as pd
     info = pd.read_csv(info_path)
-
     img_paths = [os.path.join(img_root, img_id) for img_id in info.ImageID]
-    dataset = TestDataset(img_paths, args.resize)
-    loader = torch.utils.data.DataLoader(
-        dataset,
-        batch_size=args.batch_size,
-#         num_workers=multiprocessing.cpu_count() // 2,
-        shuffle=False,
-        pin_memory=use_cuda,
-        drop_last=False,
-    )
-
-    print("Calculating inference results..")
-    preds = []
-    with torch.no_grad():
-        for idx, images in enumerate(tqdm(loader)):
-            images = images.to(device)
-            pred = model(images)
-            pred = pred.argmax(dim=-1)
-            preds.extend(pred.cpu().numpy())
-
-    info['ans'] = preds
-    save_path = os.path.join(output_dir, f'output.csv')
+    num_workers = getattr(args, 'num_workers', multiprocessing.cpu_count() // 2)
+
+    start = time.perf_counter()
+    cheap, cheap_resize = load_member(model_type, cascade['cheap'], args, device)
+    print(f"Calculating {model_type} cascade results: {type(cheap).__name__} first, threshold {threshold:.2f} (tta: {tta})..")
+    logits = predict(wrap_tta(cheap, tta),
+                     make_loader(img_paths, cheap_resize, args.batch_size, num_workers, use_cuda), device, num_classes)
+    del cheap
+    confidence = logits.softmax(dim=-1).max(dim=-1).values
+    routed = torch.nonzero(confidence < threshold).flatten().tolist()
+
+    if routed:
+        expensive, expensive_resize = load_member(model_type, cascade['expensive'], args, device)
+        print(f"{len(routed)}/{len(img_paths)} images ({len(routed) / max(len(img_paths), 1):.1%}) routed to {type(expensive).__name__}..")
+        routed_logits = predict(wrap_tta(expensive, tta),
+                                make_loader([img_paths[i] for i in routed], expensive_resize, args.batch_size, num_workers, use_cuda), device, num_classes)
+        logits[routed] = routed_logits
+    elapsed = time.perf_counter() - start
+    print(f"{len(img_paths)} images in {elapsed:.1f}s ({len(img_paths) / max(elapsed, 1e-9):.1f} images/s, including model loading)")
+
+    if getattr(args, 'save_logits', False):
+        # routed 이미지는 expensive 모델, 나머지는 cheap 모델의 logits
+        path = save_logits(output_dir, 'logits', logits.numpy(),
+                           dict(model_type=model_type, model='cascade', model_dir=cascade_path, info=info_path,
+                                threshold=threshold, routed=len(routed)))
+        print(f"logits saved at {path}")
+    info['ans'] = logits.argmax(dim=-1).numpy()
+    save_path = os.path.join(output_dir, 'output.csv')
     info.to_csv(save_path, index=False)
-    print(f"Mask&Gender Inference Done! Mask Inference result saved at {save_path}")
+    print(f"{model_type} Cascade Inference Done! Inference result saved at {save_path}")
+
 
-    
 def combine_inference(data_dir, output_dir): # Mask, Gender, Age inference make
     data_dir = '../input/data/eval'
+    import pandas as pd
     info_path = pd.read_csv(os.path.join(data_dir, 'info.csv'))
     info = pd.read_csv(info_path)
 
@@ -309,6 +768,7 @@ def combine_inference(data_dir, output_dir): # Mask, Gender, Age inference make
 
 def combine_inference_2(data_dir, output_dir): # Mask+Gender, Age inference make
     data_dir = '../input/data/eval'
+    import pandas as pd
     info_path = pd.read_csv(os.path.join(data_dir, 'info.csv'))
     info = pd.read_csv(info_path)
 
@@ -338,12 +798,26 @@ if __name__ == '__main__':
     parser.add_argument('--batch_size', type=int, default=1000, help='input batch size for validing (default: 1000)')
     parser.add_argument('--resize', nargs="+", type=tuple, default=(512, 384), help='resize size for image when you trained (default: (512, 384))')
     parser.add_argument('--model', type=str, default='BaseModel', help='model type (default: BaseModel)')
+    parser.add_argument('--num_workers', type=int, default=multiprocessing.cpu_count() // 2, help='image decoding workers that prefetch batches (default: cpu_count // 2)')
+    parser.add_argument('--num_threads', type=int, default=None, help='torch.set_num_threads for the model (default: torch default)')
+    parser.add_argument('--device', type=str, default=None, help='cpu or cuda (default: cuda if available), int8 models from quantize.py need cpu')
 
     # Container environment
     parser.add_argument('--data_dir', type=str, default=os.environ.get('SM_CHANNEL_EVAL', '/opt/ml/input/data/eval'))
     parser.add_argument('--model_dir', type=str, default=os.environ.get('SM_CHANNEL_MODEL', './model/exp'))
     parser.add_argument('--output_dir', type=str, default=os.environ.get('SM_OUTPUT_DATA_DIR', './output'))
-    parser.add_argument('--model_type', type=str, default='MaskBase', help = 'Mask or Gender or Age or MaskBase')
+    parser.add_argument('--model_type', type=str, default='MaskBase', help = 'MaskBase, Mask, Gender, Age or MaskGender (default: MaskBase)')
+    parser.add_argument('--members', nargs='+', default=None, help='fused inference: model_type=model_dir ... (e.g. Mask=./model/mask Gender=./model/gender Age=./model/age), decodes every image once')
+    parser.add_argument('--shards', type=int, default=0, help='CPU sharded inference: split info.csv over N processes pinned to disjoint cores (default: 0, off)')
+    parser.add_argument('--shard_workers', type=int, default=0, help='image decoding workers per shard (default: 0, decode in the shard process)')
+    parser.add_argument('--cascade', type=str, default=None, help='cascade.json from cascade.py: cheap model first, only low-confidence images go to the expensive model')
+    parser.add_argument('--threshold', type=float, default=None, help='override the cascade confidence threshold')
+    parser.add_argument('--cache', type=str, default=None, help='sqlite prediction cache keyed by image content / checkpoint / preprocessing, only misses are inferred (e.g. ./cache/predictions.sqlite)')
+    parser.add_argument('--chunk_size', type=int, default=0, help='streaming inference: read info.csv and append output.csv this many rows at a time, resumable (default: 0, off)')
+    parser.add_argument('--restart', action='store_true', help='streaming inference: ignore the progress file and start over')
+    parser.add_argument('--tta', type=str, default='none', choices=['none', 'flip', 'crop', 'flip_crop'], help='test-time augmentation variants stacked into one forward, logits averaged (default: none)')
+    parser.add_argument('--save_logits', action='store_true', help='also save per-image logits as float16 .npy (+ .json meta) in output_dir for ensemble.py')
+    parser.add_argument('--profile_steps', '--profile-steps', type=str, default=None, help='START:END inference batches to record with torch.profiler into {output_dir}/profile')
 
     args = parser.parse_args()
 
@@ -352,18 +826,22 @@ if __name__ == '__main__':
     output_dir = args.output_dir
     model_type = args.model_type
 
-    os.makedirs(output_dir, exist_ok=True)
+    if args.shards > 0 and (args.cascade or args.members or args.chunk_size > 0):
+        parser.error('--shards runs a single model_dir and cannot be combined with --cascade, --members or --chunk_size')
+    if args.cache and (args.cascade or args.chunk_size > 0 or args.shards > 0):
+        parser.error('--cache is only supported by single-model and --members inference (not with --cascade, --chunk_size or --shards)')
 
-    if model_type == 'MaskBase':
-        inference(data_dir, model_dir, output_dir, args) # model_dir -> load_model(saved_model 
-    elif model_type == 'Mask':
-        mask_inference(data_dir, model_dir, output_dir, args) # model_dir -> load_model(saved_model 
-    elif model_type == 'Gender':
-        gender_inference(data_dir, model_dir, output_dir, args) # model_dir -> load_model(saved_model 
-    elif model_type == 'Age':
-        age_inference(data_dir, model_dir, output_dir, args) # model_dir -> load_model(saved_model 
-    elif model_type == 'MaskGender':
-        maskgender_inference(data_dir, model_dir, output_dir, args) # model_dir -> load_model(saved_model 
+    os.makedirs(output_dir, exist_ok=True)
 
+    if args.cascade:
+        cascade_inference(data_dir, args.cascade, output_dir, args)
+    elif args.members:
+        fused_inference(data_dir, args.members, output_dir, args)
+    elif args.chunk_size > 0 and model_type in INFERENCE_TASKS:
+        stream_inference(data_dir, model_dir, output_dir, args, model_type)
+    elif args.shards > 0 and model_type in INFERENCE_TASKS:
+        shard_inference(data_dir, model_dir, output_dir, args, model_type)
+    elif model_type in INFERENCE_TASKS:
+        run_inference(data_dir, model_dir, output_dir, args, model_type) # model_dir -> load_model(saved_model
     else:
         print('inference 파일 생성 에러')
@@ -1,13 +1,46 @@
+import argparse
+import hashlib
+import json
+import os
+import socket
+from importlib import import_module
+
+import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.nn.init as init
 
+
+class _Lazy:
+    '''
+    module(.attr) 을 처음 사용할 때 import 하는 proxy
+    timm, efficientnet_pytorch, torchvision.models 는 import 만 수 초가 걸리므로
+    `import model` 만 하는 경우(train.py --help, 다른 모델 사용 등)에는 import 하지 않습니다.
+    '''
+    def __init__(self, module, attr=None):
+        self._module = module
+        self._attr = attr
+        self._target = None
+
+    def _resolve(self):
+        if self._target is None:
+            target = import_module(self._module)
+            self._target = getattr(target, self._attr) if self._attr else target
+        return self._target
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._resolve(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self._resolve()(*args, **kwargs)
+
+
 # https://pytorch.org/vision/0.10/models.html
-from torchvision.models import vgg16, vgg16_bn, vgg19, vgg19_bn
-from torchvision.models import resnet34, resnet50, resnet101, resnet152, resnext50_32x4d, resnext101_32x8d, wide_resnet50_2, wide_resnet101_2
-from torchvision.models import densenet121, densenet169, densenet161, densenet201
-from efficientnet_pytorch import EfficientNet
-import timm
+torchvision_models = _Lazy('torchvision.models')
+EfficientNet = _Lazy('efficientnet_pytorch', 'EfficientNet')
+timm = _Lazy('timm')
 
 def initialize_weights(model):
     """
@@ -56,449 +89,277 @@ class BaseModel(nn.Module):
         x = x.view(-1, 128)
         return self.fc(x)
 
-### ResNet ###
-class ResNet34(nn.Module):
-    '''
-    마지막 수정자 : 김용우
-    '''
-    def __init__(self, num_classes):
-        super(ResNet34, self).__init__()
-        self.model = resnet34(pretrained=True)
-        self.num_ftrs = self.model.fc.in_features
-        self.model.fc = nn.Linear(self.num_ftrs, num_classes) # 18
+### pretrained backbone registry ###
+# source      : torchvision / efficientnet (efficientnet_pytorch) / timm
+# backbone    : source 의 model 이름
+# head        : num_classes 출력 nn.Linear 로 교체할 classifier attribute
+# input_size  : pretrained weight 의 학습 해상도 (H, W), timm ViT / Swin 은 이 크기만 입력 가능
+# init        : 교체한 head 초기화 (None: nn.Linear 기본값, 'normal': initialize_weights, 'xavier': xavier_uniform_)
+_backbone_specs = {
+    # ResNet
+    'ResNet34':        dict(source='torchvision', backbone='resnet34', head='fc', input_size=(224, 224)),
+    'ResNet34_init':   dict(source='torchvision', backbone='resnet34', head='fc', input_size=(224, 224), init='normal'),
+    'ResNet50':        dict(source='torchvision', backbone='resnet50', head='fc', input_size=(224, 224)),
+    'ResNet101':       dict(source='torchvision', backbone='resnet101', head='fc', input_size=(224, 224)),
+    'ResNet152':       dict(source='torchvision', backbone='resnet152', head='fc', input_size=(224, 224)),
+    # ResNext
+    'ResNext50':       dict(source='torchvision', backbone='resnext50_32x4d', head='fc', input_size=(224, 224)),
+    'ResNext101_8d':   dict(source='torchvision', backbone='resnext101_32x8d', head='fc', input_size=(224, 224)),
+    # wide_resnet
+    'WideResNet50':    dict(source='torchvision', backbone='wide_resnet50_2', head='fc', input_size=(224, 224)),
+    'WideResNet101':   dict(source='torchvision', backbone='wide_resnet101_2', head='fc', input_size=(224, 224)),
+    # densenet
+    'DenseNet121':      dict(source='torchvision', backbone='densenet121', head='classifier', input_size=(224, 224)),
+    'DenseNet121_init': dict(source='torchvision', backbone='densenet121', head='classifier', input_size=(224, 224), init='normal'),
+    'DenseNet161':      dict(source='torchvision', backbone='densenet161', head='classifier', input_size=(224, 224)),
+    'DenseNet161_init': dict(source='torchvision', backbone='densenet161', head='classifier', input_size=(224, 224)),
+    'DenseNet169':      dict(source='torchvision', backbone='densenet169', head='classifier', input_size=(224, 224)),
+    'DenseNet201':      dict(source='torchvision', backbone='densenet201', head='classifier', input_size=(224, 224)),
+    # EfficientNet
+    'EfficientNetB3':        dict(source='efficientnet', backbone='efficientnet-b3', head='_fc', input_size=(300, 300)),
+    'EfficientNetB3_init':   dict(source='efficientnet', backbone='efficientnet-b3', head='_fc', input_size=(300, 300), init='normal'),
+    'EfficientNetB3_xavier': dict(source='efficientnet', backbone='efficientnet-b3', head='_fc', input_size=(300, 300), init='xavier'),
+    'EfficientNetB4':        dict(source='efficientnet', backbone='efficientnet-b4', head='_fc', input_size=(380, 380)),
+    'EfficientNetB4_init':   dict(source='efficientnet', backbone='efficientnet-b4', head='_fc', input_size=(380, 380), init='xavier'),
+    'EfficientNetB5':        dict(source='efficientnet', backbone='efficientnet-b5', head='_fc', input_size=(456, 456)),
+    'EfficientNetB6':        dict(source='efficientnet', backbone='efficientnet-b6', head='_fc', input_size=(528, 528)),
+    'EfficientNetB7':        dict(source='efficientnet', backbone='efficientnet-b7', head='_fc', input_size=(600, 600)),
+    # timm
+    'Vit_p8':    dict(source='timm', backbone='vit_base_patch8_224', head='head', input_size=(224, 224)),
+    'Vit_p16':   dict(source='timm', backbone='vit_base_patch16_224', head='head', input_size=(224, 224)),
+    'Vit_s_p16': dict(source='timm', backbone='vit_small_patch16_224', head='head', input_size=(224, 224)),
+    'Vit_s_p32': dict(source='timm', backbone='vit_small_patch32_224', head='head', input_size=(224, 224)),
+    'Swin_p4':   dict(source='timm', backbone='swin_base_patch4_window7_224', head='head', input_size=(224, 224)),
+    'Swin_p4_l': dict(source='timm', backbone='swin_large_patch4_window7_224', head='head', input_size=(224, 224)),
+    'Swin_p4_s': dict(source='timm', backbone='swin_small_patch4_window7_224', head='head', input_size=(224, 224)),
+}
+
+
+### pretrained weight cache ###
+WEIGHTS_DIR_ENV = 'PSTAGE_WEIGHTS_DIR'
+OFFLINE_ENV = 'PSTAGE_OFFLINE'
+DOWNLOAD_TIMEOUT = 30 # socket timeout (s) for downloads, so a dead network fails instead of hanging
+
+
+def weights_dir():
+    return os.environ.get(WEIGHTS_DIR_ENV, os.path.join(os.path.expanduser('~'), '.cache', 'pstage', 'weights'))
+
+
+def is_offline():
+    return os.environ.get(OFFLINE_ENV, '0').lower() not in ('', '0', 'false')
+
+
+def _weights_key(spec):
+    return f"{spec['source']}:{spec['backbone']}"
+
+
+def _read_index(cache_dir):
+    path = os.path.join(cache_dir, 'index.json')
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def cached_weights_path(spec, cache_dir=None):
+    '''
+    spec 의 pretrained weight 가 cache 에 있으면 경로를, 없으면 None 을 반환합니다.
+    cache 구조 : {cache_dir}/index.json ({"source:backbone": sha256}) + {cache_dir}/sha256/{digest}.pth
+    '''
+    cache_dir = cache_dir or weights_dir()
+    digest = _read_index(cache_dir).get(_weights_key(spec))
+    if digest is None:
+        return None
+    path = os.path.join(cache_dir, 'sha256', f'{digest}.pth')
+    return path if os.path.exists(path) else None
+
+
+def store_weights(spec, state_dict, cache_dir=None):
+    '''
+    backbone state_dict 를 sha256 이름으로 저장하고 index.json 에 등록합니다. 같은 내용은 한 번만 저장됩니다.
+    '''
+    cache_dir = cache_dir or weights_dir()
+    os.makedirs(os.path.join(cache_dir, 'sha256'), exist_ok=True)
+    tmp_path = os.path.join(cache_dir, 'sha256', f'.tmp-{os.getpid()}.pth')
+    torch.save(state_dict, tmp_path)
+    digest = file_sha256(tmp_path)
+    path = os.path.join(cache_dir, 'sha256', f'{digest}.pth')
+    os.replace(tmp_path, path)
+
+    index = _read_index(cache_dir)
+    index[_weights_key(spec)] = digest
+    tmp_index = os.path.join(cache_dir, f'.index-{os.getpid()}.json')
+    with open(tmp_index, 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=4)
+    os.replace(tmp_index, os.path.join(cache_dir, 'index.json'))
+    return path
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _build_backbone(spec, pretrained=False):
+    '''
+    source 라이브러리로 backbone 을 생성합니다. pretrained=True 는 라이브러리가 직접 weight 를 download 합니다.
+    '''
+    if spec['source'] == 'torchvision':
+        return getattr(torchvision_models, spec['backbone'])(pretrained=pretrained)
+    if spec['source'] == 'efficientnet':
+        if pretrained:
+            return EfficientNet.from_pretrained(spec['backbone'])
+        return EfficientNet.from_name(spec['backbone'])
+    if spec['source'] == 'timm':
+        return timm.create_model(spec['backbone'], pretrained=pretrained)
+    raise RuntimeError('Unknown backbone source (%s)' % spec['source'])
 
-    def forward(self, x):
-        x = self.model(x)
-        return x
-    
-class ResNet34_init(nn.Module):
-    '''
-    마지막 수정자 : 김용우
-    '''
-    def __init__(self, num_classes):
-        super(ResNet34_init, self).__init__()
-        self.model = resnet34(pretrained=True)
-        self.num_ftrs = self.model.fc.in_features
-        self.model.fc = nn.Linear(self.num_ftrs, num_classes) # 18
-        initialize_weights(self.model.fc)
 
-    def forward(self, x):
-        x = self.model(x)
-        return x
-    
-class ResNet50(nn.Module):
+def fetch_weights(spec, cache_dir=None):
     '''
-    생성자 : 박승희
+    pretrained weight 를 download 하여 cache 에 저장하고 경로를 반환합니다. 이미 있으면 download 하지 않습니다.
+    offline (PSTAGE_OFFLINE=1) 이면 download 하지 않고 바로 에러를 냅니다.
     '''
-    def __init__(self, num_classes):
-        super(ResNet50, self).__init__()
-        self.model = resnet50(pretrained=True)
-        self.num_ftrs = self.model.fc.in_features
-        self.model.fc = nn.Linear(self.num_ftrs, num_classes) # 18
-
-    def forward(self, x):
-        x = self.model(x)
-        return x
-    
+    path = cached_weights_path(spec, cache_dir)
+    if path is not None:
+        return path
+    if is_offline():
+        raise RuntimeError(
+            f"pretrained weights for {_weights_key(spec)} are not in {cache_dir or weights_dir()} and {OFFLINE_ENV} is set; "
+            f"run `python model.py fetch <model>` on a machine with network access and copy the cache")
+    timeout = socket.getdefaulttimeout()
+    socket.setdefaulttimeout(DOWNLOAD_TIMEOUT)
+    try:
+        backbone = _build_backbone(spec, pretrained=True)
+    except OSError as e:
+        raise RuntimeError(f"failed to download pretrained weights for {_weights_key(spec)} ({e}); "
+                           f"set {OFFLINE_ENV}=1 to fail fast, or fill {WEIGHTS_DIR_ENV} with `python model.py fetch`") from e
+    finally:
+        socket.setdefaulttimeout(timeout)
+    return store_weights(spec, backbone.state_dict(), cache_dir)
 
-    
-class ResNet101(nn.Module):
-    '''
-    생성자 : 박승희
-    '''
-    def __init__(self, num_classes):
-        super(ResNet101, self).__init__()
-        self.model = resnet101(pretrained=True)
-        self.num_ftrs = self.model.fc.in_features
-        self.model.fc = nn.Linear(self.num_ftrs, num_classes) # 18
 
-    def forward(self, x):
-        x = self.model(x)
-        return x
-    
-class ResNet152(nn.Module):
+class PretrainedModel(nn.Module):
     '''
-    생성자 : 박승희
+    _backbone_specs 의 spec 으로 backbone 을 만들고 head 를 num_classes 출력 nn.Linear 로 교체하는 모델
+    backbone 은 weight 없이 만든 뒤 cache 의 pretrained weight 를 load 합니다. (cache 에 없으면 fetch_weights)
+    state_dict key 는 기존 wrapper class 와 같은 model.* 입니다.
     '''
-    def __init__(self, num_classes):
-        super(ResNet152, self).__init__()
-        self.model = resnet152(pretrained=True)
-        self.num_ftrs = self.model.fc.in_features
-        self.model.fc = nn.Linear(self.num_ftrs, num_classes) # 18
+    spec = None
 
-    def forward(self, x):
-        x = self.model(x)
-        return x
+    def __init__(self, num_classes, pretrained=True):
+        super().__init__()
+        self.model = _build_backbone(self.spec)
+        if pretrained:
+            state_dict = torch.load(fetch_weights(self.spec), map_location='cpu')
+            self.model.load_state_dict(state_dict)
+        self.num_ftrs = getattr(self.model, self.spec['head']).in_features
+        setattr(self.model, self.spec['head'], nn.Linear(self.num_ftrs, num_classes))
 
-### ResNext ###
-class ResNext50(nn.Module):
-    '''
-    생성자 : 이다현
-    수정자 : 박승희
-    '''
-    def __init__(self, num_classes):
-        super(ResNext50, self).__init__()
-        self.model = resnext50_32x4d(pretrained=True)
-        self.num_ftrs = self.model.fc.in_features
-        self.model.fc = nn.Linear(self.num_ftrs, num_classes) # 18
-        
-    def forward(self, x):
-        x = self.model(x)
-        return x 
+        head = getattr(self.model, self.spec['head'])
+        if self.spec.get('init') == 'normal':
+            initialize_weights(head)
+        elif self.spec.get('init') == 'xavier':
+            nn.init.xavier_uniform_(head.weight)
 
-class ResNext101_8d(nn.Module):
-    '''
-    생성자 : 박승희
-    수정자 : 박승희
-    '''
-    def __init__(self, num_classes):
-        super(ResNext101_8d, self).__init__()
-        self.model = resnext101_32x8d(pretrained=True)
-        self.num_ftrs = self.model.fc.in_features
-        self.model.fc = nn.Linear(self.num_ftrs, num_classes) # 18
-        
     def forward(self, x):
         x = self.model(x)
         return x
 
-### wide_resnet ###
-class WideResNet50(nn.Module):
-    '''
-    생성자 : 박승희
-    수정자 : 박승희
-    '''
-    def __init__(self, num_classes):
-        super(WideResNet50, self).__init__()
-        self.model = wide_resnet50_2(pretrained=True)
-        self.num_ftrs = self.model.fc.in_features
-        self.model.fc = nn.Linear(self.num_ftrs, num_classes) # 18
-        
-    def forward(self, x):
-        x = self.model(x)
-        return x
-    
-class WideResNet101(nn.Module):
-    '''
-    생성자 : 박승희
-    수정자 : 박승희
-    '''
-    def __init__(self, num_classes):
-        super(WideResNet101, self).__init__()
-        self.model = wide_resnet101_2(pretrained=True)
-        self.num_ftrs = self.model.fc.in_features
-        self.model.fc = nn.Linear(self.num_ftrs, num_classes) # 18
-        
-    def forward(self, x):
-        x = self.model(x)
-        return x
-    
-### densenet ### 
-class DenseNet121(nn.Module):
-    '''
-    생성자 : 박승희
-    '''
-    def __init__(self, num_classes):
-        super(DenseNet121, self).__init__()
-        self.model = densenet121(pretrained=True)
-        self.num_ftrs = self.model.classifier.in_features
-        self.model.classifier = nn.Linear(self.num_ftrs, num_classes) # 18
-        
-    def forward(self, x):
-        x = self.model(x)
-        return x
-    
-class DenseNet121_init(nn.Module):
-    '''
-    생성자 : 박승희
-    '''
-    def __init__(self, num_classes):
-        super(DenseNet121_init, self).__init__()
-        self.model = densenet121(pretrained=True)
-        self.num_ftrs = self.model.classifier.in_features
-        self.model.classifier = nn.Linear(self.num_ftrs, num_classes) # 18
-        initialize_weights(self.model.classifier)
-        
-    def forward(self, x):
-        x = self.model(x)
-        return x
-    
-class DenseNet161(nn.Module):
-    '''
-    생성자 : 박승희
-    '''
-    def __init__(self, num_classes):
-        super(densenet161, self).__init__()
-        self.model = densenet161(pretrained=True)
-        self.num_ftrs = self.model.classifier.in_features
-        self.model.classifier = nn.Linear(self.num_ftrs, num_classes) # 18
-        
-    def forward(self, x):
-        x = self.model(x)
-        return x
-    
-class DenseNet161_init(nn.Module):
-    '''
-    생성자 : 박승희
-    '''
-    def __init__(self, num_classes):
-        super(DenseNet161_init, self).__init__()
-        self.model = densenet161(pretrained=True)
-        self.num_ftrs = self.model.classifier.in_features
-        self.model.classifier = nn.Linear(self.num_ftrs, num_classes) # 18
-        
-    def forward(self, x):
-        x = self.model(x)
-        return x
-    
-class DenseNet169(nn.Module):
-    '''
-    생성자 : 박승희
-    '''
-    def __init__(self, num_classes):
-        super(DenseNet169, self).__init__()
-        self.model = densenet169(pretrained=True)
-        self.num_ftrs = self.model.classifier.in_features
-        self.model.classifier = nn.Linear(self.num_ftrs, num_classes) # 18
-        
-    def forward(self, x):
-        x = self.model(x)
-        return x
-    
-class DenseNet201(nn.Module):
-    '''
-    생성자 : 박승희
-    '''
-    def __init__(self, num_classes):
-        super(DenseNet201, self).__init__()
-        self.model = densenet201(pretrained=True)
-        self.num_ftrs = self.model.classifier.in_features
-        self.model.classifier = nn.Linear(self.num_ftrs, num_classes) # 18
-        
-    def forward(self, x):
-        x = self.model(x)
-        return x
-    
-### EfficientNet ###
-class EfficientNetB3_init(nn.Module):
-    '''
-    생성자 : 박승희
-    '''
-    def __init__(self, num_classes):
-        super(EfficientNetB3_init, self).__init__()
-        self.model = EfficientNet.from_pretrained('efficientnet-b3')
-        self.num_ftrs = self.model._fc.in_features
-        self.model._fc = nn.Linear(self.num_ftrs, num_classes)
-        initialize_weights(self.model._fc)
 
-    def forward(self, x):
-        x = self.model(x)
-        return x
-    
-class EfficientNetB3_xavier(nn.Module):
-    def __init__(self, num_classes):
-        super(EfficientNetB3_xavier, self).__init__()
-        self.model = EfficientNet.from_pretrained('efficientnet-b3')
-        self.num_ftrs = self.model._fc.in_features
-        self.model._fc = nn.Linear(self.num_ftrs, num_classes)
-        nn.init.xavier_uniform_(self.model._fc.weight)
+# _backbone_specs 의 이름마다 PretrainedModel subclass 를 만들어 module attribute 로 등록 (getattr(model, 'ResNet34') 그대로 사용 가능)
+for _name, _spec in _backbone_specs.items():
+    globals()[_name] = type(_name, (PretrainedModel,), {'spec': _spec, '__module__': __name__})
 
-    def forward(self, x):
-        x = self.model(x)
-        return x
-    
-class EfficientNetB3_xavier(nn.Module):
-    def __init__(self, num_classes):
-        super(EfficientNetB3_xavier, self).__init__()
-        self.model = EfficientNet.from_pretrained('efficientnet-b3')
-        self.num_ftrs = self.model._fc.in_features
-        self.model._fc = nn.Linear(self.num_ftrs, num_classes)
-        nn.init.xavier_uniform_(self.model._fc.weight)
+_model_entrypoints = {'BaseModel': BaseModel}
+_model_entrypoints.update({name: globals()[name] for name in _backbone_specs})
 
-    def forward(self, x):
-        x = self.model(x)
-        return x
-    
-class EfficientNetB3_init(nn.Module):
-    '''
-    생성자 : 박승희
-    '''
-    def __init__(self, num_classes):
-        super(EfficientNetB3_init, self).__init__()
-        self.model = EfficientNet.from_pretrained('efficientnet-b3')
-        self.num_ftrs = self.model._fc.in_features
-        self.model._fc = nn.Linear(self.num_ftrs, num_classes)
-        initialize_weights(self.model._fc)
 
-    def forward(self, x):
-        x = self.model(x)
-        return x
-    
-class EfficientNetB4(nn.Module):
+def model_entrypoint(model_name):
     '''
-    생성자 : 박승희
+    주어진 모델 이름에 해당하는 class 를 반환
     '''
-    def __init__(self, num_classes):
-        super(EfficientNetB4, self).__init__()
-        self.model = EfficientNet.from_pretrained('efficientnet-b4')
-        self.num_ftrs = self.model._fc.in_features
-        self.model._fc = nn.Linear(self.num_ftrs, num_classes)
+    return _model_entrypoints[model_name]
 
-    def forward(self, x):
-        x = self.model(x)
-        return x
-    
-class EfficientNetB4_init(nn.Module):
-    '''
-    생성자 : 박승희
-    '''
-    def __init__(self, num_classes):
-        super(EfficientNetB4_init, self).__init__()
-        self.model = EfficientNet.from_pretrained('efficientnet-b4')
-        self.num_ftrs = self.model._fc.in_features
-        self.model._fc = nn.Linear(self.num_ftrs, num_classes)
-        nn.init.xavier_uniform_(self.model._fc.weight)
 
-    def forward(self, x):
-        x = self.model(x)
-        return x
-    
-class EfficientNetB5(nn.Module):
+def is_model(model_name):
     '''
-    생성자 : 박승희
+    주어진 이름이 유효한 모델 이름인지 확인
     '''
-    def __init__(self, num_classes):
-        super(EfficientNetB5, self).__init__()
-        self.model = EfficientNet.from_pretrained('efficientnet-b5')
-        self.num_ftrs = self.model._fc.in_features
-        self.model._fc = nn.Linear(self.num_ftrs, num_classes)
+    return model_name in _model_entrypoints
 
-    def forward(self, x):
-        x = self.model(x)
-        return x
-    
-class EfficientNetB6(nn.Module):
-    '''
-    생성자 : 박승희
-    '''
-    def __init__(self, num_classes):
-        super(EfficientNetB6, self).__init__()
-        self.model = EfficientNet.from_pretrained('efficientnet-b6')
-        self.num_ftrs = self.model._fc.in_features
-        self.model._fc = nn.Linear(self.num_ftrs, num_classes)
 
-    def forward(self, x):
-        x = self.model(x)
-        return x
-    
-class EfficientNetB7(nn.Module):
+def create_model(model_name, **kwargs):
     '''
-    생성자 : 박승희
+    모델 이름과 추가 인자(num_classes, pretrained 등)를 받아 모델을 생성합니다.
+    모델 이름이 유효하지 않을 경우 에러를 냅니다.
     '''
-    def __init__(self, num_classes):
-        super(EfficientNetB7, self).__init__()
-        self.model = EfficientNet.from_pretrained('efficientnet-b7')
-        self.num_ftrs = self.model._fc.in_features
-        self.model._fc = nn.Linear(self.num_ftrs, num_classes)
+    if is_model(model_name):
+        create_fn = model_entrypoint(model_name)
+        model = create_fn(**kwargs)
+    else:
+        raise RuntimeError('Unknown model (%s)' % model_name)
+    return model
 
-    def forward(self, x):
-        x = self.model(x)
-        return x
-    
-#####  timm model  #######
-class Vit_p8(nn.Module):
-    '''
-    생성자 : 박승희
-    '''
-    def __init__(self, num_classes):
-        super(Vit_p8, self).__init__()
-        self.model = timm.create_model('vit_base_patch8_224', pretrained=True)
-        self.num_ftrs = self.model.head.in_features
-        self.model.head = nn.Linear(self.num_ftrs, num_classes)
 
-    def forward(self, x):
-        x = self.model(x)
-        return x
-    
-class Vit_p16(nn.Module):
-    '''
-    생성자 : 박승희
-    '''
-    def __init__(self, num_classes):
-        super(Vit_p16, self).__init__()
-        self.model = timm.create_model('vit_base_patch16_224', pretrained=True)
-        self.num_ftrs = self.model.head.in_features
-        self.model.head = nn.Linear(self.num_ftrs, num_classes)
 
-    def forward(self, x):
-        x = self.model(x)
-        return x
-    
-class Vit_s_p16(nn.Module):
-    '''
-    생성자 : 박승희
-    '''
-    def __init__(self, num_classes):
-        super(Vit_s_p16, self).__init__()
-        self.model = timm.create_model('vit_small_patch16_224', pretrained=True)
-        self.num_ftrs = self.model.head.in_features
-        self.model.head = nn.Linear(self.num_ftrs, num_classes)
+def _has_meta_tensors(model):
+    return any(t.is_meta for t in model.parameters()) or any(t.is_meta for t in model.buffers())
 
-    def forward(self, x):
-        x = self.model(x)
-        return x
-    
-class Vit_s_p32(nn.Module):
-    '''
-    생성자 : 박승희
-    '''
-    def __init__(self, num_classes):
-        super(Vit_s_p32, self).__init__()
-        self.model = timm.create_model('vit_small_patch32_224', pretrained=True)
-        self.num_ftrs = self.model.head.in_features
-        self.model.head = nn.Linear(self.num_ftrs, num_classes)
 
-    def forward(self, x):
-        x = self.model(x)
-        return x
-
-class Swin_p4(nn.Module):
+def create_model_from_state_dict(model_name, state_dict, device='cpu', **kwargs):
     '''
-    생성자 : 박승희
+    checkpoint 로 복원할 모델을 pretrained weight 없이 생성합니다.
+    meta device 에서 parameter 메모리 없이 architecture 만 만든 뒤 load_state_dict(assign=True) 로
+    state_dict 의 tensor 를 그대로 parameter 로 사용합니다. (ImageNet weight load + 초기화 + 복사가 모두 생략됨)
+    meta device 를 지원하지 않는 torch 이거나 state_dict 에 없는 buffer 가 있으면 CPU 에서 생성 후 복사합니다.
     '''
-    def __init__(self, num_classes):
-        super(Swin_p4, self).__init__()
-        self.model = timm.create_model('swin_base_patch4_window7_224', pretrained=True)
-        self.num_ftrs = self.model.head.in_features
-        self.model.head = nn.Linear(self.num_ftrs, num_classes)
+    if issubclass(model_entrypoint(model_name), PretrainedModel):
+        kwargs.setdefault('pretrained', False)
+    try:
+        with torch.device('meta'):
+            model = create_model(model_name, **kwargs)
+        model.load_state_dict(state_dict, assign=True)
+        if _has_meta_tensors(model):
+            raise RuntimeError('state_dict does not cover every buffer')
+    except (AttributeError, TypeError, RuntimeError): # torch < 2.1
+        model = create_model(model_name, **kwargs)
+        model.load_state_dict(state_dict)
+    return model.to(device)
 
-    def forward(self, x):
-        x = self.model(x)
-        return x
-    
-class Swin_p4_l(nn.Module):
-    '''
-    생성자 : 박승희
-    '''
-    def __init__(self, num_classes):
-        super(Swin_p4_l, self).__init__()
-        self.model = timm.create_model('swin_large_patch4_window7_224', pretrained=True)
-        self.num_ftrs = self.model.head.in_features
-        self.model.head = nn.Linear(self.num_ftrs, num_classes)
 
-    def forward(self, x):
-        x = self.model(x)
-        return x
-    
-class Swin_p4_s(nn.Module):
+def make_traceable(model):
     '''
-    생성자 : 박승희
+    torch.jit.trace / torch.fx 로 변환할 수 있도록 모델을 바꿉니다. (quantize.py, export.py)
+    efficientnet_pytorch 의 MemoryEfficientSwish 는 autograd.Function 이라 trace 되지 않으므로 일반 Swish 로 바꿉니다.
     '''
-    def __init__(self, num_classes):
-        super(Swin_p4_s, self).__init__()
-        self.model = timm.create_model('swin_small_patch4_window7_224', pretrained=True)
-        self.num_ftrs = self.model.head.in_features
-        self.model.head = nn.Linear(self.num_ftrs, num_classes)
+    for module in model.modules():
+        if hasattr(module, 'set_swish'):
+            module.set_swish(memory_efficient=False)
+    return model.eval()
 
-    def forward(self, x):
-        x = self.model(x)
-        return x
\ No newline at end of file
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='list models / fill the local pretrained weight cache')
+    parser.add_argument('command', choices=['list', 'fetch', 'verify'], help='list: registry and cache state, fetch: download weights, verify: check sha256 of cached files')
+    parser.add_argument('models', nargs='*', help="model names (default for fetch/verify: all)")
+    parser.add_argument('--cache_dir', type=str, default=None, help=f'weight cache dir (default: ${WEIGHTS_DIR_ENV} or ~/.cache/pstage/weights)')
+    args = parser.parse_args()
+
+    names = args.models or list(_backbone_specs)
+    for name in names:
+        if name not in _backbone_specs:
+            print(f"{name:<24}no pretrained backbone")
+            continue
+        spec = _backbone_specs[name]
+        if args.command == 'fetch':
+            print(f"{name:<24}{fetch_weights(spec, args.cache_dir)}")
+            continue
+        path = cached_weights_path(spec, args.cache_dir)
+        if args.command == 'verify' and path is not None:
+            ok = file_sha256(path) == os.path.basename(path).split('.')[0]
+            print(f"{name:<24}{'ok' if ok else 'CORRUPTED'} {path}")
+        else:
+            print(f"{name:<24}{_weights_key(spec):<48}{spec['input_size']}  {'cached' if path else 'missing'}")
@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from model import file_sha256 # model.py
+
+
+def image_digest(path, chunk_size=1 << 20):
+    '''
+    이미지 파일 내용의 blake2b (128 bit) hash. 경로나 수정 시간이 바뀌어도 내용이 같으면 같은 값입니다.
+    '''
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_images(paths, num_threads=8):
+    '''
+    hashlib 은 GIL 을 풀고 계산하므로 thread 로 나누어 hash 합니다.
+    '''
+    with ThreadPoolExecutor(max_workers=num_threads) as pool:
+        return list(pool.map(image_digest, paths, chunksize=64))
+
+
+def config_key(config):
+    '''
+    전처리 / 모델 설정 dict 를 key 문자열로 만듭니다. (resize, normalize, tta, model_type ...)
+    '''
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:32]
+
+
+class PredictionCache:
+    '''
+    (이미지 내용 hash, checkpoint hash, 전처리 설정 key) -> logits 를 저장하는 sqlite 캐시
+    task 모델 하나만 다시 학습한 뒤 inference 를 다시 돌리면 나머지 모델은 바뀐 이미지만 추론합니다.
+    - predictions : logits 는 float32 bytes 로 저장
+    - checkpoints : (path, size, mtime) 가 같으면 checkpoint 를 다시 hash 하지 않도록 sha256 을 기록
+    '''
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL') # 여러 inference process 가 동시에 읽을 수 있도록
+        self.db.execute('CREATE TABLE IF NOT EXISTS predictions (image TEXT, model TEXT, config TEXT, logits BLOB, '
+                        'PRIMARY KEY (image, model, config)) WITHOUT ROWID')
+        self.db.execute('CREATE TABLE IF NOT EXISTS checkpoints (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, digest TEXT)')
+        self.db.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def checkpoint_digest(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        row = self.db.execute('SELECT size, mtime_ns, digest FROM checkpoints WHERE path = ?', (path,)).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2]
+        digest = file_sha256(path)
+        self.db.execute('INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?)', (path, stat.st_size, stat.st_mtime_ns, digest))
+        self.db.commit()
+        return digest
+
+    def get_many(self, images, model, config, batch_size=500):
+        '''
+        images (hash 리스트) 중 캐시에 있는 것을 {hash: logits} 로 반환하고 hit / miss 수를 누적합니다.
+        '''
+        found = {}
+        unique = list(dict.fromkeys(images))
+        for begin in range(0, len(unique), batch_size):
+            batch = unique[begin:begin + batch_size]
+            rows = self.db.execute(
+                f"SELECT image, logits FROM predictions WHERE model = ? AND config = ? AND image IN ({','.join('?' * len(batch))})",
+                [model, config] + batch)
+            for image, blob in rows:
+                found[image] = np.frombuffer(blob, dtype=np.float32)
+        hits = sum(image in found for image in images)
+        self.hits += hits
+        self.misses += len(images) - hits
+        return found
+
+    def put_many(self, images, logits, model, config):
+        self.db.executemany('INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?)',
+                            [(image, model, config, np.asarray(row, dtype=np.float32).tobytes()) for image, row in zip(images, logits)])
+        self.db.commit()
+
+    @property
+    def hit_rate(self):
+        return self.hits / max(self.hits + self.misses, 1)
+
+    def close(self):
+        self.db.close()
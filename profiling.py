@@ -0,0 +1,199 @@
+import os
+import time
+from collections import OrderedDict
+
+import torch
+
+
+class StepTimer:
+    '''
+    train step 을 단계별로 나누어 시간을 누적하는 lap timer
+    lap(stage) 를 부르면 직전 lap 이후 걸린 시간이 stage 에 더해집니다. (perf_counter 한 번이라 overhead 가 거의 없음)
+    - stages : data(loader 대기), h2d(device 복사), forward, loss, backward, optimizer(zero_grad + step), logging
+    - sync_cuda : True 이면 lap 마다 torch.cuda.synchronize() 를 호출합니다.
+                  False(기본)이면 GPU 에서는 비동기 실행 시간이 다음 sync 지점(loss.item() 이 있는 logging)으로 넘어갑니다.
+    - summary() : 마지막 summary 이후 step 당 평균 ms 를 stage 별로 반환하고 초기화합니다.
+    '''
+    stages = ('data', 'h2d', 'forward', 'loss', 'backward', 'optimizer', 'logging')
+
+    def __init__(self, sync_cuda=False):
+        self.sync_cuda = sync_cuda and torch.cuda.is_available()
+        self.totals = OrderedDict((stage, 0.0) for stage in self.stages)
+        self.steps = 0
+        self.last = time.perf_counter()
+
+    def start(self):
+        '''
+        data loader 를 기다리기 직전(epoch 시작)에 호출합니다.
+        '''
+        self.last = time.perf_counter()
+
+    def lap(self, stage):
+        if self.sync_cuda:
+            torch.cuda.synchronize()
+        now = time.perf_counter()
+        self.totals[stage] += now - self.last
+        self.last = now
+        if stage == 'data':
+            self.steps += 1
+
+    def summary(self):
+        steps = max(self.steps, 1)
+        result = OrderedDict((stage, total / steps * 1000) for stage, total in self.totals.items())
+        for stage in self.totals:
+            self.totals[stage] = 0.0
+        self.steps = 0
+        return result
+
+    @staticmethod
+    def format(summary):
+        '''
+        summary 를 "data 12.3ms (40%) | forward ..." 형태로 만들고 input-bound / compute-bound 를 표시합니다.
+        '''
+        total = sum(summary.values()) or 1
+        parts = [f"{stage} {ms:.1f}ms ({ms / total:.0%})" for stage, ms in summary.items()]
+        compute = summary['forward'] + summary['loss'] + summary['backward'] + summary['optimizer']
+        bound = 'input-bound' if summary['data'] + summary['h2d'] > compute else 'compute-bound'
+        return ' | '.join(parts) + f' || step {total:.1f}ms, {bound}'
+
+
+def parse_step_window(value):
+    '''
+    "START:END" 문자열을 (start, end) 로 변환합니다. END 는 포함하지 않습니다.
+    '''
+    start, end = (int(v) for v in value.split(':'))
+    if not 0 <= start < end:
+        raise ValueError(f"profile steps should be START:END with 0 <= START < END, {value}")
+    return start, end
+
+
+class ProfileWindow:
+    '''
+    [start, end) 번째 step 만 torch.profiler 로 기록하는 클래스
+    매 step 끝에 step() 을 호출하면 window 가 끝날 때 trace 를 저장하고 profiler 를 멈춥니다.
+    - CPU(+CUDA) activity, memory, shape, python stack 을 기록합니다.
+    - trace 는 {save_dir}/profile 아래 Chrome trace(json) 로 저장되며 TensorBoard profiler plugin 으로도 볼 수 있습니다.
+    - self time 기준 상위 operator 표를 출력합니다.
+    '''
+    def __init__(self, window, save_dir, row_limit=20):
+        from torch.profiler import profile, schedule, ProfilerActivity, tensorboard_trace_handler
+
+        self.start, self.end = window
+        self.row_limit = row_limit
+        self.trace_dir = os.path.join(save_dir, 'profile')
+        self.trace_handler = tensorboard_trace_handler(self.trace_dir)
+        self.steps = 0
+        self.done = False
+
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        warmup = 1 if self.start > 0 else 0
+        self.profiler = profile(
+            activities=activities,
+            schedule=schedule(wait=self.start - warmup, warmup=warmup, active=self.end - self.start, repeat=1),
+            on_trace_ready=self._on_trace_ready,
+            profile_memory=True,
+            record_shapes=True,
+            with_stack=True,
+        )
+        self.profiler.start()
+
+    def _on_trace_ready(self, prof):
+        self.trace_handler(prof)
+        sort_by = 'self_cuda_time_total' if torch.cuda.is_available() else 'self_cpu_time_total'
+        print(f"[profile] steps {self.start}:{self.end}, top operators by self time")
+        print(prof.key_averages().table(sort_by=sort_by, row_limit=self.row_limit))
+        print("[profile] top operators grouped by python stack")
+        print(prof.key_averages(group_by_stack_n=5).table(sort_by=sort_by, row_limit=self.row_limit))
+        print(f"[profile] trace saved at {self.trace_dir} (chrome://tracing or tensorboard --logdir {self.trace_dir})")
+
+    def step(self):
+        if self.done:
+            return
+        self.profiler.step()
+        self.steps += 1
+        if self.steps >= self.end:
+            self.stop()
+
+    def stop(self):
+        if not self.done:
+            self.done = True
+            self.profiler.stop()
+
+
+def _transform_name(index, transform):
+    name = type(transform).__name__
+    inner = getattr(transform, 'transforms', None)
+    if inner is not None and name != 'Compose':
+        name += '[' + ','.join(type(t).__name__ for t in inner) + ']'
+    return f'{index}:{name}'
+
+
+class TimedCompose:
+    '''
+    torchvision Compose 와 같이 transform 을 순서대로 적용하면서 transform 별 호출 수와 누적 시간을 기록하는 클래스
+    기록은 shared memory tensor (num_workers + 1, num_transforms, 2) 에 저장됩니다.
+    row 0 은 main process, row 1.. 은 DataLoader worker(id) 별 row 라서 lock 없이 누적되고,
+    worker 가 매 epoch 새로 만들어져도 main process 에서 summary() 로 합산해 볼 수 있습니다.
+    '''
+    def __init__(self, transforms, num_workers=0):
+        self.transforms = list(transforms)
+        self.names = [_transform_name(i, t) for i, t in enumerate(self.transforms)]
+        self.stats = torch.zeros(num_workers + 1, len(self.transforms), 2, dtype=torch.float64).share_memory_()
+        self._view = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_view'] = None
+        return state
+
+    def __call__(self, image):
+        if self._view is None:
+            self._view = self.stats.numpy()
+        info = torch.utils.data.get_worker_info()
+        row = self._view[0 if info is None else info.id % (len(self._view) - 1) + 1]
+        for i, transform in enumerate(self.transforms):
+            start = time.perf_counter()
+            image = transform(image)
+            row[i, 1] += time.perf_counter() - start
+            row[i, 0] += 1
+        return image
+
+    def summary(self, reset=True):
+        '''
+        모든 process 의 기록을 합산하여 [(name, calls, total_sec, avg_ms)] 를 반환합니다.
+        '''
+        totals = self.stats.sum(dim=0)
+        result = [
+            (name, int(calls), seconds, seconds / calls * 1000 if calls else 0.0)
+            for name, (calls, seconds) in zip(self.names, totals.tolist())
+        ]
+        if reset:
+            self.stats.zero_()
+        return result
+
+    @staticmethod
+    def format(summary):
+        total = sum(seconds for _, _, seconds, _ in summary) or 1
+        lines = [f"{'transform':<48}{'calls':>8}{'avg ms':>10}{'total s':>10}{'share':>8}"]
+        for name, calls, seconds, avg_ms in sorted(summary, key=lambda s: -s[2]):
+            lines.append(f"{name:<48}{calls:>8}{avg_ms:>10.3f}{seconds:>10.2f}{seconds / total:>8.0%}")
+        return '\n'.join(lines)
+
+    def __repr__(self):
+        return 'TimedCompose(' + ', '.join(repr(t) for t in self.transforms) + ')'
+
+
+def instrument_transform(transform, num_workers=0):
+    '''
+    Compose 또는 Compose 를 .transform 으로 가진 augmentation 객체(BaseAugmentation 등)를 TimedCompose 로 바꿉니다.
+    바꾼 TimedCompose 를 반환하며, 바꿀 수 없으면 None 을 반환합니다.
+    '''
+    inner = getattr(transform, 'transform', None)
+    if inner is not None and hasattr(inner, 'transforms'):
+        transform.transform = TimedCompose(inner.transforms, num_workers)
+        return transform.transform
+    if hasattr(transform, 'transforms'):
+        return TimedCompose(transform.transforms, num_workers)
+    return None
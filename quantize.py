@@ -0,0 +1,175 @@
+import argparse
+import copy
+import json
+import os
+import random
+from importlib import import_module
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, Subset
+
+from bench import measure # bench.py
+from inference import INFERENCE_TASKS, load_member # inference.py
+from model import make_traceable # model.py
+from validation import validate # validation.py
+
+
+QUANTIZE_MODES = ('dynamic', 'static')
+
+
+def quantize_dynamic(model):
+    '''
+    nn.Linear 의 weight 를 int8 로 바꾸고 activation 은 실행할 때 quantize 합니다. (calibration 불필요)
+    conv backbone 은 classifier 만 바뀌므로 ViT / Swin 처럼 Linear 가 많은 모델에서 효과가 큽니다.
+    '''
+    return torch.ao.quantization.quantize_dynamic(copy.deepcopy(model), {nn.Linear}, dtype=torch.qint8)
+
+
+@torch.no_grad()
+def quantize_static(model, calib_loader, example_inputs):
+    '''
+    FX graph mode post-training static quantization
+    observer 를 넣은 모델에 calib_loader 의 이미지를 흘려 activation 범위를 정한 뒤 conv / linear 를 int8 로 변환합니다.
+    '''
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    qconfig_mapping = get_default_qconfig_mapping(torch.backends.quantized.engine)
+    prepared = prepare_fx(copy.deepcopy(model), qconfig_mapping, example_inputs)
+    for inputs, _ in calib_loader:
+        prepared(inputs)
+    return convert_fx(prepared)
+
+
+def to_torchscript(model, example_inputs):
+    '''
+    inference.py 가 model.py 없이 로드할 수 있도록 trace 후 freeze 한 TorchScript 모델
+    '''
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example_inputs)
+    return torch.jit.freeze(traced.eval())
+
+
+def seed_everything(seed):
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+    random.seed(seed)
+
+
+def build_loaders(config, args):
+    '''
+    train.py 와 같은 dataset / seed 로 split 하여 calibration loader (train 일부) 와 validation loader 를 만듭니다.
+    train.py 와 같은 seed 를 사용하므로 split_dataset 결과도 학습 때와 같습니다.
+    '''
+    seed_everything(config.get('seed', args.seed))
+    dataset_module = getattr(import_module("dataset"), config.get('dataset', INFERENCE_TASKS[args.model_type]))
+    dataset = dataset_module(data_dir=args.data_dir, outlier_remove=config.get('outlier_remove', False))
+    transform = getattr(import_module("dataset"), 'BaseAugmentation')(resize=args.resize, mean=dataset.mean, std=dataset.std)
+    dataset.set_transform(transform)
+    train_set, val_set = dataset.split_dataset()
+
+    generator = torch.Generator().manual_seed(args.seed)
+    calib_indices = torch.randperm(len(train_set), generator=generator)[:args.calib_images].tolist()
+    calib_loader = DataLoader(Subset(train_set, calib_indices), batch_size=args.batch_size, num_workers=args.num_workers)
+    if args.val_images:
+        val_set = Subset(val_set, range(min(args.val_images, len(val_set))))
+    val_loader = DataLoader(val_set, batch_size=args.batch_size, num_workers=args.num_workers)
+    return calib_loader, val_loader
+
+
+def latency(model, batch_size, resize, steps, warmup):
+    inputs = torch.randn(batch_size, 3, *resize)
+
+    def forward():
+        with torch.no_grad():
+            model(inputs)
+
+    return measure(forward, batch_size, steps, warmup)
+
+
+def save_artifact(scripted, config, output_dir, mode):
+    '''
+    {output_dir}/{mode}/best.pt 와 config.json 을 저장합니다. inference.py --model_dir {output_dir}/{mode} --device cpu 로 바로 사용
+    '''
+    save_dir = os.path.join(output_dir, mode)
+    os.makedirs(save_dir, exist_ok=True)
+    path = os.path.join(save_dir, 'best.pt')
+    torch.jit.save(scripted, path)
+    with open(os.path.join(save_dir, 'config.json'), 'w', encoding='utf-8') as f:
+        json.dump(dict(config, quantization=mode, quantized_engine=torch.backends.quantized.engine), f, ensure_ascii=False, indent=4)
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='post-training int8 quantization (dynamic / static FX) of a trained model for CPU inference')
+    parser.add_argument('--model_dir', type=str, required=True, help='train.py save dir (best.safetensors or best.pth + config.json)')
+    parser.add_argument('--model_type', type=str, default='MaskBase', help='MaskBase, Mask, Gender, Age or MaskGender (default: MaskBase)')
+    parser.add_argument('--model', type=str, default='BaseModel', help='model type if config.json is missing (default: BaseModel)')
+    parser.add_argument('--resize', nargs=2, type=int, default=None, help='input size H W (default: resize in config.json)')
+    parser.add_argument('--modes', nargs='+', default=list(QUANTIZE_MODES), choices=QUANTIZE_MODES, help='quantization modes (default: dynamic static)')
+    parser.add_argument('--calib_images', type=int, default=256, help='training images used to calibrate static quantization (default: 256)')
+    parser.add_argument('--val_images', type=int, default=None, help='evaluate on the first N validation images (default: all)')
+    parser.add_argument('--batch_size', type=int, default=32, help='calibration / validation batch size (default: 32)')
+    parser.add_argument('--num_workers', type=int, default=4, help='data loader workers (default: 4)')
+    parser.add_argument('--num_threads', type=int, default=None, help='torch.set_num_threads (default: torch default)')
+    parser.add_argument('--latency_batch_sizes', nargs='+', type=int, default=[1, 32], help='batch sizes for latency (default: 1 32)')
+    parser.add_argument('--steps', type=int, default=10, help='measured steps for latency (default: 10)')
+    parser.add_argument('--seed', type=int, default=111, help='seed if config.json is missing (default: 111)')
+    parser.add_argument('--data_dir', type=str, default=os.environ.get('SM_CHANNEL_TRAIN', '/opt/ml/input/data/train/images'))
+    parser.add_argument('--output_dir', type=str, default=None, help='artifacts dir (default: {model_dir}/int8)')
+    args = parser.parse_args()
+
+    if args.num_threads:
+        torch.set_num_threads(args.num_threads)
+    device = torch.device('cpu')
+    config_path = os.path.join(args.model_dir, 'config.json')
+    config = {}
+    if os.path.exists(config_path):
+        with open(config_path, encoding='utf-8') as f:
+            config = json.load(f)
+    args.resize = tuple(args.resize or config.get('resize', (512, 384)))
+    config = dict(config, model=config.get('model', args.model), resize=list(args.resize))
+    output_dir = args.output_dir or os.path.join(args.model_dir, 'int8')
+
+    model, _ = load_member(args.model_type, args.model_dir, args, device)
+    model = make_traceable(model) # efficientnet 은 trace 가능한 Swish 로
+    calib_loader, val_loader = build_loaders(config, args)
+    example_inputs = (torch.randn(1, 3, *args.resize),)
+    criterion = nn.CrossEntropyLoss()
+
+    candidates = {'fp32': model}
+    for mode in args.modes:
+        try:
+            if mode == 'dynamic':
+                candidates[mode] = quantize_dynamic(model)
+            else:
+                candidates[mode] = quantize_static(model, calib_loader, example_inputs)
+        except Exception as e: # FX trace 가 안 되는 모델 (data dependent control flow 등)
+            print(f"{mode} quantization is not supported for {config['model']}: {type(e).__name__}: {e}")
+
+    report = {'model': config['model'], 'model_dir': args.model_dir, 'engine': torch.backends.quantized.engine, 'results': {}}
+    for mode, candidate in candidates.items():
+        result = validate(candidate, val_loader, criterion, device)
+        entry = {'f1': float(result['f1']), 'acc': result['acc'], 'n': result['n'], 'latency': {}}
+        for batch_size in args.latency_batch_sizes:
+            entry['latency'][batch_size] = latency(candidate, batch_size, args.resize, args.steps, warmup=2)
+        if mode != 'fp32':
+            entry['path'] = save_artifact(to_torchscript(candidate, example_inputs), config, output_dir, mode)
+        report['results'][mode] = entry
+
+    base = report['results']['fp32']
+    print(f"{'mode':<10}{'f1':>8}{'Δf1':>9}{'acc':>8}" + ''.join(f"{f'ms@{b}':>11}{'speedup':>9}" for b in args.latency_batch_sizes))
+    for mode, entry in report['results'].items():
+        line = f"{mode:<10}{entry['f1']:>8.4f}{entry['f1'] - base['f1']:>+9.4f}{entry['acc']:>8.4f}"
+        for b in args.latency_batch_sizes:
+            ms = entry['latency'][b]['ms_per_step']
+            line += f"{ms:>11.1f}{base['latency'][b]['ms_per_step'] / ms:>8.2f}x"
+        print(line)
+        if 'path' in entry:
+            print(f"    saved at {entry['path']}")
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, 'quantize.json'), 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+    print(f"report saved at {os.path.join(output_dir, 'quantize.json')} (run: python inference.py --model_dir {output_dir}/<mode> --device cpu)")
@@ -0,0 +1,278 @@
+import argparse
+import csv
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+
+from dataset import build_manifest, build_image_cache, is_image_file, MANIFEST_ENV, IMAGE_CACHE_ENV # dataset.py
+
+
+TRAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'train.py')
+RUNNER_EXCLUDED_ARGS = ('submit',) # eval set submission 은 run 마다 만들지 않음
+
+
+def parse_grid(items):
+    '''
+    ["model=EfficientNetB3,ResNet34", "lr=1e-5,1e-4"] 형태의 grid 를 config dict 리스트(곱집합)로 변환합니다.
+    '''
+    keys, values = [], []
+    for item in items:
+        key, value = item.split('=', 1)
+        keys.append(key)
+        values.append(value.split(','))
+    return [dict(zip(keys, combo)) for combo in itertools.product(*values)]
+
+
+def load_configs(path):
+    '''
+    config dict 의 list 가 담긴 json 파일을 읽습니다. 예) [{"model": "ResNet34", "lr": 1e-4}, ...]
+    '''
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def config_to_args(config):
+    '''
+    config dict 를 train.py 인자 리스트로 변환합니다.
+    True 는 flag 만, False/None 은 생략, list 는 여러 값으로 전달합니다. RUNNER_EXCLUDED_ARGS 는 전달하지 않습니다.
+    '''
+    args = []
+    for key, value in config.items():
+        if key in RUNNER_EXCLUDED_ARGS:
+            continue
+        if value is True:
+            args.append(f'--{key}')
+        elif value is False or value is None:
+            continue
+        elif isinstance(value, (list, tuple)):
+            args += [f'--{key}'] + [str(v) for v in value]
+        else:
+            args += [f'--{key}', str(value)]
+    return args
+
+
+def shared_train_args(train_args):
+    '''
+    '--' 뒤에 받은 모든 run 공통 train.py 인자에서 '--' 와 RUNNER_EXCLUDED_ARGS flag 를 제거합니다.
+    '''
+    excluded = {'--'} | {f'--{key}' for key in RUNNER_EXCLUDED_ARGS}
+    dropped = [a for a in train_args if a in excluded and a != '--']
+    if dropped:
+        print(f"[runner] ignoring {' '.join(dropped)} (not passed to runs)")
+    return [a for a in train_args if a not in excluded]
+
+
+def available_memory_gb():
+    '''
+    /proc/meminfo 의 MemAvailable (GB), 확인할 수 없으면 inf
+    '''
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 1024 ** 2
+    except OSError:
+        pass
+    return float('inf')
+
+
+def build_caches(data_dir, cache_dir, num_workers=4, decode=True):
+    '''
+    모든 run 이 공유할 manifest 와 decode 된 이미지 캐시를 한 번만 만듭니다. 이미 있으면 재사용합니다.
+    '''
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest_path = os.path.join(cache_dir, 'manifest.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            entries = json.load(f)
+    else:
+        print(f'building manifest for {data_dir}')
+        entries = build_manifest(data_dir, manifest_path)
+
+    image_cache_dir = None
+    if decode:
+        image_cache_dir = os.path.join(cache_dir, 'images')
+        if not os.path.exists(os.path.join(image_cache_dir, 'index.json')):
+            root = os.path.abspath(data_dir)
+            image_paths = [
+                os.path.join(folder, file_name)
+                for folder, file_names in entries.items() if folder != root
+                for file_name in file_names
+                if is_image_file(file_name) and not file_name.startswith('.')
+            ]
+            build_image_cache(image_paths, image_cache_dir, num_workers=num_workers)
+    return manifest_path, image_cache_dir
+
+
+def make_runs(configs, sweep_dir, data_dir):
+    '''
+    config dict 리스트를 run dict 리스트로 변환합니다. 모든 run 은 sweep_dir 아래 {name} 폴더에 저장됩니다.
+    train.py 에 --save_dir 로 폴더를 그대로 넘기고, 이전 sweep 의 결과가 섞이지 않도록 이미 있는 폴더면 에러를 냅니다.
+    '''
+    runs = []
+    for i, config in enumerate(configs):
+        name = config.get('name', f'run{i}')
+        save_dir = os.path.join(sweep_dir, name)
+        if os.path.exists(save_dir):
+            raise FileExistsError(f"{save_dir} already exists, use another --sweep_dir or remove it")
+        config = dict(config, name=name, model_dir=sweep_dir, data_dir=data_dir, save_dir=save_dir)
+        runs.append({
+            'name': name,
+            'config': config,
+            'log': os.path.join(sweep_dir, f'{name}.log'),
+            'save_dir': save_dir,
+        })
+    return runs
+
+
+def shared_cache_env(data_dir, cache_dir, decode=True):
+    '''
+    build_caches 로 캐시를 만들고, 캐시 경로가 설정된 환경변수 dict 를 반환합니다.
+    '''
+    manifest_path, image_cache_dir = build_caches(data_dir, cache_dir, decode=decode)
+    env = dict(os.environ)
+    env[MANIFEST_ENV] = manifest_path
+    if image_cache_dir:
+        env[IMAGE_CACHE_ENV] = image_cache_dir
+    return env
+
+
+def run_all(runs, max_cores, cores_per_run, max_mem_gb, mem_per_run_gb, env=None, poll_interval=2):
+    '''
+    runs 의 각 command 를 CPU core / 메모리 예산 안에서 동시에 실행합니다.
+    - 각 run 에는 겹치지 않는 core 집합을 sched_setaffinity 로 지정하고 OMP/MKL thread 수를 맞춥니다.
+    - 예약 메모리(mem_per_run_gb)의 합이 max_mem_gb 를 넘거나 MemAvailable 이 부족하면 대기합니다.
+    - 출력은 run['log'] 파일로 저장됩니다.
+    run : {'name', 'cmd', 'log'} dict, 실행 후 'returncode', 'elapsed' 가 채워집니다.
+    '''
+    if mem_per_run_gb > max_mem_gb: # 한 run 도 예약할 수 없어 영원히 대기하는 것을 방지
+        raise ValueError(f"mem_per_run_gb ({mem_per_run_gb:g}) is larger than max_mem_gb ({max_mem_gb:.1f})")
+    all_cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count()))
+    free_cores = all_cores[:max_cores]
+    cores_per_run = min(cores_per_run, len(free_cores))
+    pending = list(runs)
+    running = []
+    reserved_mem = 0
+
+    while pending or running:
+        while (pending and len(free_cores) >= cores_per_run
+               and reserved_mem + mem_per_run_gb <= max_mem_gb
+               and (not running or available_memory_gb() >= mem_per_run_gb)):
+            run = pending.pop(0)
+            cores, free_cores = free_cores[:cores_per_run], free_cores[cores_per_run:]
+            reserved_mem += mem_per_run_gb
+
+            run_env = dict(os.environ if env is None else env)
+            for key in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+                run_env[key] = str(cores_per_run)
+            log = open(run['log'], 'a')
+            print(f"[runner] start {run['name']} on cores {cores[0]}-{cores[-1]}")
+            proc = subprocess.Popen(
+                run['cmd'], stdout=log, stderr=subprocess.STDOUT, env=run_env,
+                preexec_fn=(lambda cores=cores: os.sched_setaffinity(0, cores)) if hasattr(os, 'sched_setaffinity') else None,
+            )
+            running.append((proc, run, cores, log, time.time()))
+
+        time.sleep(poll_interval)
+        for item in list(running):
+            proc, run, cores, log, started = item
+            if proc.poll() is None:
+                continue
+            log.close()
+            running.remove(item)
+            free_cores = sorted(free_cores + cores)
+            reserved_mem -= mem_per_run_gb
+            run['returncode'] = proc.returncode
+            run['elapsed'] = time.time() - started
+            status = 'done' if proc.returncode == 0 else f'failed ({proc.returncode})'
+            print(f"[runner] {status} {run['name']} in {run['elapsed']:.0f}s, {len(pending)} pending / {len(running)} running")
+    return runs
+
+
+def read_run_result(save_dir):
+    '''
+    run 의 config.json 과 metrics.json 을 읽어 반환합니다. 없으면 빈 dict
+    '''
+    result = {}
+    for file_name in ('config.json', 'metrics.json'):
+        path = os.path.join(save_dir, file_name)
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                result[file_name.split('.')[0]] = json.load(f)
+        else:
+            result[file_name.split('.')[0]] = {}
+    return result
+
+
+def write_summary(runs, keys, summary_path):
+    '''
+    각 run 의 config 값(keys)과 metrics 를 하나의 표로 모아 csv 로 저장하고 best_val_acc 순으로 출력합니다.
+    '''
+    metric_keys = ['epoch', 'best_val_acc', 'best_val_f1', 'best_val_loss', 'elapsed']
+    rows = []
+    for run in runs:
+        result = read_run_result(run['save_dir'])
+        row = {'name': run['name'], 'returncode': run.get('returncode')}
+        row.update({key: result['config'].get(key, run['config'].get(key)) for key in keys})
+        row.update({key: result['metrics'].get(key) for key in metric_keys})
+        rows.append(row)
+    rows.sort(key=lambda row: -(row['best_val_acc'] or 0))
+
+    columns = ['name', 'returncode'] + list(keys) + metric_keys
+    with open(summary_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    widths = {c: max(len(c), *(len(_format(row[c])) for row in rows)) for c in columns}
+    print(' | '.join(c.ljust(widths[c]) for c in columns))
+    for row in rows:
+        print(' | '.join(_format(row[c]).ljust(widths[c]) for c in columns))
+    print(f'summary saved at {summary_path}')
+    return rows
+
+
+def _format(value):
+    if isinstance(value, float):
+        return f'{value:.4f}'
+    return '' if value is None else str(value)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='run several train.py configs concurrently with shared data caches')
+    parser.add_argument('--grid', nargs='*', default=[], help='key=v1,v2 ... (cartesian product of train.py args)')
+    parser.add_argument('--configs', type=str, default=None, help='json file with a list of train.py arg dicts')
+    parser.add_argument('--sweep_dir', type=str, default='./sweep', help='model_dir for every run, logs and summary.csv (default: ./sweep)')
+    parser.add_argument('--data_dir', type=str, default=os.environ.get('SM_CHANNEL_TRAIN', '/opt/ml/input/data/train/images'))
+    parser.add_argument('--cache_dir', type=str, default=None, help='shared manifest / image cache dir (default: {sweep_dir}/cache)')
+    parser.add_argument('--no_image_cache', action='store_true', help='share only the manifest, decode images from disk in every run')
+    parser.add_argument('--max_cores', type=int, default=os.cpu_count(), help='total cores for all runs (default: all)')
+    parser.add_argument('--cores_per_run', type=int, default=8, help='cores pinned to each run (default: 8)')
+    parser.add_argument('--max_mem_gb', type=float, default=available_memory_gb() * 0.8, help='total memory budget (default: 80%% of MemAvailable)')
+    parser.add_argument('--mem_per_run_gb', type=float, default=8, help='memory reserved for each run (default: 8)')
+    parser.add_argument('train_args', nargs=argparse.REMAINDER, help='-- followed by train.py args shared by every run')
+    args = parser.parse_args()
+
+    configs = parse_grid(args.grid)
+    if args.configs:
+        configs += load_configs(args.configs)
+    if not configs:
+        parser.error('no configs given (use --grid and/or --configs)')
+    if args.mem_per_run_gb > args.max_mem_gb:
+        parser.error(f'--mem_per_run_gb {args.mem_per_run_gb:g} is larger than --max_mem_gb {args.max_mem_gb:.1f}, no run could ever start')
+    shared_args = shared_train_args(args.train_args)
+
+    os.makedirs(args.sweep_dir, exist_ok=True)
+    env = shared_cache_env(args.data_dir, args.cache_dir or os.path.join(args.sweep_dir, 'cache'), decode=not args.no_image_cache)
+
+    runs = make_runs(configs, args.sweep_dir, args.data_dir)
+    for run in runs:
+        run['cmd'] = [sys.executable, TRAIN_SCRIPT] + shared_args + config_to_args(run['config'])
+
+    run_all(runs, args.max_cores, args.cores_per_run, args.max_mem_gb, args.mem_per_run_gb, env=env)
+
+    keys = sorted({key for config in configs for key in config if key != 'name'})
+    write_summary(runs, keys, os.path.join(args.sweep_dir, 'summary.csv'))
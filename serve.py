@@ -0,0 +1,255 @@
+import argparse
+import asyncio
+import io
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+from dataset import MultiResizeTestDataset # dataset.py
+from deploy import label_table # deploy.py
+from ensemble import combine_predictions # ensemble.py
+from inference import load_member, parse_members, select_device, wrap_tta # inference.py
+
+
+class ModelServer:
+    '''
+    members (fused_inference 와 같은 model_type=model_dir) 를 한 번 로드해 두고 micro-batch 단위로 추론하는 클래스
+    - submit : 이미지 bytes 를 queue 에 넣고 결과 future 를 기다립니다.
+    - batcher : queue 에서 첫 요청을 꺼낸 뒤 max_batch 개가 되거나 max_wait_ms 가 지날 때까지 모아서 한 번에 추론합니다.
+    decode / resize 와 forward 는 thread pool 에서 실행하므로 event loop 는 요청을 계속 받습니다.
+    '''
+    def __init__(self, members, args, max_batch=16, max_wait_ms=10, history=1000, max_body_mb=20):
+        self.device = select_device(args)
+        self.models = []
+        resizes = []
+        for model_type, model_dir in parse_members(members):
+            model, resize = load_member(model_type, model_dir, args, self.device)
+            if resize not in resizes:
+                resizes.append(resize)
+            self.models.append((model_type, wrap_tta(model, getattr(args, 'tta', None)), resizes.index(resize)))
+            print(f"{model_type:<11}{type(model).__name__} from {model_dir}, resize {resize}")
+        self.transforms = MultiResizeTestDataset([], resizes).transforms
+        self.labels = label_table('MaskBase', 18)
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.max_body = int(max_body_mb * (1 << 20))
+        self.queue = None
+        self.executor = ThreadPoolExecutor(max_workers=max(2, os.cpu_count() or 1))
+        self.forward_executor = ThreadPoolExecutor(max_workers=1) # forward 는 하나씩 (intra-op thread 가 core 를 사용)
+        self.latencies = deque(maxlen=history)
+        self.batch_sizes = deque(maxlen=history)
+        self.counts = {'requests': 0, 'errors': 0, 'batches': 0}
+        self.started = time.time()
+
+    def preprocess(self, data):
+        from PIL import Image
+        image = Image.open(io.BytesIO(data)).convert('RGB')
+        return [transform(image) for transform in self.transforms]
+
+    @torch.no_grad()
+    def forward(self, tensors):
+        '''
+        tensors : 요청별 [resize 별 tensor] -> 요청별 18 class code
+        '''
+        batches = [torch.stack([t[i] for t in tensors]).to(self.device) for i in range(len(self.transforms))]
+        preds = {model_type: model(batches[resize_index]).argmax(dim=-1).cpu().numpy()
+                 for model_type, model, resize_index in self.models}
+        return combine_predictions(preds).tolist()
+
+    async def submit(self, data):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        tensors = await loop.run_in_executor(self.executor, self.preprocess, data)
+        future = loop.create_future()
+        await self.queue.put((tensors, future))
+        code = await future
+        self.latencies.append((time.perf_counter() - start) * 1000)
+        return dict(self.labels[code], **{'class': code})
+
+    async def batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                items = [await self.queue.get()]
+                deadline = loop.time() + self.max_wait
+                while len(items) < self.max_batch:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        items.append(await asyncio.wait_for(self.queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                # 기다리는 동안 client 가 끊겨 cancel 된 future 는 set_result / set_exception 하면 InvalidStateError
+                try:
+                    codes = await loop.run_in_executor(self.forward_executor, self.forward, [tensors for tensors, _ in items])
+                    for (_, future), code in zip(items, codes):
+                        if not future.done():
+                            future.set_result(code)
+                except Exception as e:
+                    for _, future in items:
+                        if not future.done():
+                            future.set_exception(e)
+                self.counts['batches'] += 1
+                self.batch_sizes.append(len(items))
+            except Exception as e: # batcher task 가 죽으면 이후 모든 요청이 영원히 기다리므로 기록만 하고 계속
+                print(f"batcher error: {type(e).__name__}: {e}")
+
+    def metrics(self):
+        latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+        return dict(
+            self.counts,
+            queue_depth=self.queue.qsize() if self.queue is not None else 0,
+            avg_batch_size=float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.0,
+            latency_ms={'p50': float(p50), 'p90': float(p90), 'p99': float(p99), 'max': float(latencies.max())},
+            uptime_s=time.time() - self.started,
+        )
+
+
+def _response(writer, status, body, keep_alive):
+    payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+    reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 413: 'Payload Too Large', 500: 'Internal Server Error'}[status]
+    writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\nContent-Length: {len(payload)}\r\n"
+                 f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + payload)
+
+
+async def handle(server, reader, writer):
+    '''
+    HTTP/1.1 요청 처리 (keep-alive 지원)
+    - POST /predict : body = 이미지 파일 bytes -> {"class", "mask", "gender", "age"}
+    - GET /metrics  : 요청 / batch 수, queue 깊이, 평균 batch 크기, latency percentile (ms)
+    - GET /health
+    Content-Length 가 server.max_body 보다 크거나 음수이면 body 를 읽지 않고 413 / 400 을 보낸 뒤 연결을 닫습니다.
+    request line 이나 Content-Length 를 해석할 수 없을 때도 400 을 보내고 연결을 닫습니다.
+    '''
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                key, _, value = line.decode('latin-1').partition(':')
+                headers[key.strip().lower()] = value.strip()
+            try:
+                method, path, version = request_line.decode('latin-1').split()
+                length = int(headers.get('content-length', 0))
+            except ValueError: # 잘못된 request line / Content-Length 는 body 경계를 알 수 없으므로 응답 후 연결을 닫음
+                _response(writer, 400, {'error': f'malformed request: {request_line[:100]!r}, '
+                                                 f'Content-Length {headers.get("content-length")!r}'}, False)
+                await writer.drain()
+                break
+            if not 0 <= length <= server.max_body:
+                _response(writer, 413 if length > 0 else 400,
+                          {'error': f'Content-Length {length} (max {server.max_body} bytes)'}, False)
+                await writer.drain()
+                break
+            body = await reader.readexactly(length)
+            keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+
+            if method == 'POST' and path == '/predict':
+                server.counts['requests'] += 1
+                try:
+                    _response(writer, 200, await server.submit(body), keep_alive)
+                except Exception as e:
+                    server.counts['errors'] += 1
+                    _response(writer, 400 if isinstance(e, OSError) else 500, {'error': f'{type(e).__name__}: {e}'}, keep_alive)
+            elif method == 'GET' and path == '/metrics':
+                _response(writer, 200, server.metrics(), keep_alive)
+            elif method == 'GET' and path == '/health':
+                _response(writer, 200, {'status': 'ok'}, keep_alive)
+            else:
+                _response(writer, 404, {'error': f'{method} {path}'}, keep_alive)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(server, host, port):
+    server.queue = asyncio.Queue()
+    batcher = asyncio.create_task(server.batcher())
+    http = await asyncio.start_server(lambda r, w: handle(server, r, w), host, port)
+    print(f"serving on http://{host}:{port} (POST /predict, GET /metrics), max_batch {server.max_batch}, max_wait {server.max_wait * 1000:.0f}ms")
+    async with http:
+        try:
+            await http.serve_forever()
+        finally:
+            batcher.cancel()
+
+
+def run_client(url, paths, concurrency, repeat):
+    '''
+    이미지 파일들을 concurrency 개의 thread 로 동시에 POST 하여 결과와 처리량, latency percentile 을 출력합니다.
+    '''
+    from urllib.request import Request, urlopen
+
+    def post(path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        start = time.perf_counter()
+        with urlopen(Request(url.rstrip('/') + '/predict', data=data, method='POST',
+                             headers={'Content-Type': 'application/octet-stream'})) as response:
+            result = json.loads(response.read())
+        return path, result, (time.perf_counter() - start) * 1000
+
+    jobs = list(paths) * repeat
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(post, jobs))
+    elapsed = time.perf_counter() - start
+    for path, result, ms in results[:len(paths)]:
+        print(f"{path}\t{result['class']}\t{result['mask']}\t{result['gender']}\t{result['age']}\t{ms:.1f}ms")
+    latencies = np.array([ms for _, _, ms in results])
+    print(f"{len(jobs)} requests in {elapsed:.2f}s ({len(jobs) / elapsed:.1f} req/s), "
+          f"p50 {np.percentile(latencies, 50):.1f}ms p90 {np.percentile(latencies, 90):.1f}ms p99 {np.percentile(latencies, 99):.1f}ms")
+    with urlopen(url.rstrip('/') + '/metrics') as response:
+        print(f"server metrics: {response.read().decode('utf-8')}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='local HTTP inference service with dynamic micro-batching, or a client for it')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    server_parser = subparsers.add_parser('server', help='load models once and serve POST /predict')
+    server_parser.add_argument('--members', nargs='+', required=True, help='model_type=model_dir ... (e.g. MaskBase=./model/exp or Mask=... Gender=... Age=...)')
+    server_parser.add_argument('--model', type=str, default='BaseModel', help='model type if config.json is missing (default: BaseModel)')
+    server_parser.add_argument('--resize', nargs=2, type=int, default=[512, 384], help='input size if config.json is missing (default: 512 384)')
+    server_parser.add_argument('--host', type=str, default='127.0.0.1', help='bind address (default: 127.0.0.1)')
+    server_parser.add_argument('--port', type=int, default=8000, help='port (default: 8000)')
+    server_parser.add_argument('--max_batch', type=int, default=16, help='max images per forward (default: 16)')
+    server_parser.add_argument('--max_wait_ms', type=float, default=10, help='max time the first queued image waits for a batch (default: 10)')
+    server_parser.add_argument('--max_body_mb', type=float, default=20, help='max request body size in MB, larger requests get 413 (default: 20)')
+    server_parser.add_argument('--device', type=str, default=None, help='cpu or cuda (default: cuda if available)')
+    server_parser.add_argument('--num_threads', type=int, default=None, help='torch.set_num_threads (default: torch default)')
+    server_parser.add_argument('--tta', type=str, default='none', choices=['none', 'flip', 'crop', 'flip_crop'], help='test-time augmentation (default: none)')
+
+    client_parser = subparsers.add_parser('client', help='send images to a running server')
+    client_parser.add_argument('images', nargs='+', help='image files')
+    client_parser.add_argument('--url', type=str, default='http://127.0.0.1:8000', help='server url (default: http://127.0.0.1:8000)')
+    client_parser.add_argument('--concurrency', type=int, default=8, help='concurrent requests (default: 8)')
+    client_parser.add_argument('--repeat', type=int, default=1, help='send every image this many times (default: 1)')
+    args = parser.parse_args()
+
+    if args.command == 'server':
+        if args.num_threads:
+            torch.set_num_threads(args.num_threads)
+        model_server = ModelServer(args.members, args, args.max_batch, args.max_wait_ms, max_body_mb=args.max_body_mb)
+        try:
+            asyncio.run(serve(model_server, args.host, args.port))
+        except KeyboardInterrupt:
+            print(f"stopped, {model_server.metrics()}")
+    else:
+        run_client(args.url, args.images, args.concurrency, args.repeat)
@@ -0,0 +1,101 @@
+import argparse
+import math
+import os
+import sys
+
+from runner import (parse_grid, load_configs, config_to_args, shared_train_args, available_memory_gb, make_runs, shared_cache_env,
+                    run_all, read_run_result, write_summary, TRAIN_SCRIPT) # runner.py
+
+
+def score_of(run, metric, mode):
+    '''
+    run 의 metrics.json 에서 metric 값을 읽어 클수록 좋은 점수로 반환합니다.
+    성공 여부는 exit code 가 아니라 metrics.json 의 finished 와 metric 값으로 판단하며, 학습을 끝내지 못한 run 은 -inf
+    '''
+    metrics = read_run_result(run['save_dir'])['metrics']
+    value = metrics.get(metric)
+    if not metrics.get('finished') or value is None:
+        return -math.inf
+    return value if mode == 'max' else -value
+
+
+def successive_halving(runs, rungs, eta, metric, mode, shared_args, budget):
+    '''
+    Successive halving 스케줄러
+    모든 config 를 rungs[0] epoch 까지 학습하고, 점수 상위 1/eta 만 checkpoint.pth 에서 이어서 rungs[1] epoch 까지 학습하는 것을 반복합니다.
+    같은 rung 안의 run 들은 run_all 로 동시에 실행됩니다.
+    - runs   : {'name', 'config', 'log', 'save_dir'} dict 리스트
+    - rungs  : 누적 epoch 수 (예: [1, 3, 9])
+    - budget : run_all 에 넘길 (max_cores, cores_per_run, max_mem_gb, mem_per_run_gb, env)
+    '''
+    survivors = list(runs)
+    for rung, epochs in enumerate(rungs):
+        to_train = []
+        for run in survivors:
+            if read_run_result(run['save_dir'])['metrics'].get('early_stopped'):
+                continue # 이미 early stopping 으로 끝난 run 은 더 학습하지 않고 점수만 사용
+            if rung == 0:
+                cmd_args = config_to_args(run['config'])
+            else:
+                cmd_args = config_to_args(dict(run['config'], resume=run['save_dir']))
+            run['cmd'] = [sys.executable, TRAIN_SCRIPT] + shared_args + cmd_args + ['--epochs', str(epochs), '--save_checkpoint']
+            to_train.append(run)
+
+        print(f"[sweep] rung {rung}: training {len(to_train)} configs up to {epochs} epochs")
+        run_all(to_train, *budget)
+        for run in survivors:
+            run['rung'] = rung
+            run['score'] = score_of(run, metric, mode)
+
+        if rung == len(rungs) - 1:
+            break
+        survivors.sort(key=lambda run: run['score'], reverse=True)
+        keep = max(1, math.ceil(len(survivors) / eta))
+        for run in survivors[keep:]:
+            print(f"[sweep] stop {run['name']} at rung {rung} ({metric}={read_run_result(run['save_dir'])['metrics'].get(metric)})")
+        survivors = survivors[:keep]
+    return runs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='successive-halving hyperparameter sweep on top of train.py')
+    parser.add_argument('--grid', nargs='*', default=[], help='key=v1,v2 ... (cartesian product of train.py args)')
+    parser.add_argument('--configs', type=str, default=None, help='json file with a list of train.py arg dicts')
+    parser.add_argument('--rungs', nargs='+', type=int, default=[1, 3, 9], help='cumulative epochs at each rung (default: 1 3 9)')
+    parser.add_argument('--eta', type=float, default=3, help='keep the top 1/eta configs at every rung (default: 3)')
+    parser.add_argument('--metric', type=str, default='best_val_f1', help='metrics.json key used to rank configs (default: best_val_f1)')
+    parser.add_argument('--mode', type=str, default='max', choices=['max', 'min'], help='whether a larger metric is better (default: max)')
+    parser.add_argument('--sweep_dir', type=str, default='./sweep', help='model_dir for every run, logs and summary.csv (default: ./sweep)')
+    parser.add_argument('--data_dir', type=str, default=os.environ.get('SM_CHANNEL_TRAIN', '/opt/ml/input/data/train/images'))
+    parser.add_argument('--cache_dir', type=str, default=None, help='shared manifest / image cache dir (default: {sweep_dir}/cache)')
+    parser.add_argument('--no_image_cache', action='store_true', help='share only the manifest, decode images from disk in every run')
+    parser.add_argument('--max_cores', type=int, default=os.cpu_count(), help='total cores for all runs (default: all)')
+    parser.add_argument('--cores_per_run', type=int, default=8, help='cores pinned to each run (default: 8)')
+    parser.add_argument('--max_mem_gb', type=float, default=available_memory_gb() * 0.8, help='total memory budget (default: 80%% of MemAvailable)')
+    parser.add_argument('--mem_per_run_gb', type=float, default=8, help='memory reserved for each run (default: 8)')
+    parser.add_argument('train_args', nargs=argparse.REMAINDER, help='-- followed by train.py args shared by every run')
+    args = parser.parse_args()
+
+    configs = parse_grid(args.grid)
+    if args.configs:
+        configs += load_configs(args.configs)
+    if not configs:
+        parser.error('no configs given (use --grid and/or --configs)')
+    if args.mem_per_run_gb > args.max_mem_gb:
+        parser.error(f'--mem_per_run_gb {args.mem_per_run_gb:g} is larger than --max_mem_gb {args.max_mem_gb:.1f}, no run could ever start')
+    shared_args = shared_train_args(args.train_args)
+
+    os.makedirs(args.sweep_dir, exist_ok=True)
+    env = shared_cache_env(args.data_dir, args.cache_dir or os.path.join(args.sweep_dir, 'cache'), decode=not args.no_image_cache)
+
+    runs = make_runs(configs, args.sweep_dir, args.data_dir)
+    budget = (args.max_cores, args.cores_per_run, args.max_mem_gb, args.mem_per_run_gb, env)
+    successive_halving(runs, args.rungs, args.eta, args.metric, args.mode, shared_args, budget)
+
+    trained = sum(read_run_result(run['save_dir'])['metrics'].get('epoch', 0) for run in runs)
+    full = len(runs) * args.rungs[-1]
+    print(f"[sweep] trained {trained} epochs instead of {full} ({trained / full:.0%} of a full grid)")
+    keys = sorted({key for config in configs for key in config if key != 'name'}) + ['rung']
+    for run in runs:
+        run['config']['rung'] = run.get('rung')
+    write_summary(runs, keys, os.path.join(args.sweep_dir, 'summary.csv'))
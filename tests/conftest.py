@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 저장소의 module 들은 top-level 에 있으므로 (dataset.py, ensemble.py ...) 저장소 root 를 import 경로에 추가합니다.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
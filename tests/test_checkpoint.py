@@ -0,0 +1,65 @@
+import pytest
+import torch
+
+from checkpoint import load_checkpoint, load_safetensors, read_metadata, save_checkpoint, save_safetensors
+
+
+def _state_dict():
+    torch.manual_seed(0)
+    return {
+        'conv.weight': torch.randn(4, 3, 3, 3),
+        'fc.bias': torch.randn(5, dtype=torch.float64),
+        'bn.num_batches_tracked': torch.tensor(7),
+        'mask': torch.tensor([True, False, True]),
+        'codes': torch.arange(-3, 3, dtype=torch.int8),
+        'empty': torch.zeros(0, 2),
+        'half': torch.randn(3, dtype=torch.float16), # element 크기가 달라서 offset 정렬이 필요한 순서
+    }
+
+
+def test_round_trip_keeps_dtype_shape_and_values(tmp_path):
+    state_dict = _state_dict()
+    path = str(tmp_path / 'best.safetensors')
+    save_safetensors(state_dict, path, {'model': 'BaseModel', 'num_classes': 18})
+    loaded, metadata = load_safetensors(path)
+    assert metadata == {'model': 'BaseModel', 'num_classes': '18'}
+    assert read_metadata(path) == metadata
+    assert set(loaded) == set(state_dict)
+    for name, tensor in state_dict.items():
+        assert loaded[name].dtype == tensor.dtype
+        assert loaded[name].shape == tensor.shape
+        assert torch.equal(loaded[name], tensor)
+
+
+@pytest.mark.parametrize('dtype', [torch.float16, torch.bfloat16])
+def test_reduced_precision_checkpoint(tmp_path, dtype):
+    state_dict = _state_dict()
+    path = str(tmp_path / 'best.safetensors')
+    save_checkpoint(state_dict, path, 'BaseModel', 18, dtype)
+    stored, metadata = load_checkpoint(path)
+    assert metadata['dtype'] == str(dtype).replace('torch.', '')
+    assert stored['conv.weight'].dtype == dtype
+    assert stored['bn.num_batches_tracked'].dtype == torch.int64 # int buffer 는 변환하지 않음
+    assert torch.equal(stored['conv.weight'], state_dict['conv.weight'].to(dtype))
+
+    restored, _ = load_checkpoint(path, dtype=torch.float32)
+    assert restored['conv.weight'].dtype == torch.float32
+    assert torch.equal(restored['conv.weight'], state_dict['conv.weight'].to(dtype).float())
+
+
+def test_loaded_tensors_do_not_write_back_to_file(tmp_path):
+    path = str(tmp_path / 'best.safetensors')
+    save_safetensors({'w': torch.ones(4)}, path)
+    loaded, _ = load_safetensors(path)
+    loaded['w'].mul_(3)
+    assert torch.equal(load_safetensors(path)[0]['w'], torch.ones(4))
+
+
+def test_readable_by_safetensors_package(tmp_path):
+    load_file = pytest.importorskip('safetensors.torch').load_file
+    state_dict = _state_dict()
+    path = str(tmp_path / 'best.safetensors')
+    save_checkpoint(state_dict, path, 'BaseModel', 18, torch.bfloat16)
+    loaded = load_file(path)
+    for name, tensor in load_safetensors(path)[0].items():
+        assert torch.equal(loaded[name], tensor)
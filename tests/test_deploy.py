@@ -0,0 +1,66 @@
+import copy
+
+import pytest
+import torch
+import torch.nn as nn
+
+from deploy import DeployModel, fold_normalization
+
+MEAN = (0.548, 0.504, 0.479)
+STD = (0.237, 0.247, 0.246)
+RESIZE = (24, 16)
+
+
+class TinyNet(nn.Module):
+    def __init__(self, padding, bias=True, flip_input=False):
+        super().__init__()
+        self.flip_input = flip_input
+        self.conv = nn.Conv2d(3, 8, 3, padding=padding, bias=bias)
+        self.bn = nn.BatchNorm2d(8)
+        self.fc = nn.Linear(8, 5)
+
+    def forward(self, x):
+        if self.flip_input: # 첫 conv 앞에 다른 연산이 있는 모델
+            x = x.flip(-1)
+        x = torch.relu(self.bn(self.conv(x)))
+        return self.fc(x.mean(dim=(2, 3)))
+
+
+def _reference(model):
+    # TestDataset 과 같은 (x / 255 - mean) / std 를 입력에 적용하는 folding 전 모델
+    mean = torch.tensor(MEAN).view(1, 3, 1, 1)
+    std = torch.tensor(STD).view(1, 3, 1, 1)
+    return DeployModel(copy.deepcopy(model), RESIZE, None, 1 / (255 * std), mean * 255).eval()
+
+
+@pytest.mark.parametrize('padding, bias, flip_input, expected_folding', [
+    (0, True, False, 'full'),   # padding 이 없으면 weight / bias 에 전부 합침
+    (0, False, False, 'full'),  # bias 가 없는 conv 는 bias 를 새로 만듦
+    (1, True, False, 'scale'),  # zero padding 이 있으면 mean 빼기는 입력에 남김
+    (0, True, True, 'none'),    # 첫 conv 의 입력이 모델 입력이 아니면 합치지 않음
+])
+def test_folded_logits_match_unfolded(padding, bias, flip_input, expected_folding):
+    torch.manual_seed(0)
+    model = TinyNet(padding, bias, flip_input).eval()
+    with torch.no_grad():
+        model.bn.running_mean.uniform_(-1, 1)
+        model.bn.running_var.uniform_(0.5, 2)
+    reference = _reference(model)
+
+    folding, scale, shift = fold_normalization(model, MEAN, STD, RESIZE)
+    assert folding == expected_folding
+    folded = DeployModel(model, RESIZE, None, scale, shift).eval()
+
+    images = torch.randint(0, 256, (4, *RESIZE, 3), dtype=torch.uint8)
+    images[0] = 0 # 가장자리 padding 과의 차이가 드러나는 어두운 / 밝은 이미지
+    images[1] = 255
+    with torch.no_grad():
+        expected, actual = reference(images), folded(images)
+    torch.testing.assert_close(actual, expected, rtol=1e-4, atol=1e-4)
+
+
+def test_full_folding_leaves_no_input_transform():
+    model = TinyNet(padding=0).eval()
+    _, scale, shift = fold_normalization(model, MEAN, STD, RESIZE)
+    assert torch.equal(scale, torch.ones(1, 3, 1, 1))
+    assert torch.equal(shift, torch.zeros(1, 3, 1, 1))
@@ -0,0 +1,36 @@
+import numpy as np
+
+from ensemble import TASK_LABELS, combine_predictions, decode_multi_class, encode_multi_class
+
+
+def _all_labels():
+    mask, gender, age = np.meshgrid(np.arange(3), np.arange(2), np.arange(3), indexing='ij')
+    return mask.ravel(), gender.ravel(), age.ravel()
+
+
+def test_multi_class_round_trip():
+    mask, gender, age = _all_labels()
+    codes = encode_multi_class(mask, gender, age)
+    assert sorted(codes.tolist()) == list(range(18))
+    decoded = decode_multi_class(codes)
+    for expected, actual in zip((mask, gender, age), decoded):
+        np.testing.assert_array_equal(actual, expected)
+
+
+def test_mask_gender_matches_dataset_encoding():
+    # mask+gender dataset (두 번째 MaskBaseDataset.encode_multi_class) 의 label = mask * 6 + gender * 3
+    mask, gender, age = _all_labels()
+    labels = TASK_LABELS['MaskGender'](mask * 6 + gender * 3)
+    np.testing.assert_array_equal(labels['mask'], mask)
+    np.testing.assert_array_equal(labels['gender'], gender)
+    # MaskGender + Age 를 합친 결과는 baseline combine_inference_2 (두 code 를 더함) 와 같음
+    combined = combine_predictions({'MaskGender': mask * 6 + gender * 3, 'Age': age})
+    np.testing.assert_array_equal(combined, mask * 6 + gender * 3 + age)
+
+
+def test_task_models_override_maskbase():
+    mask, gender, age = _all_labels()
+    base = encode_multi_class(mask, gender, age)
+    flipped = 1 - gender
+    combined = combine_predictions({'MaskBase': base, 'Gender': flipped})
+    np.testing.assert_array_equal(combined, encode_multi_class(mask, flipped, age))
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from ensemble_search import greedy_selection, score_weights, weighted_f1
+
+
+def _one_hot(preds, num_classes):
+    return np.eye(num_classes)[preds]
+
+
+@pytest.mark.parametrize('num_classes', [2, 3, 18])
+def test_weighted_f1_matches_sklearn(num_classes):
+    f1_score = pytest.importorskip('sklearn.metrics').f1_score
+    rng = np.random.RandomState(num_classes)
+    labels = rng.randint(0, num_classes, size=200)
+    preds = np.where(rng.rand(4, 200) < 0.6, labels[None, :], rng.randint(0, num_classes, size=(4, 200)))
+    preds[3] = 0 # 한 class 만 예측 (나머지 class 의 precision 이 0 / 0)
+    expected = [f1_score(labels, p, average='weighted', zero_division=0) for p in preds]
+    np.testing.assert_allclose(weighted_f1(preds, labels, num_classes), expected, rtol=1e-12)
+
+
+def test_weighted_f1_ignores_classes_missing_from_labels():
+    f1_score = pytest.importorskip('sklearn.metrics').f1_score
+    labels = np.array([0, 0, 1, 1, 1])
+    preds = np.array([[0, 2, 1, 1, 2]]) # class 2 는 label 에 없음 (support 0)
+    expected = f1_score(labels, preds[0], average='weighted', zero_division=0)
+    np.testing.assert_allclose(weighted_f1(preds, labels, 3), [expected])
+
+
+def test_score_weights_single_model_equals_its_f1():
+    rng = np.random.RandomState(0)
+    labels = rng.randint(0, 3, size=50)
+    probs = rng.dirichlet(np.ones(3), size=(2, 50))
+    scores = score_weights(np.eye(2), probs, labels)
+    np.testing.assert_allclose(scores, weighted_f1(probs.argmax(axis=-1), labels, 3))
+
+
+def test_greedy_selection_picks_the_accurate_model():
+    rng = np.random.RandomState(1)
+    labels = rng.randint(0, 3, size=100)
+    noisy = rng.dirichlet(np.ones(3), size=(2, 100))
+    probs = np.concatenate([_one_hot(labels, 3)[None] * 0.9 + 0.05, noisy])
+    counts, best_f1, history = greedy_selection(probs, labels, max_steps=10, patience=2)
+    assert history[0][0] == 0
+    assert best_f1 == pytest.approx(1.0)
+    # 반환되는 weight 는 처음으로 최고 F1 을 낸 step 까지의 선택 횟수
+    best_step = int(np.argmax([f1 for _, f1 in history]))
+    assert counts[0] >= 1 and counts.sum() == best_step + 1
@@ -0,0 +1,9 @@
+from ensemble import TASK_LABELS
+from inference import INFERENCE_TASKS, task_num_classes
+
+
+def test_every_task_has_a_dataset():
+    # --model_type / --members 로 받는 모든 model_type 의 dataset class 가 dataset.py 에 있어야 함
+    for model_type in INFERENCE_TASKS:
+        assert task_num_classes(model_type) > 0
+        assert model_type in TASK_LABELS
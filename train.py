@@ -8,27 +8,24 @@ import re
 from importlib import import_module
 from pathlib import Path
 
-import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
 import torch
 from torch.optim.lr_scheduler import StepLR
 from torch.utils.data import DataLoader
-from torch.utils.tensorboard import SummaryWriter
-from torchvision import transforms
-from torchvision.transforms import *
 from PIL import Image
-import seaborn as sns
 import time
 import datetime
 
-from dataset import MaskBaseDataset, MaskDataset, GenderDataset, AgeDataset, MaskGenderDataset # dataset.py
-from dataset import TestDataset
+from dataset import MaskBaseDataset, MaskDataset, GenderDataset, AgeDataset # dataset.py
+from dataset import TestDataset, MANIFEST_ENV, IMAGE_CACHE_ENV
 from loss import create_criterion # loss.py
+from model import create_model # model.py
+from checkpoint import save_checkpoint, CKPT_DTYPES, CKPT_EXTENSIONS # checkpoint.py
+from ensemble import save_val_logits # ensemble.py
 from f1score import get_F1_Score # f1score.py
-from submission import submission # submission.py
-from inference import inference, mask_inference, gender_inference, age_inference, maskgender_inference # inference.py
-import wandb
+from validation import ValidationPolicy, AsyncValidator # validation.py
+from profiling import StepTimer, ProfileWindow, TimedCompose, parse_step_window, instrument_transform # profiling.py
+# torchvision, matplotlib, tensorboard, wandb, submission.py 는 import 가 느려서 사용하는 함수 안에서 import 합니다. (python importtime.py 로 확인)
 
 
 def seed_everything(seed):
@@ -65,6 +62,8 @@ def grid_image(np_images, gts, preds, n=16, shuffle=False):
     시각화된 이미지와 함께 각 이미지의 ground truth와 예측값이 제목에 표시됩니다.
     반환된 figure 객체를 이용하여 이미지를 출력할 수 있습니다.
     '''
+    import matplotlib.pyplot as plt
+
     batch_size = np_images.shape[0]
     assert n <= batch_size
 
@@ -114,6 +113,13 @@ def increment_path(path, exist_ok=False):
         n = max(i) + 1 if i else 2
         return f"{path}{n}"
 
+def save_metrics(save_dir, metrics):
+    '''
+    runner.py 등에서 run 결과를 모을 수 있도록 현재까지의 validation 결과를 metrics.json 으로 저장합니다.
+    '''
+    with open(os.path.join(save_dir, 'metrics.json'), 'w', encoding='utf-8') as f:
+        json.dump(metrics, f, ensure_ascii=False, indent=4)
+
 def wandb_config(args):
     config_dict  = {'seed'         : args.seed,
                     'epochs'       : args.epochs,
@@ -154,12 +160,23 @@ def train(data_dir, model_dir, args):
     '''
     seed_everything(args.seed)
 
-    save_dir = increment_path(os.path.join(model_dir, args.name))
+    if args.resume:
+        save_dir = args.resume # 이어서 학습할 때는 기존 run 폴더를 그대로 사용
+    elif args.save_dir:
+        save_dir = args.save_dir # runner.py / sweep.py 가 지정한 run 폴더 (increment_path 를 거치지 않음)
+    else:
+        save_dir = increment_path(os.path.join(model_dir, args.name))
 
     # -- settings
     use_cuda = torch.cuda.is_available()
     device = torch.device("cuda" if use_cuda else "cpu")
 
+    # -- shared manifest / image cache (runner.py)
+    if args.manifest:
+        os.environ[MANIFEST_ENV] = args.manifest
+    if args.image_cache:
+        os.environ[IMAGE_CACHE_ENV] = args.image_cache
+
     # -- dataset
     dataset_module = getattr(import_module("dataset"), args.dataset)  # default: MaskPreprocessDataset
     dataset = dataset_module(
@@ -177,6 +194,8 @@ def train(data_dir, model_dir, args):
         std=dataset.std,
     )
     dataset.set_transform(transform)
+    # transform 별 호출 수 / 시간을 DataLoader worker 안에서 기록 (epoch 끝에 main process 에서 합산)
+    transform_timer = instrument_transform(transform, num_workers=4) if args.time_transforms else None
 
     # -- data_loader
     train_set, val_set = dataset.split_dataset()
@@ -190,19 +209,19 @@ def train(data_dir, model_dir, args):
         drop_last=True,
     )
 
-    val_loader = DataLoader(
-        val_set,
+    # val_loader 는 ValidationPolicy 가 생성 (subset / full)
+    val_policy_kwargs = dict(
+        val_set=val_set,
         batch_size=args.valid_batch_size,
+        subset_ratio=args.val_subset_ratio,
+        full_every=args.full_val_every,
+        seed=args.seed,
         num_workers=4,
 #         num_workers=multiprocessing.cpu_count() // 2,
-        shuffle=False,
-#         pin_memory=use_cuda,
-        drop_last=True,
     )
 
     # -- model
-    model_module = getattr(import_module("model"), args.model)  # default: BaseModel
-    model = model_module(num_classes=num_classes).to(device)
+    model = create_model(args.model, num_classes=num_classes).to(device)  # default: BaseModel
     model = torch.nn.DataParallel(model)
     
 #     # -- freeze
@@ -223,45 +242,96 @@ def train(data_dir, model_dir, args):
     scheduler = StepLR(optimizer, args.lr_decay_step, gamma=0.5)
     
     
+    import wandb
+    from torch.utils.tensorboard import SummaryWriter
+
     logger = SummaryWriter(log_dir=save_dir)
     with open(os.path.join(save_dir, 'config.json'), 'w', encoding='utf-8') as f:
         json.dump(vars(args), f, ensure_ascii=False, indent=4)
 
+    # best / last 저장 형식 (.pth 또는 mmap 으로 읽는 .safetensors, fp16/bf16 저장 가능)
+    ckpt_ext = CKPT_EXTENSIONS[args.ckpt_format]
+    ckpt_dtype = CKPT_DTYPES[args.ckpt_dtype] if args.ckpt_dtype != 'float32' else None
+
     ## ---- starting train ----
     best_val_acc = 0
     best_val_loss = np.inf
+    best_val_f1 = 0
+    metrics = {}
     
     # early stop init
     patience_limits = args.patience_limit
     best_loss = 10 ** 9 # 매우 큰 값으로 초기값 가정
     patience_limit = patience_limits # 몇 번의 epoch까지 지켜볼지를 결정
     patience_check = 0 # 현재 몇 epoch 연속으로 loss 개선이 안되는지를 기록
+
+    # resume : checkpoint.pth 에서 model / optimizer / scheduler 와 best 기록을 복원
+    start_epoch = 0
+    if args.resume:
+        checkpoint = torch.load(os.path.join(save_dir, 'checkpoint.pth'), map_location=device)
+        model.module.load_state_dict(checkpoint['model'])
+        optimizer.load_state_dict(checkpoint['optimizer'])
+        scheduler.load_state_dict(checkpoint['scheduler'])
+        start_epoch = checkpoint['epoch']
+        best_val_acc, best_val_loss, best_val_f1 = checkpoint['best_val_acc'], checkpoint['best_val_loss'], checkpoint['best_val_f1']
+        best_loss, patience_check = checkpoint['best_loss'], checkpoint['patience_check']
+        if os.path.exists(os.path.join(save_dir, 'metrics.json')):
+            with open(os.path.join(save_dir, 'metrics.json'), encoding='utf-8') as f:
+                metrics = json.load(f)
+            # 이번 실행이 끝나기 전에 실패하면 이전 실행의 finished 가 남지 않도록
+            save_metrics(save_dir, dict(metrics, finished=False))
+        print(f"Resuming {save_dir} from epoch {start_epoch}")
     
+    # -- validation policy (sync) / async validation
+    validator = None
+    val_policy = None
+    if args.async_val:
+        validator = AsyncValidator(
+            args.model, num_classes, args.criterion, val_policy_kwargs,
+            lag=args.val_lag, num_threads=args.val_num_threads,
+        )
+    else:
+        val_policy = ValidationPolicy(**val_policy_kwargs)
+
     # time
     start_time = time.time()
-    for epoch in range(args.epochs):
+    step_timer = StepTimer(sync_cuda=args.sync_timers)
+    profile_window = ProfileWindow(parse_step_window(args.profile_steps), save_dir) if args.profile_steps else None
+    epoch_start_times = {}
+    stop = False
+    for epoch in range(start_epoch, args.epochs):
         midel_time = time.time()
+        epoch_start_times[epoch] = midel_time
         # train loop
         model.train()
         loss_value = 0
         matches = 0
-        valid_f1_score = get_F1_Score()
         train_f1_score = get_F1_Score()
+        if transform_timer is not None:
+            transform_timer.summary() # 이전 epoch validation 에서 쌓인 기록은 버림
         
+        step_timer.start()
         for idx, (inputs,labels) in enumerate(train_loader):
-            inputs, labels = inputs.cuda(),labels.cuda()
+            step_timer.lap('data')
+            inputs, labels = inputs.to(device),labels.to(device)
+            step_timer.lap('h2d')
 
             optimizer.zero_grad()
+            step_timer.lap('optimizer')
 
             outs = model(inputs) # batch_size, label
             preds = torch.argmax(outs, dim=-1)
             if args.criterion == 'f1' or args.criterion == 'label_smoothing':
                 criterion.classes = num_classes
+            step_timer.lap('forward')
 
             loss = criterion(outs, labels)
+            step_timer.lap('loss')
 
             loss.backward()
+            step_timer.lap('backward')
             optimizer.step()
+            step_timer.lap('optimizer')
 
             loss_value += loss.item()
             
@@ -271,76 +341,134 @@ def train(data_dir, model_dir, args):
                 train_acc = matches / args.batch_size / args.log_interval
                 train_f1_score.update(preds, labels)
                 current_lr = get_lr(optimizer)
+                step_times = step_timer.summary()
                 print(
                     f"Epoch[{epoch+1}/{args.epochs}]({idx + 1}/{len(train_loader)}) || "
                     f"training loss {train_loss:4.4} || training accuracy {train_acc:4.2%} || train_f1_score {train_f1_score.get_score :4.2} || lr {current_lr}"
                 )
-                wandb.log({"train acc": train_acc, "train loss": train_loss, 'train_f1_score' : train_f1_score.get_score}, step = epoch)
+                print(f"    step time : {StepTimer.format(step_times)}")
+                global_step = epoch * len(train_loader) + idx
+                for stage, ms in step_times.items():
+                    logger.add_scalar(f"Time/{stage}_ms", ms, global_step)
+                wandb.log({"train acc": train_acc, "train loss": train_loss, 'train_f1_score' : train_f1_score.get_score,
+                           **{f"time/{stage}_ms": ms for stage, ms in step_times.items()}}, step = epoch)
                 loss_value = 0
                 matches = 0
+            step_timer.lap('logging')
+            if profile_window is not None:
+                profile_window.step()
 
 #         scheduler.step()
 
+        if transform_timer is not None:
+            transform_times = transform_timer.summary()
+            print(f"[epoch {epoch}] transform time (train workers)\n{TimedCompose.format(transform_times)}")
+            for name, calls, seconds, avg_ms in transform_times:
+                logger.add_scalar(f"Transform/{name}_ms", avg_ms, epoch)
+                logger.add_scalar(f"Transform/{name}_total_s", seconds, epoch)
+
         # val loop
-        with torch.no_grad():
+        if validator is not None:
+            # 현재 epoch 의 weight 를 worker 로 보내고, 도착한 결과만 처리 (최대 val_lag epoch 지연)
+            validator.submit(epoch, model.module, last_epoch=epoch == args.epochs - 1)
+            ready = validator.collect(wait_all=epoch == args.epochs - 1)
+        else:
             print("Calculating validation results...")
-            model.eval()
-            val_loss_items = []
-            val_acc_items = []
+            ready = [(epoch, val_policy(model, criterion, device, epoch, last_epoch=epoch == args.epochs - 1), None)]
+
+        for val_epoch, result, state_dict in ready:
+            if state_dict is None:
+                state_dict = model.module.state_dict()
+            val_loss = result['loss']
+            val_acc = result['acc']
+            if result['full']:
+                best_val_loss = min(best_val_loss, val_loss)
             figure = None
             
-            for inputs,labels in val_loader:
-                inputs, labels = inputs.cuda(),labels.cuda()
-
-                outs = model(inputs)
-                preds = torch.argmax(outs, dim=-1)
-
-                loss_item = criterion(outs, labels).item()
-                acc_item = (labels == preds).sum().item()
-                val_loss_items.append(loss_item)
-                val_acc_items.append(acc_item)                
-                valid_f1_score.update(preds, labels)
-                
-            val_loss = np.sum(val_loss_items) / len(val_loader)
-            val_acc = np.sum(val_acc_items) / len(val_set)
-            best_val_loss = min(best_val_loss, val_loss)
-            
-            ## 최고 val acc 모델 갱신
-            if val_acc > best_val_acc:
+            ## 최고 val acc 모델 갱신 (subset 평가 결과로는 갱신하지 않음)
+            if result['full'] and val_acc > best_val_acc:
                 print(f"New best model for val accuracy : {val_acc:4.2%}! saving the best model..")
-                torch.save(model.module.state_dict(), f"{save_dir}/best.pth")
+                save_checkpoint(state_dict, f"{save_dir}/best{ckpt_ext}", args.model, num_classes, ckpt_dtype)
+                save_val_logits(save_dir, result['logits'], result['labels'], result['indices'],
+                                dict(model=args.model, dataset=args.dataset, epoch=val_epoch, seed=args.seed, val_ratio=args.val_ratio))
                 best_val_acc = val_acc
-            torch.save(model.module.state_dict(), f"{save_dir}/last.pth")
+                best_val_f1 = result['f1']
+            save_checkpoint(state_dict, f"{save_dir}/last{ckpt_ext}", args.model, num_classes, ckpt_dtype)
             
             # time
-            sec = time.time()-midel_time # 종료 - 시작 (걸린 시간)
+            sec = time.time()-epoch_start_times.pop(val_epoch) # 종료 - 시작 (걸린 시간)
             times = str(datetime.timedelta(seconds=sec)) # 걸린시간 보기좋게 바꾸기
             short = times.split(".")[0] # 초 단위 까지만
+            acc_low, acc_high = result['acc_ci']
+            loss_low, loss_high = result['loss_ci']
             print(
-                f"[Val] acc : {val_acc:4.2%}, loss: {val_loss:4.2} || "
+                f"[Val{'' if result['full'] else ' subset'}] epoch {val_epoch+1} ({result['n']} images) || "
+                f"acc : {val_acc:4.2%} [{acc_low:4.2%}, {acc_high:4.2%}], loss: {val_loss:4.2} [{loss_low:4.2}, {loss_high:4.2}] || "
                 f"best acc : {best_val_acc:4.2%}, best loss: {best_val_loss:4.2} || "
-                f"f1 score : {valid_f1_score.get_score :4.2} || epoch time {short}"
+                f"f1 score : {result['f1'] :4.2} || epoch time {short}"
             )
-            logger.add_scalar("Val/loss", val_loss, epoch)
-            logger.add_scalar("Val/accuracy", val_acc, epoch)
-            logger.add_figure("results", figure, epoch)
+            logger.add_scalar("Val/loss", val_loss, val_epoch)
+            logger.add_scalar("Val/accuracy", val_acc, val_epoch)
+            logger.add_scalar("Val/accuracy_ci_low", acc_low, val_epoch)
+            logger.add_scalar("Val/loss_ci_low", loss_low, val_epoch)
+            logger.add_figure("results", figure, val_epoch)
+            metrics = {
+                'epoch': val_epoch + 1,
+                'val_acc': val_acc,
+                'val_loss': val_loss,
+                'val_f1': result['f1'],
+                'best_val_acc': best_val_acc,
+                'best_val_loss': best_val_loss,
+                'best_val_f1': best_val_f1,
+                'elapsed': time.time() - start_time,
+            }
+            save_metrics(save_dir, metrics)
             
             # early stop
-            if val_loss > best_loss: # loss가 개선되지 않은 경우
+            # best_loss / patience 는 full validation 결과로만 갱신 (subset 결과가 좋으면 ValidationPolicy 가 full 로 다시 평가)
+            # 조기 종료는 ready 의 결과를 모두 처리한 뒤에 (이미 도착한 이후 epoch 결과가 best 일 수 있음)
+            if not result['full'] or stop:
+                pass # subset 결과만으로는 판단하지 않고 다음 full validation 을 기다림 (조기 종료가 정해진 뒤에는 patience 유지)
+            elif val_loss > best_loss: # loss가 개선되지 않은 경우
                 patience_check += 1
                 if patience_check >= patience_limit: # early stopping 조건 만족 시 조기 종료
                     print("Early stopping")
-                    break
+                    stop = True
                     
             else: # loss가 개선된 경우 계속 진행
                 best_loss = val_loss
                 patience_check = 0
-                best_cm=valid_f1_score.get_cm
+                best_cm = result['cm']
             print('early stopping patience', patience_check)
             print()
+
+        if args.save_checkpoint:
+            torch.save({
+                'epoch': epoch + 1,
+                'model': model.module.state_dict(),
+                'optimizer': optimizer.state_dict(),
+                'scheduler': scheduler.state_dict(),
+                'best_val_acc': best_val_acc,
+                'best_val_loss': best_val_loss,
+                'best_val_f1': best_val_f1,
+                'best_loss': best_loss,
+                'patience_check': patience_check,
+            }, os.path.join(save_dir, 'checkpoint.pth'))
+
+        if stop:
+            break
+
+    if validator is not None:
+        validator.close()
+    if profile_window is not None:
+        profile_window.stop()
+    metrics.update(early_stopped=stop, finished=True)
+    save_metrics(save_dir, metrics)
     
     # ---- making submission ----
-    submission(model, save_dir=save_dir)
+    if args.submit: # runner.py / sweep.py 로 실행한 run 은 submission 을 만들지 않음
+        from submission import submission # submission.py
+        submission(model, save_dir=save_dir)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -361,6 +489,7 @@ if __name__ == '__main__':
     parser.add_argument('--lr_decay_step', type=int, default=20, help='learning rate scheduler deacy step (default: 20)')
     parser.add_argument('--log_interval', type=int, default=20, help='how many batches to wait before logging training status')
     parser.add_argument('--name', default='exp', help='model save at {SM_MODEL_DIR}/{name}')
+    parser.add_argument('--save_dir', type=str, default=None, help='exact run dir to save into (default: {model_dir}/{name} with an increasing suffix)')
 
     # Container environment
     parser.add_argument('--data_dir', type=str, default=os.environ.get('SM_CHANNEL_TRAIN', '/opt/ml/input/data/train/images'))
@@ -370,6 +499,21 @@ if __name__ == '__main__':
     parser.add_argument('--inference_make', type=bool, default=True, help='inference make info (default : False)')
     parser.add_argument('--outlier_remove', type=bool, default=False, help='remove outlier (default : False)')
     parser.add_argument('--model_type', type=str, default='MaskBase', help = 'Mask or Gender or Age or MaskBase')
+    parser.add_argument('--manifest', type=str, default=os.environ.get('PSTAGE_MANIFEST'), help='shared dataset manifest json built by runner.py (default: scan data_dir)')
+    parser.add_argument('--image_cache', type=str, default=os.environ.get('PSTAGE_IMAGE_CACHE'), help='shared decoded image cache dir built by runner.py (default: decode from disk)')
+    parser.add_argument('--ckpt_format', type=str, default='pth', choices=['pth', 'safetensors'], help='best/last model file format, safetensors is memory-mapped on load (default: pth)')
+    parser.add_argument('--ckpt_dtype', type=str, default='float32', choices=['float32', 'float16', 'bfloat16'], help='floating point dtype of saved best/last weights (default: float32)')
+    parser.add_argument('--save_checkpoint', action='store_true', help='save checkpoint.pth (model, optimizer, scheduler, best stats) every epoch for --resume')
+    parser.add_argument('--resume', type=str, default=None, help='run dir with checkpoint.pth to continue training up to --epochs')
+    parser.add_argument('--profile_steps', '--profile-steps', type=str, default=None, help='START:END global train steps to record with torch.profiler into {save_dir}/profile')
+    parser.add_argument('--time_transforms', action='store_true', help='record per-transform call counts and time of the augmentation inside loader workers (default: False)')
+    parser.add_argument('--sync_timers', action='store_true', help='cuda synchronize at every step-timer lap for exact per-stage GPU times (default: False)')
+    parser.add_argument('--async_val', action='store_true', help='run validation in a background worker process on snapshotted weights (default: False)')
+    parser.add_argument('--val_lag', type=int, default=1, help='how many epochs async validation may lag behind training (default: 1)')
+    parser.add_argument('--val_num_threads', type=int, default=2, help='torch threads for the async validation worker (default: 2)')
+    parser.add_argument('--val_subset_ratio', type=float, default=1.0, help='fraction of the validation set (label-stratified) evaluated each epoch (default: 1.0, full)')
+    parser.add_argument('--full_val_every', type=int, default=5, help='evaluate the full validation set every N epochs when --val_subset_ratio < 1 (default: 5)')
+    parser.add_argument('--submit', action='store_true', help='make {save_dir}/submission.csv on the eval set after training (default: False)')
     args = parser.parse_args()
     print(args)
 
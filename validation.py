@@ -0,0 +1,241 @@
+import math
+import queue
+import time
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+from torch.utils.data import DataLoader, Subset
+
+from loss import create_criterion # loss.py
+from f1score import get_F1_Score # f1score.py
+from model import create_model_from_state_dict # model.py
+
+
+@torch.no_grad()
+def validate(model, loader, criterion, device):
+    '''
+    val_loader 전체에 대해 forward 를 수행하고 validation 결과를 dict 로 반환하는 함수
+    train() 의 동기 validation 과 AsyncValidator 의 worker process 가 같은 코드를 사용합니다.
+    - 반환값
+    loss : batch 평균 loss
+    acc  : 맞춘 샘플 수 / 평가한 샘플 수
+    f1   : weighted f1 score
+    cm   : confusion matrix
+    logits, labels : 평가한 순서대로의 logits (n, num_classes) / label (n,) numpy array (ensemble weight 탐색용)
+    loss_ci, acc_ci : 95% 신뢰구간 (loss 는 batch loss 의 표준오차, acc 는 Wilson interval)
+    '''
+    model.eval()
+    f1_score = get_F1_Score()
+    loss_items = []
+    correct = 0
+    seen = 0
+    all_logits, all_labels = [], []
+    for inputs, labels in loader:
+        inputs, labels = inputs.to(device), labels.to(device)
+
+        outs = model(inputs)
+        preds = torch.argmax(outs, dim=-1)
+
+        loss_items.append(criterion(outs, labels).item())
+        correct += (labels == preds).sum().item()
+        seen += labels.size(0)
+        f1_score.update(preds, labels)
+        all_logits.append(outs.float().cpu())
+        all_labels.append(labels.cpu())
+
+    loss = float(np.mean(loss_items)) if loss_items else float('nan')
+    loss_se = float(np.std(loss_items, ddof=1) / math.sqrt(len(loss_items))) if len(loss_items) > 1 else 0.0
+    return {
+        'loss': loss,
+        'acc': correct / max(seen, 1),
+        'f1': f1_score.get_score,
+        'cm': f1_score.get_cm,
+        'n': seen,
+        'loss_ci': (loss - 1.96 * loss_se, loss + 1.96 * loss_se),
+        'acc_ci': wilson_interval(correct, seen),
+        'logits': torch.cat(all_logits).numpy() if all_logits else np.zeros((0, 0), dtype=np.float32),
+        'labels': torch.cat(all_labels).numpy() if all_labels else np.zeros(0, dtype=np.int64),
+    }
+
+
+def wilson_interval(correct, n, z=1.96):
+    '''
+    정확도에 대한 Wilson score 신뢰구간 (기본 95%)
+    '''
+    if n == 0:
+        return (0.0, 1.0)
+    p = correct / n
+    denom = 1 + z ** 2 / n
+    center = (p + z ** 2 / (2 * n)) / denom
+    half = z * math.sqrt(p * (1 - p) / n + z ** 2 / (4 * n ** 2)) / denom
+    return (center - half, center + half)
+
+
+def stratified_subset(subset, ratio, seed):
+    '''
+    validation Subset 에서 label 비율을 유지하며 고정된 일부만 뽑은 Subset 을 반환합니다.
+    label 은 dataset.get_target 으로 읽으므로 이미지를 decode 하지 않습니다.
+    '''
+    dataset, indices = subset.dataset, subset.indices
+    targets = np.array([dataset.get_target(i) for i in indices])
+    rng = np.random.RandomState(seed)
+
+    chosen = []
+    for label in np.unique(targets):
+        label_idx = np.flatnonzero(targets == label)
+        k = max(1, int(round(len(label_idx) * ratio)))
+        chosen.extend(rng.choice(label_idx, k, replace=False).tolist())
+    chosen.sort()
+    return Subset(dataset, [indices[i] for i in chosen])
+
+
+class ValidationPolicy:
+    '''
+    매 epoch 고정된 label-stratified subset 으로 빠르게 평가하고,
+    full_every epoch 마다(그리고 마지막 epoch 에) 전체 validation set 을 평가하는 정책
+    subset 결과가 지금까지의 best acc 를 넘거나 best loss 보다 낮으면 best.pth 저장 / early stopping 판단 전에 전체 set 으로 다시 평가합니다.
+    subset_ratio 가 1 이상이면 항상 전체 set 을 평가합니다 (기존 동작).
+    반환된 result['full'] 로 전체 평가 여부를 알 수 있습니다.
+    '''
+    def __init__(self, val_set, batch_size, subset_ratio=1.0, full_every=1, seed=0, num_workers=4):
+        self.full_every = max(full_every, 1)
+        self.best_acc = 0
+        self.best_loss = math.inf
+
+        self.full_loader = DataLoader(
+            val_set,
+            batch_size=batch_size,
+            num_workers=num_workers,
+            shuffle=False,
+            drop_last=True,
+        )
+        self.fast_loader = None
+        if subset_ratio < 1:
+            fast_set = stratified_subset(val_set, subset_ratio, seed)
+            print(f"fast validation on {len(fast_set)}/{len(val_set)} images, full validation every {self.full_every} epochs")
+            self.fast_loader = DataLoader(
+                fast_set,
+                batch_size=batch_size,
+                num_workers=num_workers,
+                shuffle=False,
+                drop_last=False,
+            )
+
+    def __call__(self, model, criterion, device, epoch, last_epoch=False):
+        full = self.fast_loader is None or (epoch + 1) % self.full_every == 0 or last_epoch
+        result = validate(model, self.full_loader if full else self.fast_loader, criterion, device)
+        if not full and (result['acc'] > self.best_acc or result['loss'] < self.best_loss):
+            # best.pth 와 early stopping 의 best loss 는 항상 전체 validation 결과로만 갱신
+            full = True
+            result = validate(model, self.full_loader, criterion, device)
+        if full:
+            self.best_acc = max(self.best_acc, result['acc'])
+            self.best_loss = min(self.best_loss, result['loss'])
+            # logits 의 각 row 가 dataset 의 몇 번째 샘플인지 (drop_last 로 잘린 뒤의 순서)
+            result['indices'] = np.asarray(getattr(self.full_loader.dataset, 'indices', range(result['n']))[:result['n']])
+        result['full'] = full
+        return result
+
+
+def _validation_worker(tasks, results, model_name, num_classes, criterion_name, policy_kwargs, num_threads):
+    '''
+    별도 process 에서 실행되는 validation worker
+    tasks 에서 (epoch, state_dict, last_epoch) 를 받아 ValidationPolicy 로 평가하고 (epoch, result) 를 results 로 돌려줍니다.
+    None 을 받으면 종료합니다.
+    '''
+    torch.set_num_threads(num_threads)
+    device = torch.device("cpu")
+
+    model = None # 첫 state_dict 를 받을 때 pretrained weight 없이 생성
+    criterion = create_criterion(criterion_name)
+    if criterion_name == 'f1' or criterion_name == 'label_smoothing':
+        criterion.classes = num_classes
+
+    policy = ValidationPolicy(**policy_kwargs)
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        epoch, state_dict, last_epoch = task
+        if model is None:
+            model = create_model_from_state_dict(model_name, state_dict, num_classes=num_classes)
+        else:
+            model.load_state_dict(state_dict)
+        results.put((epoch, policy(model, criterion, device, epoch, last_epoch)))
+
+
+class AsyncValidator:
+    '''
+    매 epoch 의 weight snapshot 을 validation worker process 로 보내
+    다음 epoch 학습과 동시에 validation 을 수행하는 클래스
+    - __init__
+        policy_kwargs : worker 에서 만들 ValidationPolicy 의 인자 (val_set, batch_size, subset_ratio, ...)
+        lag : validation 결과가 학습보다 최대 몇 epoch 늦어도 되는지 (0 이면 매 epoch 결과를 기다림)
+    - submit
+        현재 model 의 state_dict 를 cpu 로 복사하여 worker 에 전달합니다.
+        best.pth / last.pth 저장을 위해 결과가 도착할 때까지 snapshot 을 보관합니다.
+    - collect
+        도착한 결과를 (epoch, result, state_dict) 리스트로 epoch 순서대로 반환합니다.
+        lag 보다 많은 epoch 가 밀려 있으면 그만큼 결과를 기다립니다.
+    '''
+    def __init__(self, model_name, num_classes, criterion_name, policy_kwargs, lag=1, num_threads=2):
+        self.lag = lag
+        self.pending = {}
+
+        ctx = mp.get_context("spawn")
+        self.tasks = ctx.Queue()
+        self.results = ctx.Queue()
+        self.process = ctx.Process(
+            target=_validation_worker,
+            args=(self.tasks, self.results, model_name, num_classes, criterion_name,
+                  policy_kwargs, num_threads),
+        )
+        self.process.start()
+
+    def submit(self, epoch, model, last_epoch=False):
+        state_dict = {k: v.detach().cpu().clone() for k, v in model.state_dict().items()}
+        self.pending[epoch] = state_dict
+        self.tasks.put((epoch, state_dict, last_epoch))
+
+    def _get(self, block):
+        while True:
+            try:
+                epoch, result = self.results.get(block=block, timeout=5 if block else None)
+                return epoch, result, self.pending.pop(epoch)
+            except queue.Empty:
+                if not block:
+                    return None
+                if not self.process.is_alive():
+                    raise RuntimeError("validation worker exited unexpectedly")
+
+    def collect(self, wait_all=False):
+        ready = []
+        while self.pending:
+            item = self._get(block=wait_all or len(self.pending) > self.lag)
+            if item is None:
+                break
+            ready.append(item)
+        return ready
+
+    def close(self, timeout=30):
+        '''
+        worker 에 종료를 알리고, results 를 비우면서 종료를 기다립니다.
+        queue 에 넣은 item 이 소비되지 않으면 worker process 가 끝나지 않으므로 (early stopping 후 남은 결과) 버리면서 join 하고,
+        timeout 초 안에 끝나지 않으면 terminate 합니다.
+        '''
+        self.tasks.put(None)
+        deadline = time.time() + timeout
+        while self.process.is_alive() and time.time() < deadline:
+            try:
+                while True:
+                    self.results.get_nowait()
+            except queue.Empty:
+                pass
+            self.process.join(timeout=0.5)
+        if self.process.is_alive():
+            print(f"validation worker did not exit in {timeout}s, terminating")
+            self.process.terminate()
+            self.process.join()
+        self.pending.clear()